@@ -3,15 +3,14 @@
 ## Importing Libraries
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+# plotly is imported inside the chart functions so it only loads when charts are drawn
 
 
 ## Importing Custom Pipeline
-from pipeline.data_loader import load_data
-from pipeline.embedder import get_embedder
-from pipeline.vectorstore import build_vectorstore
-from pipeline.rag_chain import build_rag_chain_manual
-from pipeline.recall_categorizer import format_recall_for_display
+from pipeline import tracing
+from pipeline.service import create_service
+from pipeline.recall_categorizer import get_record
+from pipeline.analytics import CUBE_FILTER_FIELDS, filter_cube, summarize
 
 # Page frontend config 
 st.set_page_config(
@@ -67,118 +66,171 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-##Create visualizations from retrieved documents
-def create_visualizations_from_docs(source_docs, query_context=""):
-    
-    if not source_docs:
-        st.warning("No recall data found for visualization")
-        return
-    
-    # Extract data from documents
-    data = []
-    for doc in source_docs:
-        recall_data = format_recall_for_display(doc)
-        data.append({
-            'manufacturer': recall_data['manufacturer'],
-            'component': recall_data['component'],
-            'category': recall_data['category'],
-            'severity': recall_data['severity'],
-            'nhtsa_id': recall_data['nhtsa_id'],
-            'recall_date': recall_data.get('recall_date', 'Unknown')
-        })
-    
-    df = pd.DataFrame(data)
-    
-    # Convert date if possible
-    if 'recall_date' in df.columns:
-        try:
-            df['recall_date'] = pd.to_datetime(df['recall_date'], errors='coerce')
-        except:
-            pass
-    
-    st.markdown(f"## 📊 Visualizations for: {query_context}")
-    st.success(f"Found {len(df)} relevant recalls")
-    
-    # Create visualizations
+CHART_LAYOUT = dict(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', font_color='white')
+SEVERITY_COLORS = {'HIGH': '#ff4444', 'MEDIUM': '#ff9800', 'LOW': '#4caf50'}
+
+##Draw the recall charts from counts (pandas Series indexed by value, largest first)
+def render_charts(manufacturer_counts, severity_counts, category_counts, trend=None):
+    import plotly.express as px
+
     col1, col2 = st.columns(2)
-    
+
     with col1:
         # Manufacturer distribution
-        if len(df['manufacturer'].unique()) > 1:
-            manufacturer_counts = df['manufacturer'].value_counts()
+        if len(manufacturer_counts) > 1:
             fig_mfg = px.bar(
                 x=manufacturer_counts.values,
                 y=manufacturer_counts.index,
                 orientation='h',
-                title='Recalls by Manufacturer',
+                title='Recalls by Manufacturer (top 10)',
                 labels={'x': 'Number of Recalls', 'y': 'Manufacturer'},
                 template='plotly_dark',
                 color=manufacturer_counts.values,
                 color_continuous_scale='Viridis'
             )
-            fig_mfg.update_layout(
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                font_color='white',
-                showlegend=False
-            )
+            fig_mfg.update_layout(showlegend=False, **CHART_LAYOUT)
             st.plotly_chart(fig_mfg, use_container_width=True)
-    
+
     with col2:
         # Severity distribution
-        severity_counts = df['severity'].value_counts()
-        colors = {'HIGH': '#ff4444', 'MEDIUM': '#ff9800', 'LOW': '#4caf50'}
         fig_severity = px.pie(
             values=severity_counts.values,
             names=severity_counts.index,
             title='Recall Severity Distribution',
             template='plotly_dark',
             color=severity_counts.index,
-            color_discrete_map=colors
-        )
-        fig_severity.update_layout(
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            font_color='white'
+            color_discrete_map=SEVERITY_COLORS
         )
+        fig_severity.update_layout(**CHART_LAYOUT)
         st.plotly_chart(fig_severity, use_container_width=True)
-    
+
+    # Recall trend over time
+    if trend is not None and len(trend) > 1:
+        fig_trend = px.line(
+            x=trend.index.astype(str),
+            y=trend.values,
+            title='📈 Recalls Over Time',
+            labels={'x': 'Month', 'y': 'Number of Recalls'},
+            template='plotly_dark'
+        )
+        fig_trend.update_layout(**CHART_LAYOUT)
+        st.plotly_chart(fig_trend, use_container_width=True)
+
     # Component analysis
-    if len(df['category'].unique()) > 1:
-        component_counts = df['category'].value_counts().head(10)
+    if len(category_counts) > 1:
         fig_components = px.bar(
-            x=component_counts.index,
-            y=component_counts.values,
+            x=category_counts.index,
+            y=category_counts.values,
             title='🔧 Most Common Components',
             labels={'x': 'Component Category', 'y': 'Number of Recalls'},
             template='plotly_dark',
-            color=component_counts.values,
+            color=category_counts.values,
             color_continuous_scale='Plasma'
         )
-        fig_components.update_layout(
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            font_color='white',
-            showlegend=False,
-            xaxis_tickangle=-45
-        )
+        fig_components.update_layout(showlegend=False, xaxis_tickangle=-45, **CHART_LAYOUT)
         st.plotly_chart(fig_components, use_container_width=True)
 
+##Create visualizations from retrieved documents
+def create_visualizations_from_docs(source_docs, query_context=""):
+    if not source_docs:
+        st.warning("No recall data found for visualization")
+        return
+
+    # Read the typed records that travel with each document
+    records = [get_record(doc) for doc in source_docs]
+    df = pd.DataFrame.from_records(
+        [(r.manufacturer, r.category, r.severity) for r in records],
+        columns=['manufacturer', 'category', 'severity']
+    )
+
+    st.markdown(f"## 📊 Visualizations for: {query_context}")
+    st.caption("Charts cover the recalls retrieved for this question. "
+               "Ask for a chart, or name a manufacturer, component or report year, "
+               "for counts across the full database.")
+    st.success(f"Found {len(df)} relevant recalls")
+    render_charts(df['manufacturer'].value_counts().head(10), df['severity'].value_counts(),
+                  df['category'].value_counts().head(10))
+
+##Create visualizations from the pre-aggregated corpus-wide analytics cube
+def create_visualizations_from_cube(cube, constraints, query_context=""):
+    filtered = filter_cube(cube, constraints)
+    total = int(filtered['count'].sum())
+    if total == 0:
+        st.warning("No recall data found for visualization")
+        return
+
+    st.markdown(f"## 📊 Visualizations for: {query_context}")
+    filters = "; ".join(f"{field}: {', '.join(sorted(map(str, constraints[field])))}"
+                        for field in CUBE_FILTER_FIELDS if field in constraints)
+    ignored = [field for field in constraints if field not in CUBE_FILTER_FIELDS]
+    st.caption((f"Full database, filtered on {filters}" if filters else "Full database, all recalls")
+               + (f" ({', '.join(ignored)} not applied to the charts)" if ignored else ""))
+    st.success(f"Found {total} matching recalls across the full database")
+
+    trend = summarize(filtered, 'year_month').sort_index()
+    trend = trend[trend.index.astype(str) != 'Unknown']
+    render_charts(summarize(filtered, 'manufacturer', top=10), summarize(filtered, 'severity'),
+                  summarize(filtered, 'category', top=10), trend)
+
+##Database-wide charts when charts were asked for or the question names something to filter on;
+##charts shown automatically for other questions cover the retrieved recalls
+@tracing.timed("charts")
+def create_visualizations(cube, constraints, source_docs, query_context="", requested=False):
+    if cube is not None and (requested or any(field in constraints for field in CUBE_FILTER_FIELDS)):
+        create_visualizations_from_cube(cube, constraints, query_context)
+    else:
+        create_visualizations_from_docs(source_docs, query_context)
+
+@tracing.timed("render_answer")
+def render_answer_stream(answer_stream):
+    """Render the answer section progressively as tokens arrive"""
+    placeholder = st.empty()
+    placeholder.markdown('<div class="answer-section">...</div>', unsafe_allow_html=True)
+
+    answer = ""
+    for token in answer_stream:
+        answer += token
+        placeholder.markdown(f'<div class="answer-section">{answer}▌</div>', unsafe_allow_html=True)
+
+    answer = answer.strip() or "No answer generated."
+    placeholder.markdown(f'<div class="answer-section">{answer}</div>', unsafe_allow_html=True)
+    return answer
+
 def detect_chart_command(query):
     """Detect if the user wants to see charts/visualizations"""
     chart_keywords = [
         'chart', 'graph', 'plot', 'trend', 'visualization', 'stats', 'statistics',
         'show recalls', 'visualize', 'dashboard', 'analytics', 'data viz',
-        'over time', 'trends', 'analysis'
+        'over time', 'trends', 'analysis', 'compare', 'pattern'
     ]
     
     query_lower = query.lower()
     return any(keyword in query_lower for keyword in chart_keywords)
 
-def show_system_info():
+def show_system_info(rag_chain=None, document_count=None, models_ready=None):
     """Display system information in sidebar"""  
     st.sidebar.markdown("## System Info")
     st.sidebar.info("Using semantic search with embeddings for intelligent recall matching")
+    if document_count is not None:
+        st.sidebar.caption(f"{document_count} recall documents indexed")
+    if models_ready is False:
+        st.sidebar.warning("AI models are still loading, the first answer may take a moment")
+
+    # Query cache statistics
+    if rag_chain is not None and rag_chain.cache is not None:
+        cache_stats = rag_chain.cache.stats()
+        st.sidebar.markdown("## Query Cache")
+        col1, col2 = st.sidebar.columns(2)
+        col1.metric("Hit rate", f"{cache_stats['hit_rate']:.0%}")
+        col2.metric("Entries", f"{cache_stats['entries']}/{cache_stats['max_entries']}")
+        st.sidebar.caption(f"{cache_stats['hits']} hits, {cache_stats['misses']} misses")
+
+    if rag_chain is not None and rag_chain.semantic_cache is not None:
+        semantic_stats = rag_chain.semantic_cache.stats()
+        st.sidebar.caption(
+            f"Semantic cache: {semantic_stats['hits']} hits, {semantic_stats['misses']} misses "
+            f"(threshold {semantic_stats['threshold']:.2f})"
+        )
     
     # Add basic controls
     st.sidebar.markdown("## Options")
@@ -187,24 +239,49 @@ def show_system_info():
     
     return show_visualizations, max_results
 
+def show_debug_panel():
+    """Sidebar breakdown of the last query trace and per-stage latency (RECALL_TRACING=1)"""
+    if not tracing.enabled():
+        return
+
+    with st.sidebar.expander("Debug: query timings"):
+        traces = tracing.recent_traces()
+        if traces:
+            last = traces[-1]
+            st.caption(f"Last query: {last['duration_ms']:.0f} ms (trace {last['trace_id']})")
+            spans = pd.DataFrame(last["spans"]).drop(columns=["question", "question_hash", "question_chars"], errors="ignore")
+            st.dataframe(spans.sort_values("start_ms") if len(spans) else spans, hide_index=True)
+
+        stats = tracing.stage_stats()
+        if stats:
+            st.caption("All queries so far (p50/p95 are histogram bucket bounds)")
+            st.dataframe(pd.DataFrame.from_dict(stats, orient="index").round(1))
+        st.download_button("Prometheus metrics", tracing.prometheus_text(), file_name="metrics.txt")
+
 # Initialize RAG system
 @st.cache_resource
 def initialize_rag_system():
     with st.spinner("Initializing AI system..."):
-        docs = load_data()
-        embedder = get_embedder()
-        vectorstore = build_vectorstore(docs, embedder)
-        rag_chain = build_rag_chain_manual(vectorstore)
-        return rag_chain
+        # Models load in the background while the page renders
+        tracing.start_metrics_server()
+        return create_service(background_models=True)
 
 st.markdown('<div class="main-header"> Recall Recon</div>', unsafe_allow_html=True)
 st.markdown('<div class="subtitle">Ask intelligent questions about vehicle recalls using AI-powered semantic search</div>', unsafe_allow_html=True)
 
 
-rag_chain = initialize_rag_system()
+recall_service = initialize_rag_system()
+
 
+show_visualizations, max_results = show_system_info(
+    recall_service.chain, recall_service.document_count, recall_service.models_ready()
+)
 
-show_visualizations, max_results = show_system_info()
+# Swap in a rebuilt index without restarting; queries already running finish on the old one
+if st.sidebar.button("Reload index"):
+    with st.spinner("Loading the new index..."):
+        version = recall_service.reload_index()
+    st.sidebar.success(f"Switched to index version {version}")
 
 # User Input
 query = st.text_input(
@@ -217,72 +294,93 @@ query = st.text_input(
 # Check if user wants charts
 wants_charts = detect_chart_command(query) if query else False
 
-if query:
+##Recalls retrieved for a question, grouped by category for display
+@tracing.timed("group_records")
+def group_recalls(docs):
+    recall_groups = {}
+    for doc in docs:
+        recall_data = get_record(doc)
+        category = recall_data.category
+
+        if category not in recall_groups:
+            recall_groups[category] = []
+        # Near-duplicates folded in at retrieval (diversified mode) are listed on the card
+        recall_groups[category].append((recall_data, doc.metadata.get("duplicate_ids", [])))
+    return recall_groups
+
+@tracing.timed("render_recalls")
+def render_recall_groups(recall_groups):
+    for category, recalls in recall_groups.items():
+        has_high_severity = any(recall.severity == 'HIGH' for recall, _ in recalls)
+        expanded = len(recall_groups) == 1 or has_high_severity
+
+        with st.expander(f"{category} ({len(recalls)} recalls)", expanded=expanded):
+            for i, (recall, duplicate_ids) in enumerate(recalls):
+                severity_color = {
+                    'HIGH':'#ff4444',
+                    'MEDIUM': '#ff9800', 
+                    'LOW': '#4caf50'
+                }
+        
+                severity_emoji = {
+                    'HIGH': '🚨',
+                    'MEDIUM': '⚠️',
+                    'LOW': 'ℹ️'
+                }
+        
+                st.markdown(f"""
+                <div style="border-left: 4px solid {severity_color[recall.severity]}; padding-left: 1rem; margin: 1rem 0;">
+                    <div class="recall-details">
+                        <p>{severity_emoji[recall.severity]} <strong>Recall ID:</strong> <span class="recall-id">{recall.nhtsa_id}</span> 
+                        <span style="color: {severity_color[recall.severity]}; font-size: 0.8rem; font-weight: bold;">({recall.severity} RISK)</span></p>
+                        <p><strong>Manufacturer:</strong> <span class="manufacturer">{recall.manufacturer}</span></p>
+                        <p><strong>Component:</strong> <span class="component">{recall.component}</span></p>
+                        <p><strong>Summary:</strong> {recall.summary}</p>
+                        <p><strong>Corrective Action:</strong> {recall.action}</p>
+                    </div>
+                </div>
+                """, unsafe_allow_html=True)
+                if duplicate_ids:
+                    st.caption(f"Also issued as {', '.join(duplicate_ids)}")
+        
+                if i < len(recalls) - 1:
+                    st.markdown('<hr style="margin: 1rem 0; border-color: #444;">', unsafe_allow_html=True)
+
+def answer_query(query):
     with st.spinner("Searching NHTSA database..."):
-        rag_result = rag_chain({"question": query})
-        rag_answer = rag_result.get("answer", "No answer generated.")
+        rag_result = recall_service.stream(query)
         source_docs = rag_result.get("source_documents", [])
+        cache_info = rag_result.get("cache", {})
 
     # Answer section
     st.markdown("## AI Analysis")
-    st.markdown(f'<div class="answer-section">{rag_answer}</div>', unsafe_allow_html=True)
+    rag_answer = render_answer_stream(rag_result["answer_stream"])
+    if cache_info.get("hit"):
+        st.caption(f"Cached answer ({cache_info['layer']} match, similarity {cache_info['similarity']:.3f})")
+    elif cache_info:
+        st.caption(f"Fresh answer (closest past question similarity {cache_info['similarity']:.3f})")
 
     # Show visualizations if requested or enabled
     if wants_charts or show_visualizations:
-        create_visualizations_from_docs(source_docs, query)
+        create_visualizations(recall_service.analytics_cube, recall_service.parse_query(query), source_docs, query,
+                              requested=wants_charts)
 
     # Top Relevant Recalls section
     if source_docs:
         st.markdown("## Related Recalls")
-        
+    
         # Limit results based on user preference
         display_docs = source_docs[:max_results]
-        
-        # Process and group recalls by category
-        recall_groups = {}
-        
-        for doc in display_docs:
-            recall_data = format_recall_for_display(doc)
-            category = recall_data['category']
-            
-            if category not in recall_groups:
-                recall_groups[category] = []
-            recall_groups[category].append(recall_data)
-        
-        # Display each category
-        for category, recalls in recall_groups.items():
-            has_high_severity = any(recall['severity'] == 'HIGH' for recall in recalls)
-            expanded = len(recall_groups) == 1 or has_high_severity
-            
-            with st.expander(f"{category} ({len(recalls)} recalls)", expanded=expanded):
-                for i, recall in enumerate(recalls):
-                    severity_color = {
-                        'HIGH':'#ff4444',
-                        'MEDIUM': '#ff9800', 
-                        'LOW': '#4caf50'
-                    }
-                    
-                    severity_emoji = {
-                        'HIGH': '🚨',
-                        'MEDIUM': '⚠️',
-                        'LOW': 'ℹ️'
-                    }
-                    
-                    st.markdown(f"""
-                    <div style="border-left: 4px solid {severity_color[recall['severity']]}; padding-left: 1rem; margin: 1rem 0;">
-                        <div class="recall-details">
-                            <p>{severity_emoji[recall['severity']]} <strong>Recall ID:</strong> <span class="recall-id">{recall['nhtsa_id']}</span> 
-                            <span style="color: {severity_color[recall['severity']]}; font-size: 0.8rem; font-weight: bold;">({recall['severity']} RISK)</span></p>
-                            <p><strong>Manufacturer:</strong> <span class="manufacturer">{recall['manufacturer']}</span></p>
-                            <p><strong>Component:</strong> <span class="component">{recall['component']}</span></p>
-                            <p><strong>Summary:</strong> {recall['summary']}</p>
-                            <p><strong>Corrective Action:</strong> {recall['action']}</p>
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    if i < len(recalls) - 1:
-                        st.markdown('<hr style="margin: 1rem 0; border-color: #444;">', unsafe_allow_html=True)
+    
+        # Process and group recalls by category, then display each category
+        render_recall_groups(group_recalls(display_docs))
+
+if query:
+    with tracing.trace("page_query", question=query):
+        answer_query(query)
+
+# Timings of the query above, once its trace has finished
+show_debug_panel()
 
 # Example queries section
 if not query:
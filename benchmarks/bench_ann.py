@@ -0,0 +1,98 @@
+# benchmarks/bench_ann.py
+# Recall@k and single-query latency of the ANN index types against the exact flat index.
+# Usage: python -m benchmarks.bench_ann [--rows N] [--dim N] [--queries N] [--k N]
+#        [--nprobe 8,16,32] [--refine none,sq8,flat] [--ef-search 32,64,128] [--json]
+# Without --vectors the corpus is a synthetic gaussian mixture (clustered like real
+# sentence embeddings); --vectors takes an .npy of real embeddings instead.
+import argparse
+import json
+import time
+
+import numpy as np
+
+from pipeline.ann_index import build_ann_index, configure_search
+
+
+def clustered_vectors(n, dim, clusters=200, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall_at_k(found, truth):
+    """Fraction of the exact top-k that the approximate search returned"""
+    k = truth.shape[1]
+    return np.mean([len(set(f[f != -1]) & set(t)) / k for f, t in zip(found, truth)])
+
+
+def time_queries(index, queries, k):
+    """Search one query at a time like the service does; returns (positions, latencies in ms)"""
+    positions = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, positions[i] = index.search(query[None, :], k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return positions, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--vectors", help=".npy file of embeddings to index instead of synthetic ones")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", default="4,8,16,32,64")
+    parser.add_argument("--refine", default="none,sq8,flat", help="IVF-PQ re-rank types to compare")
+    parser.add_argument("--ef-search", default="16,32,64,128,256")
+    parser.add_argument("--json", action="store_true", help="print one JSON line per setting")
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    else:
+        vectors = clustered_vectors(args.rows + args.queries, args.dim)
+    # Held-out queries so no query is its own nearest neighbour
+    queries, vectors = vectors[:args.queries], vectors[args.queries:]
+
+    results = []
+    flat = build_ann_index(vectors, "flat")
+    truth, latencies = time_queries(flat, queries, args.k)
+    results.append({"index": "flat", "param": "", "build_s": 0.0, "recall": 1.0,
+                    "p50_ms": np.percentile(latencies, 50), "p99_ms": np.percentile(latencies, 99)})
+
+    sweeps = [
+        ("ivfpq", refine, "nprobe", [int(v) for v in args.nprobe.split(",")]) for refine in args.refine.split(",")
+    ]
+    sweeps.append(("hnsw", None, "efSearch", [int(v) for v in args.ef_search.split(",")]))
+    for index_type, refine, param, values in sweeps:
+        start = time.perf_counter()
+        index = build_ann_index(vectors, index_type, refine=refine)
+        build_s = time.perf_counter() - start
+        name = index_type if refine in (None, "none") else f"{index_type}+{refine}"
+        for value in values:
+            if param == "nprobe":
+                configure_search(index, nprobe=value)
+            else:
+                configure_search(index, ef_search=value)
+            found, latencies = time_queries(index, queries, args.k)
+            results.append({"index": name, "param": f"{param}={value}", "build_s": build_s,
+                            "recall": recall_at_k(found, truth),
+                            "p50_ms": np.percentile(latencies, 50), "p99_ms": np.percentile(latencies, 99)})
+
+    if args.json:
+        for result in results:
+            print(json.dumps({key: float(v) if isinstance(v, np.floating) else v for key, v in result.items()}))
+        return
+    print(f"{len(vectors)} vectors, {vectors.shape[1]} dims, {len(queries)} queries, k={args.k}")
+    print(f"  {'index':<10} {'setting':<14} {'build':>8} {'recall@k':>9} {'p50':>9} {'p99':>9}")
+    for r in results:
+        print(f"  {r['index']:<10} {r['param']:<14} {r['build_s']:7.1f}s {r['recall']:9.3f} "
+              f"{r['p50_ms']:7.3f}ms {r['p99_ms']:7.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
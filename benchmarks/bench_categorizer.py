@@ -0,0 +1,52 @@
+# benchmarks/bench_categorizer.py
+# Compare per-row categorize_recall/get_recall_severity with the compiled, vectorized rules.
+# Usage: python -m benchmarks.bench_categorizer [--rows 100000]
+import argparse
+import time
+
+from benchmarks.synthetic import make_recalls_frame
+from pipeline.recall_categorizer import (
+    categorize_recall, categorize_series, get_recall_severity, severity_series
+)
+
+# Component names that exercise every branch of the rule table
+EXTRA_COMPONENTS = [
+    "VISIBILITY:WINDSHIELD WIPER/WASHER:MOTOR", "VISIBILITY:WINDSHIELD WIPER/WASHER:LINKAGES",
+    "VISIBILITY:WINDSHIELD DEFROSTER/DEFOGGER", "VISIBILITY:WINDSHIELD", "WIPER ARM", "WIPER BLADE",
+    "SEAT BELTS:FRONT:RETRACTORS", "SEAT BELTS:ANCHORAGE", "SEAT BELTS", "ENGINE AND ENGINE COOLING",
+    "ENGINE:OIL PUMP", "SERVICE BRAKES, HYDRAULIC:PADS", "BRAKES:FLUID", "BRAKE HOSE", "TIRES",
+    "VEHICLE SPEED CONTROL", "AUTO  LATCHES/LOCKS", "CAR", "AIR BAGS", "STEERING:WHEEL", "GEAR SHIFT",
+    "SUSPENSION:REAR:SHOCK ABSORBER", "FUEL SYSTEM, GASOLINE:STORAGE:TANK ASSEMBLY", "Unknown",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    df = make_recalls_frame(args.rows)
+    df.loc[::7, "component"] = [EXTRA_COMPONENTS[i % len(EXTRA_COMPONENTS)]
+                                for i in range(len(df.loc[::7]))]
+    df.loc[::11, "defect_summary"] = "The seat belt PRETENSIONER may not deploy."
+
+    start = time.perf_counter()
+    expected_category = [categorize_recall(c, s) for c, s in zip(df["component"], df["defect_summary"])]
+    expected_severity = [get_recall_severity(s, c) for c, s in zip(df["component"], df["defect_summary"])]
+    baseline_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    category = categorize_series(df["component"], df["defect_summary"])
+    severity = severity_series(df["defect_summary"])
+    compiled_time = time.perf_counter() - start
+
+    assert list(category) == expected_category
+    assert list(severity) == expected_severity
+
+    print(f"rows: {args.rows}")
+    print(f"per-row keyword scans: {baseline_time:.3f}s")
+    print(f"compiled vectorized:   {compiled_time:.3f}s ({baseline_time / compiled_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
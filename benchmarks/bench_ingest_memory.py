@@ -0,0 +1,64 @@
+# benchmarks/bench_ingest_memory.py
+# Peak memory of building the index from a CSV: whole-file load_data + build_vectorstore
+# against streaming build_vectorstore_from_csv.
+# Usage: python -m benchmarks.bench_ingest_memory [--rows N] [--chunksize N] [--dim N]
+# Each mode runs in a fresh process so ru_maxrss is that mode's own peak.
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import tempfile
+import time
+
+from benchmarks.synthetic import HashEmbeddings, write_recalls_csv
+
+
+def _build(mode, data_path, persist_path, chunksize, dim, queue):
+    from pipeline.data_loader import load_data
+    from pipeline.vectorstore import build_vectorstore, build_vectorstore_from_csv
+
+    start = time.perf_counter()
+    embedder = HashEmbeddings(dim)
+    if mode == "streaming":
+        vectorstore = build_vectorstore_from_csv(data_path, embedder, persist_path, chunksize=chunksize)
+    else:
+        vectorstore = build_vectorstore(load_data(data_path), embedder, persist_path)
+    # ru_maxrss is in KB on Linux
+    queue.put({"seconds": time.perf_counter() - start, "documents": vectorstore.index.ntotal,
+               "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+
+
+def measure(mode, data_path, persist_path, chunksize, dim):
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_build, args=(mode, data_path, persist_path, chunksize, dim, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--chunksize", type=int, default=10_000)
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = write_recalls_csv(os.path.join(tmp, "recalls.csv"), args.rows)
+        csv_mb = os.path.getsize(data_path) / 2 ** 20
+        vectors_mb = args.rows * args.dim * 4 / 2 ** 20
+
+        results = {}
+        for mode in ["in-memory", "streaming"]:
+            results[mode] = measure(mode, data_path, os.path.join(tmp, mode), args.chunksize, args.dim)
+
+    print(f"{args.rows} recalls ({csv_mb:.0f}MB CSV, {vectors_mb:.0f}MB of vectors), chunksize {args.chunksize}")
+    print(f"  {'mode':<10} {'peak RSS':>10} {'time':>8}")
+    for mode, result in results.items():
+        print(f"  {mode:<10} {result['peak_rss_mb']:8.0f}MB {result['seconds']:7.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_llm_batching.py
+# Throughput of the local CPU LLM at different generate batch sizes.
+# Usage: python -m benchmarks.bench_llm_batching [--prompts N] [--batch-sizes 1,4,16]
+#        [--model ID_OR_PATH] [--no-quantize] [--via-batcher] [--json]
+# --via-batcher submits prompts from that many threads through the micro-batcher
+# instead of calling generate_batch directly, which is what the service does.
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.synthetic import make_recalls_frame
+
+
+def make_prompts(n):
+    """Realistic prompts: synthetic recalls packed the same way the chain packs them"""
+    from pipeline.data_loader import build_documents
+    from pipeline.rag_chain import build_prompt
+
+    docs = build_documents(make_recalls_frame(n * 5).fillna("Unknown"))
+    questions = ["What are the risks of this defect?", "How will dealers fix it?",
+                 "Which vehicles are affected?", "Is it safe to drive?"]
+    return [build_prompt(questions[i % len(questions)], docs[i * 5:(i + 1) * 5]) for i in range(n)]
+
+
+def run_direct(llm, prompts, batch_size):
+    latencies = []
+    for start in range(0, len(prompts), batch_size):
+        batch_start = time.perf_counter()
+        llm.generate_batch(prompts[start:start + batch_size])
+        latencies.append(time.perf_counter() - batch_start)
+    return latencies
+
+
+def run_batcher(llm, prompts, batch_size):
+    """batch_size concurrent callers each asking one question at a time"""
+    def ask(prompt):
+        start = time.perf_counter()
+        llm(prompt)
+        return time.perf_counter() - start
+
+    llm.batcher.max_batch_size = batch_size
+    with ThreadPoolExecutor(max_workers=batch_size) as pool:
+        return list(pool.map(ask, prompts))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts", type=int, default=32)
+    parser.add_argument("--batch-sizes", default="1,4,16")
+    parser.add_argument("--model", default=None, help="model id or local directory")
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument("--via-batcher", action="store_true")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    from pipeline.llm_loader import LOCAL_MODEL_ID, LocalLLM, load_local_model
+
+    model_id = args.model or LOCAL_MODEL_ID
+    start = time.perf_counter()
+    llm = LocalLLM(*load_local_model(model_id, quantize=not args.no_quantize))
+    load_s = time.perf_counter() - start
+
+    prompts = make_prompts(args.prompts)
+    # Warm up so the first batch does not pay for lazy initialisation
+    llm.generate_batch(prompts[:1])
+
+    results = []
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        start = time.perf_counter()
+        if args.via_batcher:
+            latencies = run_batcher(llm, prompts, batch_size)
+        else:
+            latencies = run_direct(llm, prompts, batch_size)
+        elapsed = time.perf_counter() - start
+        results.append({"batch_size": batch_size, "prompts_per_s": len(prompts) / elapsed,
+                        "p50_s": float(np.percentile(latencies, 50)),
+                        "p99_s": float(np.percentile(latencies, 99))})
+
+    if args.json:
+        for result in results:
+            print(json.dumps({"model": model_id, "int8": not args.no_quantize, **result}))
+        return
+    mode = "micro-batcher" if args.via_batcher else "generate_batch"
+    print(f"{model_id} (int8: {not args.no_quantize}), {len(prompts)} prompts via {mode}, load {load_s:.1f}s")
+    print(f"  {'batch':>5} {'prompts/s':>10} {'p50':>8} {'p99':>8}")
+    for r in results:
+        print(f"  {r['batch_size']:>5} {r['prompts_per_s']:10.2f} {r['p50_s']:7.2f}s {r['p99_s']:7.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# benchmarks/bench_retrieval.py
+# Retrieval quality and latency on a labeled query set, with the LLM stubbed out.
+# Usage: python -m benchmarks.bench_retrieval [--rows N | --data CSV] [--golden JSONL]
+#        [--k 5] [--embedder model|hash] [--no-hybrid] [--no-filter] [--rerank] [--diversify]
+#        [--output results.json]
+# Without --golden, labeled queries are generated from the CSV: NHTSA id lookups,
+# manufacturer + component questions and manufacturer + defect questions, each
+# labeled with every recall that matches. --save-golden writes them out so a
+# fixed set can be reused across runs. Results are written as JSON for comparison.
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import HashEmbeddings, write_recalls_csv
+
+# Stages timed by pipeline.tracing spans inside one chain call
+STAGES = ["id_lookup", "embed_query", "metadata_filter", "vector_search", "keyword_search",
+          "diversify", "docstore_fetch", "rerank", "prompt", "llm"]
+SEARCH_STAGES = ["metadata_filter", "vector_search", "keyword_search", "diversify", "docstore_fetch", "rerank"]
+
+
+def short_manufacturer(name):
+    """'Honda (American Honda Motor Co.)' -> 'Honda', the way people type it"""
+    return name.split(" (")[0].split(",")[0]
+
+
+def make_golden_queries(df, per_type=50, seed=0):
+    """Labeled queries generated from a recall frame: {"type", "question", "relevant"}"""
+    rng = np.random.default_rng(seed)
+    df = df.astype({"nhtsa_id": str})
+    queries = []
+
+    for nhtsa_id in rng.choice(df["nhtsa_id"].unique(), min(per_type, df["nhtsa_id"].nunique()), replace=False):
+        queries.append({"type": "id_lookup", "question": f"What is recall {nhtsa_id} about?",
+                        "relevant": [nhtsa_id]})
+
+    groups = df.groupby(["manufacturer", "component"])["nhtsa_id"].apply(list)
+    for position in rng.choice(len(groups), min(per_type, len(groups)), replace=False):
+        (manufacturer, component), ids = groups.index[position], groups.iloc[position]
+        queries.append({"type": "manufacturer_component",
+                        "question": f"{short_manufacturer(manufacturer)} {component.lower()} recalls",
+                        "relevant": ids})
+
+    groups = df.groupby(["manufacturer", "subject"])["nhtsa_id"].apply(list)
+    for position in rng.choice(len(groups), min(per_type, len(groups)), replace=False):
+        (manufacturer, subject), ids = groups.index[position], groups.iloc[position]
+        queries.append({"type": "manufacturer_defect",
+                        "question": f"{short_manufacturer(manufacturer)}: {subject.rstrip('.').lower()}",
+                        "relevant": ids})
+    return queries
+
+
+def recall_at_k(retrieved, relevant, k):
+    """Share of the relevant recalls found, out of the most that k results could hold"""
+    return len(set(retrieved[:k]) & set(relevant)) / min(len(relevant), k)
+
+
+def reciprocal_rank(retrieved, relevant):
+    relevant = set(relevant)
+    for rank, doc_id in enumerate(retrieved, start=1):
+        if doc_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return {"p50_ms": None, "p95_ms": None, "mean_ms": None}
+    return {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95)),
+            "mean_ms": float(values.mean())}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_queries(chain, queries, k):
+    """Run every query through the chain and collect quality and per-stage timings"""
+    from pipeline import tracing
+
+    results = []
+    for query in queries:
+        # The pipeline logs every step; keep the benchmark output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = chain({"question": query["question"]})
+        trace = tracing.recent_traces()[-1]
+        stages = {}
+        for span in trace["spans"]:
+            stages[span["name"]] = stages.get(span["name"], 0.0) + span["duration_ms"]
+
+        retrieved = [doc.metadata.get("nhtsa_id") for doc in result["source_documents"]]
+        results.append({
+            **query,
+            "retrieved": retrieved,
+            "recall_at_k": recall_at_k(retrieved, query["relevant"], k),
+            "reciprocal_rank": reciprocal_rank(retrieved, query["relevant"]),
+            "stages_ms": stages,
+            "search_ms": sum(stages.get(stage, 0.0) for stage in SEARCH_STAGES),
+            "total_ms": trace["duration_ms"],
+        })
+    return results
+
+
+def summarize(results):
+    summary = {
+        "queries": len(results),
+        "recall_at_k": float(np.mean([r["recall_at_k"] for r in results])),
+        "mrr": float(np.mean([r["reciprocal_rank"] for r in results])),
+        "search": percentiles([r["search_ms"] for r in results]),
+        "end_to_end": percentiles([r["total_ms"] for r in results]),
+    }
+    for stage in STAGES:
+        timings = [r["stages_ms"][stage] for r in results if stage in r["stages_ms"]]
+        if timings:
+            summary[stage] = percentiles(timings)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="recall CSV in the load_data schema (default: synthetic)")
+    parser.add_argument("--rows", type=int, default=5000, help="synthetic rows when --data is not given")
+    parser.add_argument("--golden", help="JSONL of {\"question\", \"relevant\": [ids], \"type\"}")
+    parser.add_argument("--save-golden", help="write the generated queries to this JSONL file")
+    parser.add_argument("--per-type", type=int, default=50, help="generated queries per type")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--embedder", choices=["model", "hash"], default="model",
+                        help="hash skips the model download; quality numbers are then meaningless")
+    parser.add_argument("--index-type", default=None, help="flat, ivfpq or hnsw")
+    parser.add_argument("--no-hybrid", action="store_true", help="vector search only, no BM25 fusion")
+    parser.add_argument("--no-filter", action="store_true", help="skip the metadata pre-filter")
+    parser.add_argument("--rerank", action="store_true",
+                        help="re-score RECALL_RERANK_FETCH_K candidates with the cross-encoder")
+    parser.add_argument("--diversify", action="store_true",
+                        help="collapse near-duplicates and pick by MMR from RECALL_DIVERSIFY_FETCH_K candidates")
+    parser.add_argument("--output", default="bench_retrieval.json")
+    args = parser.parse_args()
+
+    from pipeline import tracing
+    from pipeline.data_loader import load_data
+    from pipeline.diversify import Diversifier
+    from pipeline.embedder import get_embedder
+    from pipeline.keyword_index import load_keyword_index
+    from pipeline.metadata_index import MetadataIndex
+    from pipeline.rag_chain import RAGChain
+    from pipeline.reranker import CrossEncoderReranker
+    from pipeline.vectorstore import build_vectorstore
+
+    # Stage timings come from the tracing spans; the JSON trace log is not needed here
+    tracing.set_enabled(True)
+    tracing.TRACE_LOG = os.devnull
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = args.data or write_recalls_csv(os.path.join(tmp, "recalls.csv"), args.rows)
+        embedder = get_embedder(cache_path=None) if args.embedder == "model" else HashEmbeddings()
+
+        start = time.perf_counter()
+        docs = load_data(data_path)
+        vectorstore = build_vectorstore(docs, embedder, os.path.join(tmp, "index"), index_type=args.index_type)
+        keyword_index = None if args.no_hybrid else load_keyword_index(os.path.join(tmp, "index"))
+        metadata_index = None if args.no_filter else MetadataIndex.from_vectorstore(vectorstore)
+        reranker = None
+        if args.rerank:
+            # Wait for the model so the timed queries are not fallbacks while it loads
+            reranker = CrossEncoderReranker(top_k=args.k)
+            reranker.start_loading().result()
+        build_s = time.perf_counter() - start
+
+        if args.golden:
+            with open(args.golden) as f:
+                queries = [json.loads(line) for line in f if line.strip()]
+        else:
+            queries = make_golden_queries(pd.read_csv(data_path).fillna("Unknown"), args.per_type)
+        if args.save_golden:
+            with open(args.save_golden, "w") as f:
+                f.writelines(json.dumps(query) + "\n" for query in queries)
+
+        # No caches (every query retrieves) and a stub LLM (latency is retrieval + prompt only)
+        chain = RAGChain(vectorstore, lambda prompt: "stub answer", args.k, "stub",
+                         metadata_index=metadata_index, keyword_index=keyword_index, reranker=reranker,
+                         diversifier=Diversifier() if args.diversify else None)
+        results = run_queries(chain, queries, args.k)
+
+    by_type = {}
+    for result in results:
+        by_type.setdefault(result.get("type", "custom"), []).append(result)
+
+    report = {
+        "config": {"data": args.data or f"synthetic:{args.rows}", "documents": len(docs), "k": args.k,
+                   "embedder": args.embedder, "index_type": args.index_type, "hybrid": not args.no_hybrid,
+                   "metadata_filter": not args.no_filter,
+                   "rerank": reranker.stats() if reranker is not None else None,
+                   "diversify": args.diversify, "git": git_revision(), "timestamp": time.time()},
+        "build_s": build_s,
+        "summary": summarize(results),
+        "by_type": {name: summarize(rows) for name, rows in by_type.items()},
+        "queries": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{len(docs)} recalls, {len(results)} queries, k={args.k}, embedder={args.embedder}, "
+          f"index built in {build_s:.1f}s")
+    print(f"  {'query type':<24} {'n':>4} {'recall@k':>9} {'MRR':>6} {'embed p50':>10} {'search p50':>11} {'e2e p95':>9}")
+    for name, summary in [("all", report["summary"])] + sorted(report["by_type"].items()):
+        embed = summary.get("embed_query", {}).get("p50_ms")
+        embed = f"{embed:8.2f}ms" if embed is not None else f"{'-':>10}"
+        print(f"  {name:<24} {summary['queries']:>4} {summary['recall_at_k']:9.3f} {summary['mrr']:6.3f} "
+              f"{embed} {summary['search']['p50_ms']:9.2f}ms {summary['end_to_end']['p95_ms']:7.2f}ms")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
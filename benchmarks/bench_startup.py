@@ -0,0 +1,63 @@
+# benchmarks/bench_startup.py
+# Break down startup time per phase: import, data, embedder, index and LLM.
+# Usage: python -m benchmarks.bench_startup [--mode cold|warm] [--data PATH] [--persist-path PATH]
+# Run it in a fresh process each time so import timings are real.
+import argparse
+import importlib
+import json
+import time
+
+
+def phase(timings, name, fn):
+    start = time.perf_counter()
+    result = fn()
+    timings[name] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mode", choices=["cold", "warm"], default="warm",
+                        help="cold rebuilds from the CSV, warm opens the snapshot")
+    parser.add_argument("--data", default="data/vehicle_recalls_clean.csv")
+    parser.add_argument("--persist-path", default="recall_faiss_index")
+    parser.add_argument("--json", action="store_true", help="print timings as JSON")
+    args = parser.parse_args()
+
+    timings = {}
+    total_start = time.perf_counter()
+
+    service = phase(timings, "import", lambda: importlib.import_module("pipeline.service"))
+    from pipeline.metadata_index import MetadataIndex
+    from pipeline.snapshot import load_snapshot, save_snapshot
+
+    embedder = phase(timings, "embedder", service.get_embedder)
+
+    if args.mode == "warm":
+        timings["data"] = 0.0
+        snapshot = phase(timings, "index", lambda: load_snapshot(args.persist_path, embedder, args.data))
+        if snapshot is None:
+            raise SystemExit("No up-to-date snapshot, run once with --mode cold first")
+    else:
+        docs = phase(timings, "data", lambda: service.load_data(args.data))
+
+        def build_index():
+            vectorstore = service.build_vectorstore(docs, embedder, args.persist_path)
+            save_snapshot(vectorstore, MetadataIndex.from_vectorstore(vectorstore),
+                          args.persist_path, source_path=args.data)
+
+        phase(timings, "index", build_index)
+
+    phase(timings, "llm", service.get_llm)
+    timings["total"] = time.perf_counter() - total_start
+
+    if args.json:
+        print(json.dumps({"mode": args.mode, **timings}))
+        return
+    print(f"startup ({args.mode})")
+    for name in ["import", "data", "embedder", "index", "llm", "total"]:
+        print(f"  {name:<9} {timings[name]:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
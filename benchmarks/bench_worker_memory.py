@@ -0,0 +1,106 @@
+# benchmarks/bench_worker_memory.py
+# Per-worker memory of N serving processes opening the same index.
+# Compares the memory-mapped flat store with a pickled FAISS.load_local copy.
+# Usage: python -m benchmarks.bench_worker_memory [--rows N] [--workers N] [--dim N]
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.synthetic import make_recalls_frame
+
+
+class RandomEmbeddings(Embeddings):
+    """Deterministic random vectors so the benchmark needs no model download"""
+
+    def __init__(self, dim):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        rng = np.random.default_rng(len(texts))
+        return rng.standard_normal((len(texts), self.dim), dtype=np.float32).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def memory_status():
+    """Private (RssAnon) and file-backed (RssFile) resident memory in MB, Linux only"""
+    status = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("RssAnon", "RssFile"):
+                status[key] = int(value.split()[0]) / 1024
+    return status
+
+
+def _worker(mode, path, dim, queue):
+    before = memory_status()
+    embedder = RandomEmbeddings(dim)
+    if mode == "mmap":
+        from pipeline.snapshot import open_flat_store
+        vectorstore = open_flat_store(path, embedder)
+    else:
+        from langchain.vectorstores import FAISS
+        vectorstore = FAISS.load_local(path, embedder, allow_dangerous_deserialization=True)
+
+    # Touch the whole index and a spread of documents like a busy worker would
+    queries = np.random.default_rng(os.getpid()).standard_normal((32, dim)).astype(np.float32)
+    vectorstore.index.search(queries, 10)
+    for row in range(0, vectorstore.index.ntotal, max(1, vectorstore.index.ntotal // 200)):
+        vectorstore.docstore.search(vectorstore.index_to_docstore_id[row])
+
+    after = memory_status()
+    queue.put({key: after[key] - before[key] for key in after})
+
+
+def measure(mode, path, dim, workers):
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(mode, path, dim, queue)) for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    results = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+
+    from langchain.vectorstores import FAISS
+    from pipeline.data_loader import build_documents
+    from pipeline.snapshot import save_flat_store
+    from pipeline.vectorstore import document_ids
+
+    docs = build_documents(make_recalls_frame(args.rows).fillna("Unknown"))
+    embedder = RandomEmbeddings(args.dim)
+    vectorstore = FAISS.from_documents(docs, embedder, ids=document_ids(docs))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mmap_path = os.path.join(tmp, "mmap")
+        pickle_path = os.path.join(tmp, "pickle")
+        save_flat_store(vectorstore, mmap_path).publish()
+        vectorstore.save_local(pickle_path)
+        del vectorstore
+
+        print(f"{args.rows} recalls, {args.dim}-dim vectors, {args.workers} workers")
+        print(f"  {'mode':<8} {'RssAnon/worker':>15} {'RssFile/worker':>15} {'RssAnon total':>14}")
+        for mode, path in [("pickle", pickle_path), ("mmap", mmap_path)]:
+            results = measure(mode, path, args.dim, args.workers)
+            anon = [r["RssAnon"] for r in results]
+            shared = [r["RssFile"] for r in results]
+            print(f"  {mode:<8} {np.mean(anon):13.1f}MB {np.mean(shared):13.1f}MB {np.sum(anon):12.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/synthetic.py
+import hashlib
+
+import numpy as np
+import pandas as pd
+from langchain_core.embeddings import Embeddings
+
+
+MANUFACTURERS = [
+    "Ford Motor Company", "Toyota Motor Engineering & Manufacturing", "Honda (American Honda Motor Co.)",
+    "General Motors, LLC", "Chrysler (FCA US, LLC)", "Nissan North America, Inc.",
+    "Hyundai Motor America", "Kia America, Inc.", "Tesla, Inc.", "Subaru of America, Inc."
+]
+
+COMPONENTS = [
+    "SERVICE BRAKES, HYDRAULIC", "ENGINE AND ENGINE COOLING", "AIR BAGS", "SEAT BELTS",
+    "ELECTRICAL SYSTEM", "FUEL SYSTEM, GASOLINE", "STEERING", "POWER TRAIN",
+    "VISIBILITY:WINDSHIELD WIPER/WASHER", "SUSPENSION", "TIRES", "BACK OVER PREVENTION"
+]
+
+DEFECTS = [
+    "The brake hose may crack, causing a brake fluid leak.",
+    "The engine may stall while driving, increasing the risk of a crash.",
+    "The air bag inflator may rupture during deployment, which can cause injury.",
+    "The seat belt pretensioner may not deploy as intended.",
+    "A short circuit in the wiring harness may cause a fire.",
+    "The fuel pump may fail, resulting in a fuel leak.",
+    "The windshield wiper motor may malfunction, reducing visibility.",
+    "The rearview camera image may not display."
+]
+
+
+def make_recalls_frame(n_rows, seed=0):
+    """Synthetic recall DataFrame with the columns load_data expects"""
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(0, 3650, n_rows), unit="D")
+    # Unique ids in the NHTSA campaign format, e.g. 15V123000
+    ids = [f"{15 + i // 1_000_000 % 10}V{i % 1000:03d}{i // 1000 % 1000:03d}" for i in range(n_rows)]
+    defects = rng.choice(DEFECTS, n_rows)
+
+    return pd.DataFrame({
+        "nhtsa_id": ids,
+        "report_received_date": dates.strftime("%Y-%m-%d"),
+        "manufacturer": rng.choice(MANUFACTURERS, n_rows),
+        "component": rng.choice(COMPONENTS, n_rows),
+        "subject": [d.split(",")[0] for d in defects],
+        "defect_summary": defects,
+        "consequence_summary": rng.choice(["Increased risk of crash.", "Increased risk of injury.",
+                                           "Increased risk of fire."], n_rows),
+        "corrective_action": rng.choice(["Dealers will replace the part, free of charge.",
+                                         "Dealers will update the software, free of charge."], n_rows),
+        "potentially_affected": rng.integers(1, 500000, n_rows),
+        "recall_type": rng.choice(["Vehicle", "Equipment", "Tire"], n_rows),
+        "do_not_drive": rng.choice(["No", "Yes"], n_rows, p=[0.97, 0.03]),
+        "fire_risk_when_parked": rng.choice(["No", "Yes"], n_rows, p=[0.95, 0.05]),
+        "year": dates.year,
+        "year_month": dates.strftime("%Y-%m"),
+    })
+
+
+def write_recalls_csv(path, n_rows, seed=0):
+    """Write a synthetic recall CSV in the schema of vehicle_recalls_clean.csv"""
+    make_recalls_frame(n_rows, seed).to_csv(path, index=False)
+    return path
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic stand-in for the sentence-transformer: each text gets a
+    random unit vector seeded by its hash. Retrieval quality is meaningless,
+    but the pipeline and its timings run without downloading a model.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
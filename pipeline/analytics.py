@@ -0,0 +1,73 @@
+# pipeline/analytics.py
+import os
+
+import pandas as pd
+
+from pipeline.metadata_index import normalize_value
+from pipeline.store_version import current_path
+
+ANALYTICS_CUBE_FILE = "analytics_cube.parquet"
+CUBE_DIMENSIONS = ["manufacturer", "component", "category", "severity", "year", "year_month"]
+# Parsed query constraints the cube can be filtered on
+CUBE_FILTER_FIELDS = ("manufacturer", "component", "year")
+
+
+def count_cube(docs):
+    """Recall counts per cube cell for a batch of documents (plain string columns)"""
+    frame = pd.DataFrame.from_records(
+        [tuple(str(doc.metadata.get(field, "Unknown")) for field in CUBE_DIMENSIONS) for doc in docs],
+        columns=CUBE_DIMENSIONS,
+    )
+    frame["year"] = [normalize_value("year", year) for year in frame["year"]]
+    return frame.groupby(CUBE_DIMENSIONS, sort=False).size().rename("count").reset_index()
+
+
+def merge_cubes(*counts):
+    """Add up count_cube results from several batches of documents"""
+    counts = [c for c in counts if c is not None]
+    return pd.concat(counts).groupby(CUBE_DIMENSIONS, sort=False)["count"].sum().reset_index()
+
+
+def finish_cube(counts):
+    for field in CUBE_DIMENSIONS:
+        counts[field] = counts[field].astype("category")
+    return counts
+
+
+def build_cube(docs):
+    """
+    Pre-aggregated recall counts over the full corpus, one row per
+    manufacturer x component x category x severity x year_month
+    """
+    return finish_cube(count_cube(docs))
+
+
+def save_cube(cube, persist_path):
+    cube.to_parquet(os.path.join(persist_path, ANALYTICS_CUBE_FILE), index=False)
+    return cube
+
+
+def save_analytics_cube(docs, persist_path):
+    return save_cube(build_cube(docs), persist_path)
+
+
+def load_analytics_cube(persist_path):
+    """Load the cube saved next to the FAISS index, if there is one"""
+    path = os.path.join(current_path(persist_path), ANALYTICS_CUBE_FILE)
+    return pd.read_parquet(path) if os.path.exists(path) else None
+
+
+def filter_cube(cube, constraints):
+    """Restrict the cube to the manufacturer/component/year constraints parsed from a query"""
+    mask = pd.Series(True, index=cube.index)
+    for field in CUBE_FILTER_FIELDS:
+        if field in constraints:
+            values = {normalize_value(field, value) for value in constraints[field]}
+            mask &= cube[field].isin(values)
+    return cube[mask]
+
+
+def summarize(cube, dimension, top=None):
+    """Recall counts per value of one dimension, largest first"""
+    counts = cube.groupby(dimension, observed=True)["count"].sum().sort_values(ascending=False)
+    return counts.head(top) if top else counts
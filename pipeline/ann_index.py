@@ -0,0 +1,239 @@
+# pipeline/ann_index.py
+# Approximate nearest neighbour index types for the recall vector store.
+# The index type and its search parameters come from the environment (.env):
+#   RECALL_INDEX_TYPE          flat (default, exact), ivfpq or hnsw
+#   RECALL_IVF_NLIST           IVF cells, 0 picks about 4 * sqrt(n)
+#   RECALL_IVF_NPROBE          IVF cells visited per query
+#   RECALL_PQ_M                PQ sub-quantizers, 0 picks dim / 8
+#   RECALL_IVF_REFINE          re-rank of IVF-PQ candidates: flat (default, exact vectors),
+#                              sq8 (8-bit vectors, a quarter of the memory) or none
+#   RECALL_REFINE_K_FACTOR     IVF-PQ candidates re-ranked per requested result (default 10)
+#   RECALL_HNSW_M              HNSW graph degree
+#   RECALL_HNSW_EF_CONSTRUCTION / RECALL_HNSW_EF_SEARCH
+import os
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INDEX_TYPES = ("flat", "ivfpq", "hnsw")
+INDEX_TYPE = os.getenv("RECALL_INDEX_TYPE", "flat").lower()
+
+IVF_NLIST = int(os.getenv("RECALL_IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("RECALL_IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("RECALL_PQ_M", "0"))
+PQ_NBITS = 8
+REFINE_TYPES = ("flat", "sq8", "none")
+IVF_REFINE = os.getenv("RECALL_IVF_REFINE", "flat").lower()
+REFINE_K_FACTOR = float(os.getenv("RECALL_REFINE_K_FACTOR", "10"))
+HNSW_M = int(os.getenv("RECALL_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("RECALL_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("RECALL_HNSW_EF_SEARCH", "64"))
+
+# k-means wants about 39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+# Training sample per centroid for chunked builds, a little over that minimum
+TRAIN_POINTS_PER_CENTROID = 50
+
+
+def check_index_type(index_type):
+    index_type = (index_type or INDEX_TYPE).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {', '.join(INDEX_TYPES)}")
+    return index_type
+
+
+def _pq_subquantizers(dim):
+    """Number of PQ sub-quantizers; it has to divide the vector dimension"""
+    if PQ_M and dim % PQ_M == 0:
+        return PQ_M
+    m = max(dim // 8, 1)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def _refined(index, dim, refine):
+    """
+    Wrap an IVF-PQ index so its candidates are re-scored against stored vectors.
+    PQ codes alone cap recall however many cells are probed.
+    """
+    refine = (refine or IVF_REFINE).lower()
+    if refine not in REFINE_TYPES:
+        raise ValueError(f"Unknown IVF refine type {refine!r}, expected one of {', '.join(REFINE_TYPES)}")
+    if refine == "none":
+        return index
+    if refine == "flat":
+        refined = faiss.IndexRefineFlat(index)
+    else:
+        refined = faiss.IndexRefine(index, faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit))
+    refined.k_factor = REFINE_K_FACTOR
+    return refined
+
+
+def new_ann_index(dim, n, index_type=None, nlist=None, refine=None):
+    """
+    Empty FAISS index of the given type for about n vectors of dimension dim.
+    Corpora too small to train IVF-PQ get the exact flat index.
+    refine picks the IVF-PQ re-rank (default: RECALL_IVF_REFINE).
+    """
+    index_type = check_index_type(index_type)
+    if index_type == "ivfpq":
+        nlist = nlist or IVF_NLIST or int(4 * np.sqrt(n))
+        nlist = min(nlist, n // MIN_POINTS_PER_CENTROID)
+        if n < MIN_POINTS_PER_CENTROID * 2 ** PQ_NBITS or nlist < 1:
+            print(f"{n} vectors are too few to train IVF-PQ, keeping the flat index")
+            return faiss.IndexFlatL2(dim)
+        m = _pq_subquantizers(dim)
+        print(f"IVF-PQ index: nlist={nlist}, m={m}, nbits={PQ_NBITS}, refine={refine or IVF_REFINE}")
+        return _refined(faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, m, PQ_NBITS), dim, refine)
+
+    if index_type == "hnsw":
+        print(f"Building HNSW index: M={HNSW_M}, efConstruction={HNSW_EF_CONSTRUCTION}")
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+    return faiss.IndexFlatL2(dim)
+
+
+def training_size(index):
+    """Vectors to train an index on before adding to it (0 when it needs no training)"""
+    if index.is_trained:
+        return 0
+    ivf = faiss.try_extract_index_ivf(index)
+    return max(ivf.nlist, 2 ** PQ_NBITS) * TRAIN_POINTS_PER_CENTROID
+
+
+def build_ann_index(vectors, index_type=None, nlist=None, refine=None):
+    """
+    Train (if needed) and fill a FAISS index of the given type with float32 vectors.
+    Rows keep their order, so row i of the result is vectors[i].
+    Corpora too small to train IVF-PQ keep the exact flat index.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    index = new_ann_index(dim, n, index_type, nlist, refine)
+    if not index.is_trained:
+        print(f"Training on {n} vectors")
+        index.train(vectors)
+    index.add(vectors)
+    configure_search(index)
+    return enable_reconstruct(index)
+
+
+class IndexBuilder:
+    """
+    Fills an index chunk by chunk for builds that never hold all vectors at once.
+    An index that needs training buffers the first training_size vectors, is
+    trained on them and then takes every later chunk directly, so memory is the
+    index itself plus, until training, that one sample.
+    expected_rows sizes the IVF cells (ignored by the other types).
+    """
+
+    def __init__(self, index_type=None, expected_rows=0, nlist=None):
+        self.index_type = check_index_type(index_type)
+        self.expected_rows = expected_rows
+        self.nlist = nlist
+        self.index = None
+        self._sample = None
+
+    def add(self, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.index is None:
+            self.index = new_ann_index(vectors.shape[1], self.expected_rows, self.index_type, self.nlist)
+            self._sample = [] if not self.index.is_trained else None
+        if self._sample is None:
+            self.index.add(vectors)
+            return
+        self._sample.append(vectors)
+        if sum(len(chunk) for chunk in self._sample) >= training_size(self.index):
+            self._train()
+
+    def _train(self):
+        sample = np.concatenate(self._sample)
+        self._sample = None
+        if len(sample) < MIN_POINTS_PER_CENTROID * 2 ** PQ_NBITS:
+            # Fewer rows arrived than expected_rows promised
+            print(f"{len(sample)} vectors are too few to train IVF-PQ, keeping the flat index")
+            self.index = faiss.IndexFlatL2(sample.shape[1])
+        else:
+            print(f"Training on the first {len(sample)} vectors")
+            self.index.train(sample)
+        self.index.add(sample)
+
+    def finish(self):
+        """The filled index, ready for search (None if nothing was added)"""
+        if self.index is None:
+            return None
+        if self._sample is not None:
+            self._train()
+        configure_search(self.index)
+        return enable_reconstruct(self.index)
+
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if faiss.try_extract_index_ivf(index) is not None:
+        return "ivfpq"
+    return "flat"
+
+
+def configure_search(index, nprobe=None, ef_search=None, k_factor=None):
+    """Apply the query-time knobs (nprobe and re-rank k_factor for IVF, efSearch for HNSW) to an index"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe or IVF_NPROBE, ivf.nlist)
+    if isinstance(index, faiss.IndexRefine):
+        index.k_factor = k_factor or REFINE_K_FACTOR
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search or HNSW_EF_SEARCH
+    return index
+
+
+def search_candidates(index, vector, k, candidate_positions):
+    """
+    Search only the given index rows. Approximate indexes can miss rows a filter
+    allows, so IVF probes every cell and HNSW scores the candidates exactly.
+    Returns (distances, positions) shaped like index.search.
+    """
+    candidate_positions = np.asarray(candidate_positions, dtype=np.int64)
+    k = min(k, len(candidate_positions))
+
+    if isinstance(index, faiss.IndexHNSW):
+        candidates = index.reconstruct_batch(candidate_positions)
+        distances = ((candidates - vector) ** 2).sum(axis=1)
+        top = np.argsort(distances, kind="stable")[:k]
+        return distances[top][None, :], candidate_positions[top][None, :]
+
+    selector = faiss.IDSelectorBatch(candidate_positions)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nlist)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    if isinstance(index, faiss.IndexRefine):
+        params = faiss.IndexRefineSearchParameters(k_factor=index.k_factor, base_index_params=params)
+    return index.search(vector, k, params=params)
+
+
+def enable_reconstruct(index):
+    """
+    Give IVF indexes the row -> list direct map reconstruct_rows needs. Done once
+    when an index is built or opened, before any query can reach it, so the
+    shared index is never mutated on the query path.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index
+
+
+def reconstruct_rows(index, positions):
+    """
+    Stored vectors for the given index rows (see enable_reconstruct for IVF);
+    IVF-PQ gives back its refine vectors, or the decoded PQ codes without a re-rank
+    """
+    return index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
@@ -0,0 +1,111 @@
+# pipeline/batch_qa.py
+# Answer a file of questions offline, e.g. one per manufacturer x component:
+#   python -m pipeline.batch_qa questions.jsonl answers.jsonl [--batch-size 64]
+# Each input line is a JSON object with a "question" and optionally an "id"
+# (default: the line number); any other fields are copied to the output.
+# The output file doubles as the checkpoint: rerunning the same command skips
+# every id already answered, so an interrupted run picks up where it stopped.
+import argparse
+import json
+import os
+import time
+
+from pipeline.llm_loader import MAX_BATCH_SIZE, uses_local_llm
+
+
+def read_questions(path):
+    records = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "question" not in record:
+                raise ValueError(f"{path}:{line_number} has no \"question\" field")
+            record["id"] = str(record.get("id", line_number))
+            records.append(record)
+    return records
+
+
+def load_checkpoint(path):
+    """
+    Ids already answered in the output file. A line cut off by a crash
+    mid-write is removed so the file stays valid JSONL.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            print(f"Dropping a partially written line at the end of {path}")
+            f.truncate(end)
+    return {json.loads(line)["id"] for line in data[:end].splitlines() if line.strip()}
+
+
+def answer_record(record, result):
+    """Output line for one question: the input fields plus answer and sources"""
+    return {
+        **record,
+        "answer": result["answer"],
+        "sources": [doc.metadata.get("nhtsa_id") for doc in result["source_documents"]],
+        "cache": result["cache"]["layer"],
+    }
+
+
+def run_batch_qa(rag_chain, input_path, output_path, batch_size=64, max_workers=None):
+    """
+    Answer every question in input_path not yet in output_path, appending as
+    batches finish. rag_chain is anything with answer_batch: a RAGChain or a RecallService.
+    """
+    if max_workers is None:
+        max_workers = MAX_BATCH_SIZE if uses_local_llm() else 4
+
+    records = read_questions(input_path)
+    done = load_checkpoint(output_path)
+    todo = [record for record in records if record["id"] not in done]
+    print(f"{len(records)} questions, {len(records) - len(todo)} already answered, {len(todo)} to go")
+
+    start = time.perf_counter()
+    answered = failed = 0
+    with open(output_path, "a") as out:
+        for batch_start in range(0, len(todo), batch_size):
+            batch = todo[batch_start:batch_start + batch_size]
+            results = rag_chain.answer_batch([record["question"] for record in batch], max_workers)
+            for record, result in zip(batch, results):
+                if result.get("error"):
+                    # Not written, so the next run retries it
+                    failed += 1
+                    continue
+                out.write(json.dumps(answer_record(record, result)) + "\n")
+                answered += 1
+            out.flush()
+            os.fsync(out.fileno())
+
+            elapsed = time.perf_counter() - start
+            print(f"Answered {answered}/{len(todo)} ({failed} failed), {answered / elapsed:.2f} questions/s")
+    return answered, failed
+
+
+if __name__ == "__main__":
+    from pipeline.service import create_service
+
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of recall questions")
+    parser.add_argument("input", help="JSONL file with one {\"question\": ...} per line")
+    parser.add_argument("output", help="JSONL file for answers, appended to and resumed from")
+    parser.add_argument("--data", default="data/vehicle_recalls_clean.csv")
+    parser.add_argument("--persist-path", default="recall_faiss_index")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="questions retrieved together and written per checkpoint")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="concurrent LLM calls (default 4, or a full micro-batch for the local LLM)")
+    args = parser.parse_args()
+
+    service = create_service(args.data, args.persist_path)
+    try:
+        # The service leases one index version per batch, so a reload mid-run is safe
+        _, failed = run_batch_qa(service, args.input, args.output, args.batch_size, args.workers)
+    finally:
+        service.close()
+    if failed:
+        raise SystemExit(f"{failed} questions failed, rerun to retry them")
@@ -0,0 +1,172 @@
+# pipeline/context_packer.py
+# Fits the retrieved recalls into the LLM input limit instead of pasting every
+# page_content in full and letting the model truncate it.
+import math
+import os
+import re
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+from pipeline.llm_loader import active_model_id, input_token_limit
+
+load_dotenv()
+
+# Whole prompt budget (instructions + question + context), RECALL_PROMPT_TOKENS in .env;
+# unset, it is the input limit of the model in use (see prompt_token_budget)
+PROMPT_TOKENS = int(os.getenv("RECALL_PROMPT_TOKENS", "0"))
+
+# Recalls whose text shares this fraction of word shingles are merged
+DUPLICATE_THRESHOLD = 0.9
+# Ids listed in a header's "also issued as" note before the rest are just counted
+MAX_LISTED_DUPLICATES = 5
+# A field is cut short rather than dropped if at least this many tokens still fit
+MIN_FIELD_TOKENS = 16
+
+# Labelled fields of the page_content template in data_loader.build_documents,
+# in default order of usefulness to the model
+FIELD_LABELS = ["Issue", "Summary", "Consequence", "Corrective Action", "Affected Vehicles", "Recall Type"]
+FIELD_PATTERN = re.compile(r"^\s*(" + "|".join(FIELD_LABELS) + r"): ", re.MULTILINE)
+
+# Question words that move a field ahead of the default order
+FIELD_HINTS = {
+    "Summary": {"what", "why", "defect", "problem", "issue", "cause", "wrong"},
+    "Consequence": {"risk", "danger", "dangerous", "consequence", "injury", "crash", "fire", "happen", "safe", "safety"},
+    "Corrective Action": {"fix", "fixed", "remedy", "repair", "action", "dealer", "dealers", "replace", "should"},
+    "Affected Vehicles": {"many", "affected", "vehicles", "units", "number"},
+    "Recall Type": {"year", "month", "when", "type"},
+}
+
+
+def prompt_token_budget():
+    """Tokens the whole prompt may use with the model that answers"""
+    return PROMPT_TOKENS or input_token_limit(active_model_id())
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """The answering LLM's tokenizer if it is installed and cached locally, else None"""
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(active_model_id(), local_files_only=True)
+    except Exception:
+        print("Tokenizer unavailable, estimating token counts")
+        return None
+
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    # SentencePiece averages about 1.3 tokens per English word
+    return math.ceil(len(re.findall(r"\w+|[^\w\s]", text)) * 1.3)
+
+
+def split_fields(page_content):
+    """Split a recall page_content into its header line and labelled fields"""
+    parts = FIELD_PATTERN.split(page_content)
+    header = " ".join(parts[0].split())
+    fields = {}
+    for label, value in zip(parts[1::2], parts[2::2]):
+        value = " ".join(value.split())
+        if value and value != "Unknown":
+            fields[label] = value
+    return header, fields
+
+
+def rank_fields(question):
+    """Field labels ordered by relevance to the question"""
+    words = set(re.findall(r"[a-z]+", question.lower()))
+    return sorted(FIELD_LABELS, key=lambda label: (
+        label != "Issue", -len(FIELD_HINTS.get(label, set()) & words), FIELD_LABELS.index(label)
+    ))
+
+
+def _shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def dedupe_recalls(recalls):
+    """
+    Merge recalls whose fields are near-identical (the same supplier defect filed
+    by several manufacturers). recalls is a list of (header, fields, nhtsa_id,
+    duplicate_ids), duplicate_ids being any already folded in at retrieval;
+    returns the kept ones with the ids of their merged duplicates.
+    """
+    kept = []
+    for header, fields, nhtsa_id, duplicate_ids in recalls:
+        shingles = _shingles(" ".join(fields.get(label, "") for label in FIELD_LABELS[:4]))
+        for other in kept:
+            overlap = len(shingles & other["shingles"]) / max(len(shingles | other["shingles"]), 1)
+            if overlap >= DUPLICATE_THRESHOLD:
+                other["duplicates"] += [nhtsa_id] + duplicate_ids
+                break
+        else:
+            kept.append({"header": header, "fields": fields, "shingles": shingles, "duplicates": list(duplicate_ids)})
+    return kept
+
+
+def _truncate(text, max_tokens):
+    """Cut text to about max_tokens on a word boundary"""
+    words = text.split()
+    keep = len(words) * max_tokens // max(count_tokens(text), 1)
+    while keep > 0 and count_tokens(" ".join(words[:keep]) + " ...") > max_tokens:
+        keep = keep * 9 // 10
+    return " ".join(words[:keep]) + " ..." if keep else ""
+
+
+def pack_context(question, retrieved_docs, max_tokens):
+    """
+    Build the context block within max_tokens. Every recall gets its header and
+    most relevant field before any recall gets a second field, so lower-ranked
+    recalls are not crowded out by the long summaries of the first ones.
+    """
+    recalls = dedupe_recalls([
+        split_fields(doc.page_content) + (doc.metadata.get("nhtsa_id", ""), doc.metadata.get("duplicate_ids", []))
+        for doc in retrieved_docs
+    ])
+    field_order = rank_fields(question)
+
+    blocks = [[] for _ in recalls]
+    used = 0
+    for round_number, label in enumerate(field_order):
+        for recall, block in zip(recalls, blocks):
+            if round_number == 0:
+                header = recall["header"]
+                duplicates = recall["duplicates"]
+                if len(duplicates) > MAX_LISTED_DUPLICATES:
+                    extra = len(duplicates) - MAX_LISTED_DUPLICATES
+                    header += f" (also issued as {', '.join(duplicates[:MAX_LISTED_DUPLICATES])} and {extra} more)"
+                elif duplicates:
+                    header += f" (also issued as {', '.join(duplicates)})"
+                cost = count_tokens(header)
+                if used + cost > max_tokens:
+                    break
+                block.append(header)
+                used += cost
+            elif not block:
+                continue
+
+            value = recall["fields"].get(label)
+            if value is None:
+                continue
+            line = f"{label}: {value}"
+            cost = count_tokens(line)
+            if used + cost > max_tokens:
+                if max_tokens - used < MIN_FIELD_TOKENS:
+                    continue
+                line = _truncate(line, max_tokens - used)
+                if not line:
+                    continue
+                cost = count_tokens(line)
+            block.append(line)
+            used += cost
+
+    context = "\n\n".join("\n".join(block) for block in blocks if block)
+    original = count_tokens("\n\n".join(doc.page_content for doc in retrieved_docs))
+    packed = count_tokens(context)
+    merged = sum(len(recall["duplicates"]) for recall in recalls)
+    print(f"Context packed: {sum(1 for block in blocks if block)}/{len(recalls)} recalls, "
+          f"{packed} tokens (saved {original - packed} of {original}, {merged} near-duplicates merged)")
+    return context
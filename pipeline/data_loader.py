@@ -1,56 +1,119 @@
 # pipeline/data_loader.py - Clean version without duplicated functions
 from langchain_core.documents import Document
 import pandas as pd
-import streamlit as st
-from pipeline.recall_categorizer import format_recall_date
+from pipeline.recall_categorizer import format_recall_date, categorize_series, severity_series, RecallRecord
 
 
+# Metadata fields copied as-is from the CSV columns
+METADATA_COLUMNS = [
+    "manufacturer", "component", "recall_type", "do_not_drive",
+    "fire_risk_when_parked", "year", "year_month"
+]
+
+
+def _text_column(df, column):
+    """Column rendered the same way an f-string renders each cell"""
+    return df[column].astype(str).astype(object)
+
+
+def format_date_column(raw_dates):
+    """
+    Format a whole column of recall dates at once.
+    Each distinct value is parsed a single time and mapped back onto the column,
+    so the output matches format_recall_date row by row.
+    """
+    raw_dates = raw_dates.astype(str)
+    formatted = {value: format_recall_date(value) for value in raw_dates.unique()}
+    return raw_dates.map(formatted).astype(object)
+
+
+def build_documents(df):
+    """
+    Build LangChain documents from a recall DataFrame column by column
+    instead of walking it with iterrows
+    """
+    if len(df) == 0:
+        return []
+
+    if 'report_received_date' in df.columns:
+        raw_date = df['report_received_date']
+        has_date = raw_date.notna()
+        recall_date = raw_date.astype(str).astype(object).where(has_date, 'Unknown')
+        formatted_date = format_date_column(raw_date).where(has_date, 'an unknown date')
+    else:
+        recall_date = pd.Series('Unknown', index=df.index, dtype=object)
+        formatted_date = pd.Series('an unknown date', index=df.index, dtype=object)
+
+    # Creating text to embedd into vectors (same template the row loop used)
+    indent = "\n            "
+    text = (
+        "[" + _text_column(df, 'manufacturer') + "] issued recall ID "
+        + _text_column(df, 'nhtsa_id') + " on             " + formatted_date
+        + " related to the " + _text_column(df, 'component') + " component.\n"
+        + indent + "Issue: " + _text_column(df, 'subject')
+        + indent + "Summary: " + _text_column(df, 'defect_summary')
+        + indent + "Consequence: " + _text_column(df, 'consequence_summary')
+        + indent + "Corrective Action: " + _text_column(df, 'corrective_action')
+        + indent + "Affected Vehicles: " + _text_column(df, 'potentially_affected')
+        + indent + "Recall Type: " + _text_column(df, 'recall_type')
+        + " | Year: " + _text_column(df, 'year')
+        + " | Month: " + _text_column(df, 'year_month')
+    )
+
+    # Creating metadata to help in retrieval, filtering, and UI rendering
+    columns = {
+        "nhtsa_id": _text_column(df, 'nhtsa_id').tolist(),
+        "recall_date": recall_date.tolist(),
+    }
+    for column in METADATA_COLUMNS:
+        columns[column] = df[column].tolist()
+
+    # Category and severity are computed once here instead of on every render
+    columns["category"] = categorize_series(df['component'], df['defect_summary']).tolist()
+    columns["severity"] = severity_series(df['defect_summary']).tolist()
+
+    keys = ["nhtsa_id", "manufacturer", "component", "recall_date", "recall_type",
+            "do_not_drive", "fire_risk_when_parked", "year", "year_month",
+            "category", "severity"]
+    rows = zip(*(columns[key] for key in keys))
+
+    # Typed display record built once per recall, so the UI never re-parses page_content
+    records = map(RecallRecord._make, zip(
+        columns["nhtsa_id"],
+        _text_column(df, 'manufacturer').tolist(),
+        _text_column(df, 'component').tolist(),
+        _text_column(df, 'defect_summary').str.strip().tolist(),
+        _text_column(df, 'consequence_summary').str.strip().tolist(),
+        _text_column(df, 'corrective_action').str.strip().tolist(),
+        columns["category"],
+        columns["severity"],
+        columns["recall_date"],
+        format_date_column(recall_date).tolist(),
+    ))
+
+    # Wraps text and metadata into LangChain Documents
+    return [
+        Document(page_content=content, metadata={**dict(zip(keys, values)), "record": record})
+        for content, values, record in zip(text.tolist(), rows, records)
+    ]
+
 
-@st.cache_data(show_spinner="Loading and preparing recall documents...")
 def load_data(path="data/vehicle_recalls_clean.csv"):
     """Load CSV data and convert to LangChain documents"""
     df = pd.read_csv(path)
     df = df.fillna("Unknown")
 
-    documents = []
-    for _, row in df.iterrows():
-        # Include date information if available
-        # date_info = ""
-        raw_date = row.get('report_received_date', None)
-        if pd.notna(raw_date):
-            formatted_date = format_recall_date(str(raw_date))
-            # date_info = f"Recall Date: {formatted_date}\n"
-        
-        # Creating text to embedd into vectors
-        text = f"""[{row['manufacturer']}] issued recall ID {row['nhtsa_id']} on \
-            {formatted_date if pd.notna(raw_date) else 'an unknown date'} related to the {row['component']} component.
-
-            Issue: {row['subject']}
-            Summary: {row['defect_summary']}
-            Consequence: {row['consequence_summary']}
-            Corrective Action: {row['corrective_action']}
-            Affected Vehicles: {row['potentially_affected']}
-            Recall Type: {row['recall_type']} | Year: {row['year']} | Month: {row['year_month']}"""
-
-
-        
-        # Creating metadata to help in retrieval, filtering, and UI rendering
-        metadata = {
-            "nhtsa_id": str(row['nhtsa_id']),
-            "manufacturer": row['manufacturer'],
-            "component": row['component'],
-            "recall_date": str(raw_date) if pd.notna(raw_date) else 'Unknown',
-            "recall_type": row['recall_type'],
-            "do_not_drive": row['do_not_drive'],
-            "fire_risk_when_parked": row['fire_risk_when_parked'],
-            "year": row['year'],
-            "year_month": row['year_month']
-        }
-
-
-        doc = Document(page_content=text, metadata=metadata)
-        # Wraps text and metadata into a LangChain Document
-        documents.append(doc)
-    st.markdown(f"Successfully created {len(documents)} documents with metadata")
+    documents = build_documents(df)
     print(f"Successfully created {len(documents)} documents with metadata")
     return documents
+
+
+def iter_documents(path="data/vehicle_recalls_clean.csv", chunksize=10_000):
+    """Yield lists of documents for chunksize rows of the CSV at a time"""
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        yield build_documents(chunk.fillna("Unknown"))
+
+
+def count_rows(path="data/vehicle_recalls_clean.csv", chunksize=100_000):
+    """Number of recalls in the CSV, reading a single column"""
+    return sum(len(chunk) for chunk in pd.read_csv(path, chunksize=chunksize, usecols=[0]))
@@ -0,0 +1,125 @@
+# pipeline/diversify.py
+# Diversified retrieval: collapse near-duplicate recalls, then pick the rest by
+# maximal marginal relevance (MMR), all on the candidates' stored FAISS vectors.
+#   RECALL_DIVERSIFY=1               turn diversification on in create_service
+#   RECALL_DIVERSIFY_FETCH_K         first-stage candidates to diversify
+#   RECALL_MMR_LAMBDA                relevance vs novelty (1.0 = plain relevance order)
+#   RECALL_DUPLICATE_SIMILARITY      cosine at or above which two recalls count as one
+import os
+import threading
+import weakref
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+
+from pipeline import tracing
+from pipeline.ann_index import reconstruct_rows
+
+load_dotenv()
+
+DIVERSIFY_ENABLED = os.getenv("RECALL_DIVERSIFY", "0") == "1"
+DIVERSIFY_FETCH_K = int(os.getenv("RECALL_DIVERSIFY_FETCH_K", "50"))
+MMR_LAMBDA = float(os.getenv("RECALL_MMR_LAMBDA", "0.7"))
+DUPLICATE_SIMILARITY = float(os.getenv("RECALL_DUPLICATE_SIMILARITY", "0.95"))
+
+_rows_lock = threading.Lock()
+_rows_by_vectorstore = weakref.WeakKeyDictionary()
+
+
+def rows_of(vectorstore, doc_ids):
+    """
+    FAISS rows of docstore ids (None where unknown). The memory-mapped docstore
+    looks them up by binary search; other stores get an id -> row dict, built
+    once per vector store.
+    """
+    row = getattr(vectorstore.docstore, "row", None)
+    if row is not None:
+        return [row(doc_id) for doc_id in doc_ids]
+    with _rows_lock:
+        rows = _rows_by_vectorstore.get(vectorstore)
+        if rows is None:
+            rows = {doc_id: row for row, doc_id in vectorstore.index_to_docstore_id.items()}
+            _rows_by_vectorstore[vectorstore] = rows
+    return [rows.get(doc_id) for doc_id in doc_ids]
+
+
+def collapse_duplicates(similarity, threshold):
+    """
+    Group candidates whose cosine similarity is at least threshold. Candidates
+    are taken in rank order and each one not yet grouped becomes the
+    representative of every later candidate that close to it.
+    Returns {representative: [member, ...]} in rank order.
+    """
+    unassigned = np.ones(len(similarity), dtype=bool)
+    groups = {}
+    for i in range(len(similarity)):
+        if not unassigned[i]:
+            continue
+        members = np.flatnonzero(unassigned & (similarity[i] >= threshold))
+        unassigned[members] = False
+        groups[i] = [int(j) for j in members if j != i]
+    return groups
+
+
+def mmr(relevance, similarity, k, lambda_mult):
+    """
+    Indices of k items by maximal marginal relevance: each step takes the item
+    maximizing lambda * relevance - (1 - lambda) * max similarity to those taken
+    """
+    k = min(k, len(relevance))
+    selected = []
+    closest = np.full(len(relevance), -np.inf, dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    for _ in range(k):
+        novelty = np.where(np.isfinite(closest), closest, 0.0)
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * novelty, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        closest = np.maximum(closest, similarity[best])
+    return selected
+
+
+class Diversifier:
+    """
+    Second retrieval stage for recall data full of near-identical entries (the
+    same defect filed for several model years or sister brands). Candidates
+    within duplicate_similarity of a better-ranked one are folded into it, and
+    the representatives are ordered by MMR.
+    """
+
+    def __init__(self, fetch_k=DIVERSIFY_FETCH_K, lambda_mult=MMR_LAMBDA,
+                 duplicate_similarity=DUPLICATE_SIMILARITY):
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+        self.duplicate_similarity = duplicate_similarity
+
+    def select(self, vectorstore, query_vector, doc_ids, k):
+        """
+        Up to k representatives of the ranked candidate ids.
+        Returns [(doc_id, [ids of the duplicates folded into it]), ...].
+        """
+        positions = rows_of(vectorstore, doc_ids)
+        if len(doc_ids) <= 1 or query_vector is None or None in positions:
+            return [(doc_id, []) for doc_id in doc_ids[:k]]
+
+        with tracing.span("diversify", candidates=len(doc_ids)) as span:
+            vectors = reconstruct_rows(vectorstore.index, positions)
+            faiss.normalize_L2(vectors)
+            query = np.array([query_vector], dtype=np.float32)
+            faiss.normalize_L2(query)
+            similarity = vectors @ vectors.T
+            relevance = vectors @ query[0]
+
+            groups = collapse_duplicates(similarity, self.duplicate_similarity)
+            representatives = np.fromiter(groups, dtype=np.int64, count=len(groups))
+            chosen = mmr(relevance[representatives], similarity[np.ix_(representatives, representatives)],
+                         k, self.lambda_mult)
+            span.set(kept=len(chosen), collapsed=len(doc_ids) - len(groups))
+            return [(doc_ids[i], [doc_ids[j] for j in groups[int(i)]]) for i in representatives[chosen]]
+
+
+def get_diversifier():
+    """The configured diversifier, or None when RECALL_DIVERSIFY is off"""
+    return Diversifier() if DIVERSIFY_ENABLED else None
@@ -1,10 +1,278 @@
 #embedder.py
 
-from langchain.embeddings import HuggingFaceEmbeddings
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
 from dotenv import load_dotenv
+import hashlib
+import sqlite3
+import threading
+import weakref
 
+import numpy as np
 
-load_dotenv()
-def get_embedder():
-    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+from pipeline.registry import registry
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed embedding cache in front of another Embeddings object.
+    Document vectors are stored as float32 blobs in SQLite keyed by hash(model
+    name + text), so they survive restarts. The cache is capped at max_entries
+    and evicts the least recently used vectors first; recency updates from cache
+    hits are batched in memory and written every touch_batch hits (and before
+    any eviction).
+    Query vectors stay out of the document cache, in a small in-memory LRU.
+    """
+
+    def __init__(self, embedder, model_name, cache_path="embedding_cache.sqlite", max_entries=500_000,
+                 query_cache_size=1024, touch_batch=1000):
+        self.embedder = embedder
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.query_cache_size = query_cache_size
+        self.touch_batch = touch_batch
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._queries = OrderedDict()
+        self._touched = {}
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)")
+        self._conn.commit()
+        self._clock, self._size = self._conn.execute(
+            "SELECT COALESCE(MAX(last_used), 0), COUNT(*) FROM embeddings").fetchone()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        """Fetch cached vectors for keys and note them as recently used"""
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            found.update((key, np.frombuffer(blob, dtype=np.float32)) for key, blob in rows)
+        if found:
+            self._clock += 1
+            self._touched.update((key, self._clock) for key in found)
+            if len(self._touched) >= self.touch_batch:
+                self._flush_touched()
+                self._conn.commit()
+        return found
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                   [(clock, key) for key, clock in self._touched.items()])
+            self._touched.clear()
+
+    def _store(self, items):
+        """Insert new vectors and evict the least recently used ones over the cap"""
+        self._clock += 1
+        inserted = self._conn.executemany(
+            "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes(), self._clock) for key, vector in items]
+        ).rowcount
+        self._size += max(inserted, 0)
+        overflow = self._size - self.max_entries
+        if overflow > 0:
+            # Eviction order must see the recency of every hit so far
+            self._flush_touched()
+            deleted = self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (overflow,)
+            ).rowcount
+            self._size -= deleted
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(list(set(keys)))
+            # Texts repeated within one call are only encoded once
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in cached:
+                    missing.setdefault(key, text)
+            self.hits += len(keys) - sum(1 for key in keys if key in missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = self.embedder.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            with self._lock:
+                self._store(new_items)
+                self._conn.commit()
+            cached.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in new_items)
+
+        return [cached[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        """Questions are rarely repeated word for word, so they only get an in-memory LRU"""
+        with self._lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+        vector = self.embedder.embed_query(text)
+        with self._lock:
+            self._queries[text] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return vector
+
+    def embed_queries(self, texts):
+        """
+        embed_query for a batch of questions: misses are encoded in one call
+        and, like single questions, only go into the in-memory LRU
+        """
+        vectors = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                vector = self._queries.get(text)
+                if vector is not None:
+                    self._queries.move_to_end(text)
+                    vectors[i] = list(vector)
+                else:
+                    missing.setdefault(text, []).append(i)
+            self.hits += len(texts) - sum(len(positions) for positions in missing.values())
+            self.misses += len(missing)
+
+        if missing:
+            # all-MiniLM embeds queries and documents the same way, so misses share one batched call
+            encoded = self.embedder.embed_documents(list(missing))
+            with self._lock:
+                for (text, positions), vector in zip(missing.items(), encoded):
+                    for i in positions:
+                        vectors[i] = vector
+                    self._queries[text] = vector
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+        return vectors
+
+    def flush(self):
+        """Write batched recency updates to disk"""
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+
+    def lookup(self, texts):
+        """Cached vectors for texts, None where a text is not cached (for callers that embed elsewhere)"""
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(list(set(keys)))
+            self._conn.commit()
+            self.hits += sum(1 for key in keys if key in cached)
+            self.misses += sum(1 for key in keys if key not in cached)
+        return [cached.get(key) for key in keys]
+
+    def missing(self, texts):
+        """Positions of texts with no cached vector; a plain check that counts no hits or misses"""
+        keys = [self._key(text) for text in texts]
+        present = set()
+        with self._lock:
+            unique = list(set(keys))
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                present.update(key for key, in self._conn.execute(
+                    f"SELECT key FROM embeddings WHERE key IN ({placeholders})", chunk))
+        return [i for i, key in enumerate(keys) if key not in present]
+
+    def store(self, texts, vectors):
+        """Add vectors computed outside this object, e.g. by embedding worker processes"""
+        with self._lock:
+            self._store(list(zip((self._key(text) for text in texts), vectors)))
+            self._conn.commit()
+
+    def stats(self):
+        """Hit/miss counters plus the number of vectors currently cached"""
+        with self._lock:
+            size = self._size
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+            "max_entries": self.max_entries,
+            "query_entries": len(self._queries),
+        }
 
+
+class LazyEmbeddings(Embeddings):
+    """Embeddings whose model is still loading in the background; calls wait for it"""
+
+    def __init__(self, future):
+        self._future = future
+
+    @property
+    def embedder(self):
+        return self._future.result()
+
+    def ready(self):
+        return self._future.done()
+
+    def embed_documents(self, texts):
+        return self.embedder.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embedder.embed_query(text)
+
+    def embed_queries(self, texts):
+        return embed_queries(self.embedder, texts)
+
+
+class SharedEmbeddings(Embeddings):
+    """
+    Embeddings backed by the process-wide copy of a model in the registry.
+    The registry reference is dropped when this object is garbage collected,
+    and the model is freed once no SharedEmbeddings use it any more.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        weakref.finalize(self, handle.release)
+
+    def embed_documents(self, texts):
+        return self.handle.value.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.handle.value.embed_query(text)
+
+
+def embed_queries(embeddings, texts):
+    """
+    Vectors for a batch of questions. Cached embedders keep them out of the
+    persistent document cache; plain models embed them in one batched call.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    return embeddings.embed_documents(texts)
+
+
+def load_model(model_name=MODEL_NAME):
+    # Imported here so sentence-transformers/torch load only when a model is needed
+    from langchain.embeddings import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+load_dotenv()
+def get_embedder(cache_path="embedding_cache.sqlite", max_entries=500_000):
+    # Every caller in the process shares one copy of the model
+    embedder = SharedEmbeddings(registry.acquire(f"embedder:{MODEL_NAME}", load_model))
+    if cache_path is None:
+        return embedder
+    return CachedEmbeddings(embedder, MODEL_NAME, cache_path=cache_path, max_entries=max_entries)
@@ -0,0 +1,165 @@
+# pipeline/keyword_index.py
+import os
+import re
+
+import numpy as np
+
+from pipeline.store_version import current_path
+
+KEYWORD_INDEX_FILE = "keyword_index.npz"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# NHTSA campaign ids such as 24V123000, also written as 24V-123 or 24v123
+NHTSA_ID_PATTERN = re.compile(r"\b(\d{2})\s*([VEICT])\s*-?\s*(\d{3})(\d{3})?\b", re.IGNORECASE)
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def canonical_nhtsa_id(value):
+    """Canonical NHTSA id (24V-123 -> 24V123000), or None if value is not one"""
+    match = NHTSA_ID_PATTERN.fullmatch(str(value).strip())
+    if match is None:
+        return None
+    year, kind, number, suffix = match.groups()
+    return f"{year}{kind.upper()}{number}{suffix or '000'}"
+
+
+def find_nhtsa_ids(text):
+    """All NHTSA ids mentioned in a piece of text, in canonical form"""
+    return [canonical_nhtsa_id(match.group(0)) for match in NHTSA_ID_PATTERN.finditer(str(text))]
+
+
+class KeywordIndex:
+    """
+    BM25 index over the recall texts, stored as CSR posting arrays.
+    Per-posting BM25 weights are precomputed at build time, so a query is a
+    handful of numpy slices and one weighted sum. The arrays live in a single
+    .npz file that loads without unpickling anything.
+    """
+
+    def __init__(self, terms, indptr, postings, weights, doc_ids):
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.indptr = indptr
+        self.postings = postings
+        self.weights = weights
+        self.doc_ids = doc_ids
+        self.row_of = {doc_id: row for row, doc_id in enumerate(doc_ids)}
+        self.id_lookup = {}
+        for row, doc_id in enumerate(doc_ids):
+            canonical = canonical_nhtsa_id(doc_id.split("#")[0])
+            if canonical is not None:
+                self.id_lookup.setdefault(canonical, []).append(row)
+        n_docs = len(doc_ids)
+        df = np.diff(indptr).astype(np.float32)
+        self.idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts, doc_ids, k1=1.5, b=0.75):
+        builder = KeywordIndexBuilder()
+        builder.add(texts, doc_ids)
+        return builder.finish(k1, b)
+
+    def save(self, path):
+        np.savez(path, terms=np.array(self.terms, dtype=str), indptr=self.indptr,
+                 postings=self.postings, weights=self.weights, doc_ids=np.array(self.doc_ids, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        return cls(data["terms"].tolist(), data["indptr"], data["postings"], data["weights"],
+                   data["doc_ids"].tolist())
+
+    def lookup_ids(self, question):
+        """Docstore ids of recalls whose NHTSA id is mentioned in the question"""
+        rows = [row for canonical in find_nhtsa_ids(question) for row in self.id_lookup.get(canonical, [])]
+        return [self.doc_ids[row] for row in dict.fromkeys(rows)]
+
+    def search(self, question, k=20, allowed_ids=None):
+        """Top-k docstore ids by BM25 score, optionally restricted to allowed_ids"""
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for token in set(tokenize(question)):
+            tid = self.term_ids.get(token)
+            if tid is None:
+                continue
+            start, end = self.indptr[tid], self.indptr[tid + 1]
+            scores[self.postings[start:end]] += self.idf[tid] * self.weights[start:end]
+
+        if allowed_ids is not None:
+            mask = np.zeros(len(self.doc_ids), dtype=bool)
+            mask[[self.row_of[doc_id] for doc_id in allowed_ids if doc_id in self.row_of]] = True
+            scores[~mask] = 0.0
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [self.doc_ids[row] for row in hits]
+
+
+class KeywordIndexBuilder:
+    """
+    Accumulates BM25 postings chunk by chunk, so the index can be built while
+    streaming a corpus that is never held in memory as a whole
+    """
+
+    def __init__(self):
+        self.term_ids = {}
+        self.doc_ids = []
+        self._rows = []
+        self._tids = []
+        self._tfs = []
+        self._lengths = []
+
+    def add(self, texts, doc_ids):
+        offset = len(self.doc_ids)
+        doc_terms = []
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = {}
+            tokens = tokenize(text)
+            for token in tokens:
+                tid = self.term_ids.setdefault(token, len(self.term_ids))
+                counts[tid] = counts.get(tid, 0) + 1
+            doc_terms.append(counts)
+            doc_lengths[row] = len(tokens)
+
+        self._rows.append(np.fromiter((offset + row for row, counts in enumerate(doc_terms) for _ in counts),
+                                      dtype=np.int32))
+        self._tids.append(np.fromiter((tid for counts in doc_terms for tid in counts), dtype=np.int32))
+        self._tfs.append(np.fromiter((tf for counts in doc_terms for tf in counts.values()), dtype=np.float32))
+        self._lengths.append(doc_lengths)
+        self.doc_ids.extend(doc_ids)
+
+    def finish(self, k1=1.5, b=0.75):
+        rows = np.concatenate(self._rows) if self._rows else np.zeros(0, dtype=np.int32)
+        tids = np.concatenate(self._tids) if self._tids else np.zeros(0, dtype=np.int32)
+        tfs = np.concatenate(self._tfs) if self._tfs else np.zeros(0, dtype=np.float32)
+        doc_lengths = np.concatenate(self._lengths) if self._lengths else np.zeros(0, dtype=np.float32)
+
+        # Group (term, doc, tf) triples by term to get CSR postings
+        order = np.argsort(tids, kind="stable")
+        rows, tids, tfs = rows[order], tids[order], tfs[order]
+        indptr = np.zeros(len(self.term_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tids, minlength=len(self.term_ids)), out=indptr[1:])
+
+        avg_length = doc_lengths.mean() if len(doc_lengths) else 1.0
+        norm = k1 * (1 - b + b * doc_lengths[rows] / avg_length)
+        weights = (tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+        terms = sorted(self.term_ids, key=self.term_ids.get)
+        return KeywordIndex(terms, indptr, rows, weights, list(self.doc_ids))
+
+
+def save_keyword_index(docs, doc_ids, persist_path):
+    index = KeywordIndex.build([doc.page_content for doc in docs], doc_ids)
+    index.save(os.path.join(persist_path, KEYWORD_INDEX_FILE))
+    return index
+
+
+def load_keyword_index(persist_path):
+    """Load the keyword index saved next to the FAISS index, if there is one"""
+    path = os.path.join(current_path(persist_path), KEYWORD_INDEX_FILE)
+    return KeywordIndex.load(path) if os.path.exists(path) else None
@@ -1,27 +1,269 @@
 #llm_loader.py
-from langchain.llms import HuggingFacePipeline, HuggingFaceHub
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+# langchain and transformers are imported inside the functions so that
+# importing this module stays cheap and models load only when needed
+from concurrent.futures import Future
 from dotenv import load_dotenv
+from functools import lru_cache
+from threading import Lock, Thread
+import os
+import queue
+import time
 
+from pipeline.registry import registry
 
-# def get_llm():
-#     model_id = "google/flan-t5-base"
-#     tokenizer = AutoTokenizer.from_pretrained(model_id)
-#     model = AutoModelForSeq2SeqLM.from_pretrained(model_id)
 
-#     pipe = pipeline(
-#         "text2text-generation",
-#         model=model,
-#         tokenizer=tokenizer,
-#         max_new_tokens=200
-#     )
+load_dotenv()
 
-#     return HuggingFacePipeline(pipeline=pipe)
+MODEL_ID = "google/flan-t5-base"
+MAX_NEW_TOKENS = 200
+MAX_INPUT_TOKENS = 512 # flan-t5 encoder limit; other models use their own (input_token_limit)
+TEMPERATURE = 0.3
+
+# Backend selection (.env):
+#   RECALL_LLM_BACKEND   hub (default) or local
+#   RECALL_LOCAL_MODEL   model id or local directory for the local backend
+#   RECALL_LLM_QUANTIZE  1 (default) to quantize Linear layers to int8
+#   HF_HUB_OFFLINE       1 on network-isolated hosts: forces the local backend
+#                        and loads only files already on disk
+#   RECALL_STREAM_TIMEOUT seconds to wait for each streamed token from the
+#                        local backend before giving up (default 60)
+LLM_BACKEND = os.getenv("RECALL_LLM_BACKEND", "hub").lower()
+LOCAL_MODEL_ID = os.getenv("RECALL_LOCAL_MODEL", MODEL_ID)
+QUANTIZE = os.getenv("RECALL_LLM_QUANTIZE", "1") == "1"
+OFFLINE = os.getenv("HF_HUB_OFFLINE", "0").lower() in ("1", "true", "yes")
+STREAM_TIMEOUT = float(os.getenv("RECALL_STREAM_TIMEOUT", "60"))
+
+MAX_BATCH_SIZE = 16
+MAX_BATCH_WAIT_MS = 10
+
+
+class MicroBatcher:
+    """
+    Collects prompts submitted from many threads and runs them through
+    generate_batch together: a batch closes when it is full or when the
+    first prompt in it has waited max_wait_ms.
+    """
+
+    def __init__(self, generate_batch, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batch_sizes = []
+        self._queue = queue.Queue()
+        Thread(target=self._run, name="llm-batcher", daemon=True).start()
+
+    def submit(self, prompt):
+        future = Future()
+        self._queue.put((prompt, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            self.batch_sizes.append(len(batch))
+            try:
+                answers = self.generate_batch([prompt for prompt, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), answer in zip(batch, answers):
+                future.set_result(answer)
+
+
+class LocalLLM:
+    """
+    CPU model shared by every caller in the process. llm(prompt) goes through
+    the micro-batcher, so concurrent questions share one generate call.
+    """
+
+    def __init__(self, tokenizer, model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.model_id = model.name_or_path
+        self.max_input_tokens = _context_limit(tokenizer, model.config)
+        self.batcher = MicroBatcher(self.generate_batch, max_batch_size, max_wait_ms)
+
+    def generate_batch(self, prompts):
+        """One padded generate call for a list of prompts"""
+        import torch
+
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True,
+                                truncation=True, max_length=self.max_input_tokens)
+        with torch.inference_mode():
+            outputs = self.model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS)
+        if not self.model.config.is_encoder_decoder:
+            # Decoder-only models echo the prompt before the answer
+            outputs = outputs[:, inputs["input_ids"].shape[1]:]
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    def __call__(self, prompt):
+        return self.batcher.submit(prompt).result()
+
+    def batch(self, prompts):
+        futures = [self.batcher.submit(prompt) for prompt in prompts]
+        return [future.result() for future in futures]
+
+
+_local_llm = None
+_local_llm_lock = Lock()
+
+
+def _load_local_llm():
+    print(f"Loading local LLM {LOCAL_MODEL_ID} (int8: {QUANTIZE}, offline: {OFFLINE})")
+    return LocalLLM(*load_local_model())
 
-load_dotenv()
+
+def load_local_model(model_id=LOCAL_MODEL_ID, quantize=QUANTIZE):
+    """Load tokenizer and model for CPU inference, int8-quantizing the Linear layers"""
+    import torch
+    from transformers import AutoConfig, AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer
+
+    config = AutoConfig.from_pretrained(model_id, local_files_only=OFFLINE)
+    model_class = AutoModelForSeq2SeqLM if config.is_encoder_decoder else AutoModelForCausalLM
+    tokenizer = AutoTokenizer.from_pretrained(model_id, local_files_only=OFFLINE)
+    model = model_class.from_pretrained(model_id, local_files_only=OFFLINE)
+    model.eval()
+
+    if not config.is_encoder_decoder:
+        # Batched generation with decoder-only models needs left padding
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+    if quantize:
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return tokenizer, model
+
+
+def get_local_llm():
+    """The process-wide local LLM, loaded through the registry on first use and kept"""
+    global _local_llm
+    with _local_llm_lock:
+        if _local_llm is None:
+            _local_llm = registry.acquire(f"llm:{LOCAL_MODEL_ID}", _load_local_llm)
+        return _local_llm.value
+
+def uses_local_llm():
+    return OFFLINE or LLM_BACKEND == "local"
+
+def active_model_id():
+    """Id of the model that answers questions: the local model or the hub one"""
+    return LOCAL_MODEL_ID if uses_local_llm() else MODEL_ID
+
+def _context_limit(tokenizer, config):
+    """Prompt tokens a model accepts; decoder-only models keep room for the answer"""
+    limit = tokenizer.model_max_length
+    if not limit or limit > 1_000_000:
+        # Tokenizers without a configured limit report a huge placeholder
+        limit = getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", None)
+    limit = limit or MAX_INPUT_TOKENS
+    return limit if config.is_encoder_decoder else max(limit - MAX_NEW_TOKENS, 1)
+
+@lru_cache(maxsize=None)
+def input_token_limit(model_id):
+    """
+    Prompt tokens model_id accepts, read from its files on disk.
+    Falls back to the flan-t5 limit when they are not available.
+    """
+    if model_id == MODEL_ID:
+        return MAX_INPUT_TOKENS
+    try:
+        from transformers import AutoConfig, AutoTokenizer
+
+        config = AutoConfig.from_pretrained(model_id, local_files_only=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_id, local_files_only=True)
+    except Exception:
+        print(f"No local files for {model_id}, assuming a {MAX_INPUT_TOKENS}-token input limit")
+        return MAX_INPUT_TOKENS
+    return _context_limit(tokenizer, config)
 
 def get_llm():
+    if uses_local_llm():
+        return get_local_llm()
+
+    from langchain.llms import HuggingFaceHub
+
     return HuggingFaceHub(
-        repo_id="google/flan-t5-base",
-        model_kwargs={"temperature": 0.3, "max_new_tokens": 200}
-    )
\ No newline at end of file
+        repo_id=MODEL_ID,
+        model_kwargs={"temperature": TEMPERATURE, "max_new_tokens": MAX_NEW_TOKENS}
+    )
+
+def _stream_local(tokenizer, model, prompt, max_input_tokens=MAX_INPUT_TOKENS):
+    """
+    Run generate in a background thread and read tokens from a text streamer.
+    An error in generate ends the stream and is re-raised here; a token that
+    takes longer than STREAM_TIMEOUT raises TimeoutError instead of hanging.
+    """
+    from transformers import TextIteratorStreamer
+
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True,
+                                    timeout=STREAM_TIMEOUT)
+    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, max_length=max_input_tokens)
+    errors = []
+
+    def generate():
+        try:
+            model.generate(**inputs, streamer=streamer, max_new_tokens=MAX_NEW_TOKENS)
+        except BaseException as e:
+            errors.append(e)
+            streamer.end()
+
+    thread = Thread(target=generate, name="llm-stream", daemon=True)
+    thread.start()
+    try:
+        yield from streamer
+    except queue.Empty:
+        raise TimeoutError(f"Local model produced no token for {STREAM_TIMEOUT:g} s") from None
+    thread.join()
+    if errors:
+        raise errors[0]
+
+def _stream_hub(llm, prompt):
+    """Stream tokens from the Inference API, falling back to a single blocking call"""
+    from huggingface_hub import InferenceClient
+
+    client = InferenceClient(model=llm.repo_id, token=llm.huggingfacehub_api_token)
+    model_kwargs = llm.model_kwargs or {}
+    started = False
+    try:
+        for token in client.text_generation(
+            prompt,
+            stream=True,
+            max_new_tokens=model_kwargs.get("max_new_tokens", MAX_NEW_TOKENS),
+            temperature=model_kwargs.get("temperature", TEMPERATURE),
+        ):
+            started = True
+            yield token
+    except Exception as e:
+        # Endpoints without streaming support fail before the first token
+        if started:
+            raise
+        print(f"Streaming unavailable ({e}), waiting for the full answer")
+        yield llm(prompt)
+
+def stream_llm(llm, prompt):
+    """Yield the LLM answer piece by piece as it is generated"""
+    from langchain.llms import HuggingFacePipeline, HuggingFaceHub
+
+    if isinstance(llm, LocalLLM):
+        # Streams run their own generate call next to the batcher
+        yield from _stream_local(llm.tokenizer, llm.model, prompt, llm.max_input_tokens)
+    elif isinstance(llm, HuggingFacePipeline):
+        pipeline = llm.pipeline
+        yield from _stream_local(pipeline.tokenizer, pipeline.model, prompt,
+                                 _context_limit(pipeline.tokenizer, pipeline.model.config))
+    elif isinstance(llm, HuggingFaceHub):
+        yield from _stream_hub(llm, prompt)
+    else:
+        yield llm(prompt)
@@ -0,0 +1,85 @@
+# pipeline/metadata_index.py
+import numpy as np
+
+FILTER_FIELDS = ["manufacturer", "component", "year", "do_not_drive", "fire_risk_when_parked"]
+
+
+def normalize_value(field, value):
+    """Canonical form of a metadata value used as an inverted index key"""
+    if field == "year":
+        try:
+            return str(int(float(value)))
+        except (TypeError, ValueError):
+            return str(value)
+    if field in ("do_not_drive", "fire_risk_when_parked"):
+        value = str(value).strip().lower()
+        return "yes" if value in ("yes", "y", "true", "1") else value
+    return str(value)
+
+
+class MetadataIndex:
+    """
+    Inverted indexes from metadata values to FAISS row positions.
+    Used to restrict vector search to the recalls that match a parsed query.
+    """
+
+    def __init__(self, postings, size):
+        self.postings = postings
+        self.size = size
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        postings = {field: {} for field in FILTER_FIELDS}
+        for position, doc_id in vectorstore.index_to_docstore_id.items():
+            metadata = vectorstore.docstore.search(doc_id).metadata
+            for field in FILTER_FIELDS:
+                if field in metadata:
+                    key = normalize_value(field, metadata[field])
+                    postings[field].setdefault(key, []).append(position)
+
+        for field in FILTER_FIELDS:
+            postings[field] = {key: np.array(sorted(ids), dtype=np.int64)
+                               for key, ids in postings[field].items()}
+        return cls(postings, len(vectorstore.index_to_docstore_id))
+
+    def values(self, field):
+        return list(self.postings[field])
+
+    def candidates(self, constraints):
+        """
+        Row positions matching every constraint (values within a field are OR-ed).
+        Returns None when there is nothing to filter on.
+        """
+        result = None
+        for field, values in constraints.items():
+            if field not in self.postings:
+                continue
+            arrays = [self.postings[field][key]
+                      for key in (normalize_value(field, v) for v in values)
+                      if key in self.postings[field]]
+            matches = np.unique(np.concatenate(arrays)) if arrays else np.array([], dtype=np.int64)
+            result = matches if result is None else np.intersect1d(result, matches, assume_unique=True)
+        return result
+
+
+    def save(self, path):
+        """Store the posting lists as flat numpy arrays (no pickle)"""
+        arrays = {}
+        for field, postings in self.postings.items():
+            keys = list(postings)
+            lengths = [len(postings[key]) for key in keys]
+            arrays[f"{field}_keys"] = np.array(keys, dtype=str)
+            arrays[f"{field}_indptr"] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            arrays[f"{field}_ids"] = (np.concatenate([postings[key] for key in keys])
+                                      if keys else np.array([], dtype=np.int64))
+        np.savez(path, size=np.array(self.size), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        postings = {}
+        for field in FILTER_FIELDS:
+            keys = data[f"{field}_keys"].tolist()
+            indptr, ids = data[f"{field}_indptr"], data[f"{field}_ids"]
+            postings[field] = {key: ids[indptr[i]:indptr[i + 1]] for i, key in enumerate(keys)}
+        return cls(postings, int(data["size"]))
@@ -0,0 +1,57 @@
+# pipeline/parallel_embedder.py
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+# Each worker process holds its own copy of the sentence-transformers model
+_worker_model = None
+
+
+def _init_worker(model_name, threads_per_worker):
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads_per_worker)
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+
+def _encode_batch(batch):
+    start, texts = batch
+    vectors = _worker_model.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+    return start, np.asarray(vectors, dtype=np.float32)
+
+
+def iter_text_batches(docs, batch_size):
+    """Yield (offset, texts) batches from a sequence of documents"""
+    for start in range(0, len(docs), batch_size):
+        yield start, [doc.page_content for doc in docs[start:start + batch_size]]
+
+
+def embed_documents_parallel(docs, model_name, workers=None, batch_size=256):
+    """
+    Encode documents with a pool of worker processes.
+    Yields (offset, vectors) batches in document order as soon as they are ready,
+    showing a progress bar and reporting throughput in docs/sec at the end.
+    """
+    workers = workers or os.cpu_count() or 1
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    print(f"Embedding {len(docs)} documents with {workers} workers, batch size {batch_size}")
+
+    started = time.perf_counter()
+    done = 0
+    # spawn keeps torch thread pools from being shared across forked workers
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(model_name, threads_per_worker)) as pool, \
+            tqdm(total=len(docs), unit="docs", desc="Embedding") as progress:
+        for start, vectors in pool.imap(_encode_batch, iter_text_batches(docs, batch_size)):
+            done += len(vectors)
+            progress.update(len(vectors))
+            progress.set_postfix(docs_per_sec=f"{done / (time.perf_counter() - started):.0f}")
+            yield start, vectors
+
+    elapsed = time.perf_counter() - started
+    print(f"Embedded {done} documents in {elapsed:.1f}s ({done / elapsed:.0f} docs/sec)")
@@ -0,0 +1,65 @@
+# pipeline/query_cache.py
+from collections import OrderedDict
+import re
+import threading
+import time
+
+
+def normalize_question(question):
+    """Normalize a question so trivial variations share one cache entry"""
+    question = re.sub(r"\s+", " ", str(question).lower()).strip()
+    return question.rstrip("?!. ")
+
+
+class QueryCache:
+    """
+    Bounded LRU cache with a time-to-live for RAG results.
+    Keys are (normalized question, retriever k, model id).
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(question, k, model_id):
+        return (normalize_question(question), k, model_id)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if time.monotonic() - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
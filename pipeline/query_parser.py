@@ -0,0 +1,156 @@
+# pipeline/query_parser.py
+from functools import lru_cache
+import re
+
+# Brand names that appear in questions but not in the NHTSA manufacturer name
+MANUFACTURER_ALIASES = {
+    "gm": "GENERAL MOTORS", "chevrolet": "GENERAL MOTORS", "chevy": "GENERAL MOTORS",
+    "gmc": "GENERAL MOTORS", "buick": "GENERAL MOTORS", "cadillac": "GENERAL MOTORS",
+    "jeep": "CHRYSLER", "dodge": "CHRYSLER", "ram": "CHRYSLER", "fca": "CHRYSLER",
+    "stellantis": "CHRYSLER", "lexus": "TOYOTA", "acura": "HONDA", "infiniti": "NISSAN",
+    "lincoln": "FORD", "vw": "VOLKSWAGEN", "mercedes": "MERCEDES-BENZ", "benz": "MERCEDES-BENZ",
+}
+
+# One-word brand names safe to match on their own; any other manufacturer
+# needs the first two words of its name ("new flyer", "grand design") in the
+# question, so ordinary words like "recent" or "new" never become filters
+KNOWN_BRANDS = {
+    "ford", "toyota", "honda", "nissan", "hyundai", "kia", "subaru", "mazda", "mitsubishi",
+    "tesla", "volkswagen", "audi", "mercedes-benz", "volvo", "bmw", "porsche", "jaguar",
+    "chrysler", "daimler", "isuzu", "hino", "freightliner", "navistar", "peterbilt", "kenworth",
+    "paccar", "mack", "gillig", "prevost", "winnebago", "polaris", "harley-davidson", "yamaha",
+    "kawasaki", "suzuki", "ducati", "ferrari", "maserati", "bentley", "rivian", "fisker",
+    "mclaren", "goodyear", "michelin", "bridgestone", "firestone", "graco", "evenflo", "britax",
+}
+
+# More distinct brands than this in one question is read as a misparse, not a filter
+MAX_BRANDS_PER_QUERY = 3
+
+# Words in manufacturer names that do not identify a brand
+MANUFACTURER_STOPWORDS = {
+    "motor", "motors", "company", "inc", "llc", "america", "american", "north", "corporation",
+    "corp", "usa", "the", "and", "manufacturing", "engineering", "group", "vehicle", "vehicles",
+    "general", "international", "industries", "trucks", "truck", "unknown", "ltd", "div",
+}
+
+# Question words that should never be read as a brand name
+GENERIC_QUERY_WORDS = {
+    "recall", "recalls", "safety", "system", "systems", "problem", "problems", "issue", "issues",
+    "parts", "products", "auto", "automotive", "power", "electric", "high", "fire", "show",
+    "vehicle", "vehicles", "car", "cars", "defect", "defects", "risk", "severity",
+}
+
+# Question keywords -> substring of the NHTSA component name
+COMPONENT_KEYWORDS = {
+    "parking brake": "PARKING BRAKE", "brake": "BRAKE", "braking": "BRAKE",
+    "engine": "ENGINE", "cooling": "ENGINE COOLING", "air bag": "AIR BAG", "airbag": "AIR BAG",
+    "seat belt": "SEAT BELT", "seatbelt": "SEAT BELT", "steering": "STEERING",
+    "fuel": "FUEL", "electrical": "ELECTRICAL", "wiring": "ELECTRICAL", "battery": "ELECTRICAL",
+    "tire": "TIRE", "wheel": "WHEEL", "wiper": "WIPER", "windshield": "WINDSHIELD",
+    "suspension": "SUSPENSION", "transmission": "POWER TRAIN", "power train": "POWER TRAIN",
+    "powertrain": "POWER TRAIN", "camera": "BACK OVER", "backup": "BACK OVER",
+    "rearview": "BACK OVER", "light": "LIGHTING", "lighting": "LIGHTING", "headlight": "LIGHTING",
+    "latch": "LATCH", "door": "LATCH", "seat": "SEATS", "hood": "STRUCTURE",
+    "exhaust": "EXHAUST", "visibility": "VISIBILITY", "child seat": "CHILD SEAT",
+}
+
+DO_NOT_DRIVE_PHRASES = ["do not drive", "don't drive", "dont drive", "do-not-drive", "stop driving"]
+PARK_OUTSIDE_PHRASES = ["park outside", "parked outside", "when parked", "fire risk when parked",
+                        "parked fire", "park outdoors"]
+
+YEAR_PATTERN = re.compile(r"\b(19[5-9]\d|20\d\d)\b")
+
+
+def _keyword_pattern(keyword):
+    # Allow a plural "s" so "brakes" and "tires" still match
+    return re.compile(r"\b" + re.escape(keyword) + r"s?\b")
+
+
+# Longest keywords first, so "parking brake" claims its words before "brake" can
+_COMPONENT_PATTERNS = [(_keyword_pattern(k), COMPONENT_KEYWORDS[k])
+                       for k in sorted(COMPONENT_KEYWORDS, key=len, reverse=True)]
+_COMPONENT_WORDS = {word + suffix for keyword in COMPONENT_KEYWORDS
+                    for word in keyword.split() for suffix in ("", "s")}
+
+
+@lru_cache(maxsize=None)
+def manufacturer_brand(manufacturer):
+    """
+    Brand name of an NHTSA manufacturer name as a question would spell it: its
+    first word when that is a known brand ("Chrysler (FCA US, LLC)" -> "chrysler"),
+    else its first two words ("Grand Design RV, LLC" -> "grand design").
+    None when that leaves a single unknown word, which is too likely to be an
+    ordinary word ("Recent Inc").
+    """
+    words = [word for word in re.findall(r"[a-z][a-z\-]+", str(manufacturer).lower())
+             if word not in MANUFACTURER_STOPWORDS and len(word) > 2]
+    if words and words[0] in KNOWN_BRANDS:
+        return words[0]
+    if len(words) < 2 or all(word in GENERIC_QUERY_WORDS or word in _COMPONENT_WORDS for word in words[:2]):
+        return None
+    return " ".join(words[:2])
+
+
+def component_substrings(text):
+    """
+    Component name substrings for the keywords in a lower-cased question.
+    A keyword inside a longer matched one ("brake" in "parking brake", "seat"
+    in "child seat") is not counted again, so it cannot widen the filter.
+    """
+    claimed = []
+    substrings = set()
+    for pattern, value in _COMPONENT_PATTERNS:
+        for match in pattern.finditer(text):
+            start, end = match.span()
+            if not any(start < claimed_end and claimed_start < end for claimed_start, claimed_end in claimed):
+                claimed.append((start, end))
+                substrings.add(value)
+    return substrings
+
+
+def parse_query(question, manufacturers=(), components=()):
+    """
+    Extract structured constraints from a free-text question.
+    `manufacturers` and `components` are the values known to the index; the
+    returned dict maps metadata fields to the set of values that may match:
+    manufacturer, component, year, do_not_drive, fire_risk_when_parked.
+    A question naming more than MAX_BRANDS_PER_QUERY brands gets no manufacturer
+    constraint, so a misparse widens retrieval instead of emptying it.
+    """
+    text = str(question).lower()
+    words = re.findall(r"[a-z][a-z\-]+", text)
+    constraints = {}
+
+    # Manufacturer: whole brand names or aliases found in the question
+    phrase = f" {' '.join(words)} "
+    aliases = {MANUFACTURER_ALIASES[word] for word in words if word in MANUFACTURER_ALIASES}
+    brands = {}
+    for m in manufacturers:
+        brand = manufacturer_brand(m)
+        if brand is not None and f" {brand} " in phrase:
+            brands.setdefault(brand, set()).add(m)
+        else:
+            alias = next((alias for alias in aliases if alias in str(m).upper()), None)
+            if alias is not None:
+                brands.setdefault(alias.lower(), set()).add(m)
+    if len(brands) > MAX_BRANDS_PER_QUERY:
+        print(f"Manufacturer match is ambiguous ({', '.join(sorted(brands))}), not filtering on it")
+    elif brands:
+        constraints["manufacturer"] = set().union(*brands.values())
+
+    # Component: known component keywords mapped onto component names
+    substrings = component_substrings(text)
+    matched = {c for c in components if any(s in str(c).upper() for s in substrings)}
+    if matched:
+        constraints["component"] = matched
+
+    years = set(YEAR_PATTERN.findall(text))
+    if years:
+        constraints["year"] = years
+
+    if any(phrase in text for phrase in DO_NOT_DRIVE_PHRASES):
+        constraints["do_not_drive"] = {"yes"}
+    if any(phrase in text for phrase in PARK_OUTSIDE_PHRASES):
+        constraints["fire_risk_when_parked"] = {"yes"}
+
+    return constraints
@@ -1,31 +1,277 @@
 # rag_chain.py
 
 # from langchain.prompts import PromptTemplate
-from pipeline.llm_loader import get_llm
+from concurrent.futures import Future, ThreadPoolExecutor
+import copy
+import time
 
+from pipeline import tracing
+from pipeline.context_packer import count_tokens, pack_context, prompt_token_budget
+from pipeline.llm_loader import active_model_id, get_llm, stream_llm
+from pipeline.metadata_index import MetadataIndex
+from pipeline.query_cache import QueryCache
+from pipeline.retrieval import retrieve_documents, retrieve_documents_batch
+from pipeline.semantic_cache import SemanticCache
 
 
-def build_rag_chain_manual(vectorstore):
-    print("Building enhanced RAG chain")
-    llm = get_llm()
+class RAGChain:
+    """Callable RAG chain: rag_chain({"question": ...}) -> answer + source documents"""
+
+    def __init__(self, vectorstore, llm, k, model_id, cache=None, semantic_cache=None,
+                 metadata_index=None, keyword_index=None, reranker=None, diversifier=None):
+        self.vectorstore = vectorstore
+        self.metadata_index = metadata_index
+        self.keyword_index = keyword_index
+        self._llm = llm
+        self.k = k
+        self.model_id = model_id
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.reranker = reranker
+        self.diversifier = diversifier
+
+    def with_index(self, vectorstore, metadata_index=None, keyword_index=None, version=None):
+        """
+        Shallow copy of the chain answering from another index; the caches, LLM
+        and re-ranker are shared. Answers in both cache layers are kept apart per
+        version through the model id.
+        """
+        chain = copy.copy(self)
+        chain.vectorstore = vectorstore
+        chain.metadata_index = metadata_index
+        chain.keyword_index = keyword_index
+        if version is not None:
+            chain.model_id = f"{self.model_id}@index-v{version}"
+        return chain
+
+    @property
+    def llm(self):
+        """The LLM, waiting for it first if it is still loading in the background"""
+        if isinstance(self._llm, Future):
+            self._llm = self._llm.result()
+        return self._llm
+
+    def retrieve_or_cached(self, question):
+        """
+        Run the cache layers and retrieval for a question.
+        Returns (cached result or None, retrieval state for a fresh answer);
+        pass the state to remember() together with the generated answer.
+        """
+        cached, key = self._exact_lookup(question)
+        if cached is not None:
+            return cached, None
+
+        print(f"Processing question: {question}")
+        retrieved_docs, query_vector = retrieve_documents(
+            question, self.vectorstore, self._fetch_k(), self.metadata_index, self.keyword_index, self.diversifier
+        )
+        return self._semantic_lookup(question, key, self._rerank(question, retrieved_docs), query_vector)
+
+    def _fetch_k(self):
+        """First-stage depth: the re-ranker's candidate pool when re-ranking, else k"""
+        return max(self.reranker.fetch_k, self.k) if self.reranker is not None else self.k
+
+    def _rerank(self, question, docs):
+        """Second stage: keep the re-ranker's best few, or the first k if it had to fall back"""
+        if self.reranker is None:
+            return docs
+        return self.reranker.rerank(question, docs, self.k)
+
+    def _exact_lookup(self, question):
+        """Layer 1: exact repeat of a normalized question. Returns (cached result or None, key)"""
+        key = QueryCache.make_key(question, self.k, self.model_id)
+        if self.cache is not None:
+            with tracing.span("query_cache"):
+                cached = self.cache.get(key)
+            if cached is not None:
+                print(f"Query cache hit: {question}")
+                tracing.count("query_cache_hit")
+                return {**cached, "cache": {"hit": True, "layer": "exact", "similarity": 1.0}}, key
+        return None, key
+
+    def _semantic_lookup(self, question, key, retrieved_docs, query_vector):
+        """Layer 2: paraphrase of a past question with overlapping sources"""
+        print(f"Retrieved {len(retrieved_docs)} documents")
+        nhtsa_ids = [doc.metadata.get("nhtsa_id") for doc in retrieved_docs]
+
+        similarity = 0.0
+        if self.semantic_cache is not None and query_vector is not None:
+            with tracing.span("semantic_cache"):
+                entry, similarity = self.semantic_cache.lookup(query_vector, nhtsa_ids, scope=self.model_id)
+            if entry is not None:
+                print(f"Semantic cache hit ({entry['similarity']:.3f}): {entry['question']}")
+                tracing.count("semantic_cache_hit")
+                result = {"answer": entry["answer"], "source_documents": retrieved_docs}
+                if self.cache is not None:
+                    self.cache.put(key, result)
+                return {**result, "cache": {"hit": True, "layer": "semantic",
+                                            "similarity": entry["similarity"],
+                                            "matched_question": entry["question"]}}, None
+
+        tracing.count("cache_miss")
+        state = {"key": key, "docs": retrieved_docs, "query_vector": query_vector,
+                 "nhtsa_ids": nhtsa_ids, "similarity": similarity}
+        return None, state
+
+    def remember(self, question, state, answer):
+        """
+        Store a freshly generated answer in both cache layers.
+        Returns the result dict callers hand back: {"answer", "source_documents", "cache"}.
+        """
+        result = {"answer": answer, "source_documents": state["docs"]}
+        if self.cache is not None:
+            self.cache.put(state["key"], result)
+        if self.semantic_cache is not None and state["query_vector"] is not None:
+            self.semantic_cache.add(state["query_vector"], question, state["nhtsa_ids"], answer,
+                                    scope=self.model_id)
+        return {**result, "cache": {"hit": False, "layer": None, "similarity": state["similarity"]}}
+
+    def __call__(self, inputs):
+        question = inputs["question"]
+        with tracing.trace("query", question=question):
+            cached, state = self.retrieve_or_cached(question)
+            if cached is not None:
+                return cached
+
+            answer = generate_answer(question, state["docs"], self.llm)
+            return self.remember(question, state, answer)
+
+    def stream(self, inputs):
+        """
+        Same as calling the chain, but the answer comes back as a token generator.
+        Returns {"answer_stream", "source_documents", "cache"}; the caches are
+        filled once the stream has been fully consumed.
+        """
+        question = inputs["question"]
+        # Tokens are consumed after this returns, so the trace covers cache and retrieval;
+        # callers that render the stream can wrap the whole thing in their own trace
+        with tracing.trace("query", question=question):
+            cached, state = self.retrieve_or_cached(question)
+        if cached is not None:
+            return {"answer_stream": iter([cached["answer"]]),
+                    "source_documents": cached["source_documents"],
+                    "cache": cached["cache"]}
+
+        def answer_stream():
+            tokens = []
+            with tracing.span("prompt"):
+                prompt = build_prompt(question, state["docs"])
+            with tracing.span("llm_stream") as span:
+                for token in stream_llm(self.llm, prompt):
+                    if not tokens:
+                        span.set(first_token_ms=round((time.perf_counter() - span.start) * 1000, 3))
+                    tokens.append(token)
+                    yield token
+            self.remember(question, state, "".join(tokens).strip())
+
+        return {"answer_stream": answer_stream(),
+                "source_documents": state["docs"],
+                "cache": {"hit": False, "layer": None, "similarity": state["similarity"]}}
 
-    #Converts the vector store into retriever
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+    def answer_batch(self, questions, max_workers=4):
+        """
+        Answer many questions in one pass: retrieval runs batched (one embedding
+        call, one FAISS search) and the LLM calls run max_workers at a time, so a
+        local micro-batching LLM can merge them. Repeated questions are answered once.
+        Returns results in question order, like calling the chain on each;
+        a question whose LLM call failed gets answer None and an "error" message.
+        """
+        results = [None] * len(questions)
+        pending = {}
+        for i, question in enumerate(questions):
+            cached, key = self._exact_lookup(question)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.setdefault(key, []).append(i)
 
-    return lambda inputs: rag_pipeline(inputs, retriever, llm)
+        firsts = [positions[0] for positions in pending.values()]
+        retrieved = retrieve_documents_batch(
+            [questions[i] for i in firsts], self.vectorstore, self._fetch_k(), self.metadata_index,
+            self.keyword_index, self.diversifier
+        )
 
-def rag_pipeline(inputs,retriever,llm):
+        to_generate = []
+        for (key, positions), (docs, query_vector) in zip(pending.items(), retrieved):
+            question = questions[positions[0]]
+            cached, state = self._semantic_lookup(question, key, self._rerank(question, docs), query_vector)
+            if cached is not None:
+                for i in positions:
+                    results[i] = cached
+            else:
+                to_generate.append((positions, state))
+
+        def answer(item):
+            # One failed LLM call should not sink the rest of the batch
+            positions, state = item
+            question = questions[positions[0]]
+            try:
+                return self.remember(question, state, generate_answer(question, state["docs"], self.llm))
+            except Exception as e:
+                print(f"LLM call failed for {question!r}: {e}")
+                return {"answer": None, "error": str(e), "source_documents": state["docs"],
+                        "cache": {"hit": False, "layer": None, "similarity": state["similarity"]}}
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch-llm") as pool:
+            for (positions, _), result in zip(to_generate, pool.map(answer, to_generate)):
+                for i in positions:
+                    results[i] = result
+        return results
+
+
+def build_rag_chain_manual(vectorstore, k=5, cache=None, semantic_cache=None, keyword_index=None,
+                           metadata_index=None, llm=None, reranker=None, diversifier=None):
+    print("Building enhanced RAG chain")
+    if llm is None:
+        llm = get_llm()
+
+    if cache is None:
+        cache = QueryCache()
+    if semantic_cache is None:
+        semantic_cache = SemanticCache()
+    if metadata_index is None:
+        metadata_index = MetadataIndex.from_vectorstore(vectorstore)
+    # Cached answers are keyed by the model that wrote them (a loading LLM is still a Future)
+    model_id = getattr(llm, "model_id", None) or active_model_id()
+    return RAGChain(vectorstore, llm, k, model_id, cache, semantic_cache, metadata_index, keyword_index,
+                    reranker, diversifier)
+
+def rag_pipeline(inputs,retriever,llm,reranker=None):
     question = inputs["question"]
     print(f"Processing question: {question}")
     
 
     retrieved_docs = retriever.get_relevant_documents(question)
     #Returns the top 5 search similar to the query
+    #With a reranker, set the retriever's k to reranker.fetch_k so it has candidates to choose from
+    if reranker is not None:
+        retrieved_docs = reranker.rerank(question, retrieved_docs)
     print(f"Retrieved {len(retrieved_docs)} documents")
     
-    #Combines all the retrieved docs into one document block for llm
-    context = "\n\n".join([doc.page_content for doc in retrieved_docs])
+    answer = generate_answer(question, retrieved_docs, llm)
+
+    return {
+        "answer": answer,
+        "source_documents": retrieved_docs
+    }
+
+def generate_answer(question, retrieved_docs, llm):
+    """Ask the LLM about the retrieved recalls"""
+    # Return the final answer from llm
+    with tracing.span("prompt"):
+        prompt = build_prompt(question, retrieved_docs)
+    with tracing.span("llm"):
+        answer = llm(prompt)
+
+    return answer.strip()
+
+def build_prompt(question, retrieved_docs, token_budget=None):
+    """Build the LLM prompt from the question and the retrieved recalls"""
+    # The recalls are packed into whatever the input limit leaves after the instructions
+    budget = (token_budget or prompt_token_budget()) - count_tokens(_fill_prompt(question, ""))
+    return _fill_prompt(question, pack_context(question, retrieved_docs, budget))
 
+def _fill_prompt(question, context):
     prompt = f"""You are a vehicle safety expert analyzing recall data. 
     Based on the recall information provided, give a comprehensive but concise answer about the recalls.
 
@@ -43,10 +289,4 @@ Instructions:
 
 Answer:"""
     
-    # Return the final answer from llm
-    answer = llm(prompt)
-    
-    return {
-        "answer": answer.strip(),
-        "source_documents": retrieved_docs
-    }
\ No newline at end of file
+    return prompt
\ No newline at end of file
@@ -1,6 +1,11 @@
 # pipeline/recall_categorizer.py
 import re
 from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
 
 
 
@@ -22,6 +27,94 @@ def format_recall_date(date_str):
     except:
         return str(date_str)
 
+# Category rules, shared by categorize_recall and categorize_series.
+# Each rule is (keywords, target): keywords=None is the fallback branch, the target is
+# either a category name or a nested rule list. Rules are tried in order and keywords
+# match as substrings of the component; rules listed under SUMMARY_KEYWORD_RULES also
+# look at the summary.
+CATEGORY_RULES = [
+    (['WINDSHIELD'], [
+        (['WIPER'], [
+            (['MOTOR'], 'WINDSHIELD WIPER MOTOR'),
+            (['LINKAGE', 'LINK'], 'WINDSHIELD WIPER LINKAGE'),
+            (None, 'WINDSHIELD WIPER'),
+        ]),
+        (['DEFOG', 'DEFROST'], 'WINDSHIELD DEFROSTER'),
+        (None, 'WINDSHIELD'),
+    ]),
+    (['WIPER'], [
+        (['MOTOR'], 'WINDSHIELD WIPER MOTOR'),
+        (['ARM'], 'WINDSHIELD WIPER ARM'),
+        (['BLADE'], 'WINDSHIELD WIPER BLADE'),
+        (None, 'WINDSHIELD WIPER'),
+    ]),
+    (['SEAT BELT', 'SEATBELT', 'BELT'], [
+        (['PRETENSIONER'], 'SEAT BELT PRETENSIONER'),
+        (['ANCHOR', 'ANCHORAGE'], 'SEAT BELT ANCHORAGE'),
+        (['RETRACTOR'], 'SEAT BELT RETRACTOR'),
+        (None, 'SEAT BELT SYSTEM'),
+    ]),
+    (['ENGINE', 'MOTOR', 'CYLINDER'], [
+        (['COOLING'], 'ENGINE COOLING'),
+        (['OIL'], 'ENGINE OIL SYSTEM'),
+        (None, 'ENGINE'),
+    ]),
+    (['BRAKE', 'BRAKING'], [
+        (['PAD'], 'BRAKE PADS'),
+        (['FLUID'], 'BRAKE FLUID'),
+        (['LINE', 'HOSE'], 'BRAKE LINES'),
+        (None, 'BRAKE SYSTEM'),
+    ]),
+    (['ELECTRICAL', 'WIRING', 'BATTERY', 'ALTERNATOR'], 'ELECTRICAL SYSTEM'),
+    (['FUEL', 'GAS', 'TANK'], 'FUEL SYSTEM'),
+    (['STEERING', 'WHEEL'], 'STEERING SYSTEM'),
+    (['AIRBAG', 'AIR BAG'], 'AIRBAG SYSTEM'),
+    (['TRANSMISSION', 'GEAR'], 'TRANSMISSION'),
+    (['SUSPENSION', 'SHOCK', 'STRUT'], 'SUSPENSION SYSTEM'),
+]
+SUMMARY_KEYWORD_RULES = {'SEAT BELT PRETENSIONER'}
+
+HIGH_RISK_KEYWORDS = [
+    'CRASH', 'FIRE', 'EXPLOSION', 'DEATH', 'INJURY', 'FATAL',
+    'BRAKE FAILURE', 'STEERING LOSS', 'AIRBAG DEPLOY',
+    'FUEL LEAK', 'CARBON MONOXIDE', 'SEAT BELT', 'RESTRAINT'
+]
+MEDIUM_RISK_KEYWORDS = [
+    'MALFUNCTION', 'FAILURE', 'DEFECT', 'UNSAFE',
+    'VISIBILITY', 'IMPAIRED', 'REDUCED PERFORMANCE'
+]
+
+
+def _keyword_regex(keywords):
+    """One alternation regex that matches if any keyword occurs as a substring"""
+    return re.compile('|'.join(re.escape(keyword) for keyword in keywords))
+
+
+def _compile_rules(rules):
+    return [
+        (None if keywords is None else _keyword_regex(keywords),
+         _compile_rules(target) if isinstance(target, list) else target)
+        for keywords, target in rules
+    ]
+
+
+COMPILED_CATEGORY_RULES = _compile_rules(CATEGORY_RULES)
+HIGH_RISK_PATTERN = _keyword_regex(HIGH_RISK_KEYWORDS)
+MEDIUM_RISK_PATTERN = _keyword_regex(MEDIUM_RISK_KEYWORDS)
+PRETENSIONER_PATTERN = _keyword_regex(['PRETENSIONER'])
+
+
+def _match_rules(rules, component, summary_hit):
+    """Category of the first matching rule (descending into nested rules), or None"""
+    for pattern, target in rules:
+        hit = pattern is None or pattern.search(component) is not None
+        if not hit and isinstance(target, str) and target in SUMMARY_KEYWORD_RULES:
+            hit = summary_hit
+        if hit:
+            return _match_rules(target, component, summary_hit) if isinstance(target, list) else target
+    return None
+
+
 def categorize_recall(component, summary="", nhtsa_id=""):
     """
     Categorize recalls based on component and summary information
@@ -29,93 +122,15 @@ def categorize_recall(component, summary="", nhtsa_id=""):
     """
     component = str(component).upper()
     summary = str(summary).upper()
-    
-    # Windshield-related categorization
-    if 'WINDSHIELD' in component:
-        if 'WIPER' in component:
-            if 'MOTOR' in component:
-                return 'WINDSHIELD WIPER MOTOR'
-            elif 'LINKAGE' in component or 'LINK' in component:
-                return 'WINDSHIELD WIPER LINKAGE'
-            else:
-                return 'WINDSHIELD WIPER'
-        elif 'DEFOG' in component or 'DEFROST' in component:
-            return 'WINDSHIELD DEFROSTER'
-        else:
-            return 'WINDSHIELD'
-    
-    # Wiper-specific (not windshield)
-    elif 'WIPER' in component:
-        if 'MOTOR' in component:
-            return 'WINDSHIELD WIPER MOTOR'
-        elif 'ARM' in component:
-            return 'WINDSHIELD WIPER ARM'
-        elif 'BLADE' in component:
-            return 'WINDSHIELD WIPER BLADE'
-        else:
-            return 'WINDSHIELD WIPER'
-    
-    # Seat belt specific categorization
-    elif any(keyword in component for keyword in ['SEAT BELT', 'SEATBELT', 'BELT']):
-        if 'PRETENSIONER' in component or 'PRETENSIONER' in summary:
-            return 'SEAT BELT PRETENSIONER'
-        elif 'ANCHOR' in component or 'ANCHORAGE' in component:
-            return 'SEAT BELT ANCHORAGE'
-        elif 'RETRACTOR' in component:
-            return 'SEAT BELT RETRACTOR'
-        else:
-            return 'SEAT BELT SYSTEM'
-    
-    # Engine related
-    elif any(keyword in component for keyword in ['ENGINE', 'MOTOR', 'CYLINDER']):
-        if 'COOLING' in component:
-            return 'ENGINE COOLING'
-        elif 'OIL' in component:
-            return 'ENGINE OIL SYSTEM'
-        else:
-            return 'ENGINE'
-    
-    # Brake related
-    elif any(keyword in component for keyword in ['BRAKE', 'BRAKING']):
-        if 'PAD' in component:
-            return 'BRAKE PADS'
-        elif 'FLUID' in component:
-            return 'BRAKE FLUID'
-        elif 'LINE' in component or 'HOSE' in component:
-            return 'BRAKE LINES'
-        else:
-            return 'BRAKE SYSTEM'
-    
-    # Electrical
-    elif any(keyword in component for keyword in ['ELECTRICAL', 'WIRING', 'BATTERY', 'ALTERNATOR']):
-        return 'ELECTRICAL SYSTEM'
-    
-    # Fuel system
-    elif any(keyword in component for keyword in ['FUEL', 'GAS', 'TANK']):
-        return 'FUEL SYSTEM'
-    
-    # Steering
-    elif any(keyword in component for keyword in ['STEERING', 'WHEEL']):
-        return 'STEERING SYSTEM'
-    
-    # Airbag
-    elif 'AIRBAG' in component or 'AIR BAG' in component:
-        return 'AIRBAG SYSTEM'
-    
-    # Transmission
-    elif any(keyword in component for keyword in ['TRANSMISSION', 'GEAR']):
-        return 'TRANSMISSION'
-    
-    # Suspension
-    elif any(keyword in component for keyword in ['SUSPENSION', 'SHOCK', 'STRUT']):
-        return 'SUSPENSION SYSTEM'
-    
+
+    category = _match_rules(COMPILED_CATEGORY_RULES, component, PRETENSIONER_PATTERN.search(summary) is not None)
+    if category is not None:
+        return category
+
     # Default: clean up the component name
-    else:
-        # Remove common prefixes and clean up
-        cleaned = re.sub(r'^(VEHICLE|AUTO|CAR)\s*', '', component)
-        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-        return cleaned if cleaned else 'OTHER COMPONENT'
+    cleaned = re.sub(r'^(VEHICLE|AUTO|CAR)\s*', '', component)
+    cleaned = re.sub(r'\s+', ' ', cleaned).strip()
+    return cleaned if cleaned else 'OTHER COMPONENT'
 
 def get_recall_severity(summary, component):
     """
@@ -123,62 +138,89 @@ def get_recall_severity(summary, component):
     Returns: 'HIGH', 'MEDIUM', 'LOW'
     """
     summary = str(summary).upper()
-    component = str(component).upper()
-    
-    high_risk_keywords = [
-        'CRASH', 'FIRE', 'EXPLOSION', 'DEATH', 'INJURY', 'FATAL',
-        'BRAKE FAILURE', 'STEERING LOSS', 'AIRBAG DEPLOY',
-        'FUEL LEAK', 'CARBON MONOXIDE', 'SEAT BELT', 'RESTRAINT'
-    ]
-    
-    medium_risk_keywords = [
-        'MALFUNCTION', 'FAILURE', 'DEFECT', 'UNSAFE',
-        'VISIBILITY', 'IMPAIRED', 'REDUCED PERFORMANCE'
-    ]
-    
-    if any(keyword in summary for keyword in high_risk_keywords):
+    if HIGH_RISK_PATTERN.search(summary):
         return 'HIGH'
-    elif any(keyword in summary for keyword in medium_risk_keywords):
+    elif MEDIUM_RISK_PATTERN.search(summary):
         return 'MEDIUM'
     else:
         return 'LOW'
 
+class RecallRecord(NamedTuple):
+    """
+    Display fields of one recall, built once at load time and kept in doc.metadata['record'].
+    The flat store persists it as a list in field order, so documents read back
+    from disk carry the same record without re-parsing page_content.
+    """
+    nhtsa_id: str
+    manufacturer: str
+    component: str
+    summary: str
+    consequence: str
+    action: str
+    category: str
+    severity: str
+    recall_date: str
+    formatted_date: str
+
+
+def get_record(doc):
+    """The RecallRecord that travels with a document"""
+    return doc.metadata['record']
+
+
 def format_recall_for_display(doc):
     """
     Format a recall document for consistent display
     """
-    content_lines = doc.page_content.split('\n')
-    
-    # Parse the structured content
-    recall_info = {}
-    for line in content_lines:
-        if ':' in line:
-            key, value = line.split(':', 1)
-            recall_info[key.strip()] = value.strip()
-    
-    # Extract basic information
-    nhtsa_id = recall_info.get('Recall ID', 'Unknown')
-    manufacturer = recall_info.get('Manufacturer', 'Unknown')
-    component = recall_info.get('Component', 'Unknown')
-    summary = recall_info.get('Summary', 'No summary available')
-    action = recall_info.get('Action', 'No action specified')
-    recall_date = recall_info.get('Recall Date', doc.metadata.get('recall_date', 'Unknown'))
-    
-    # Format date for display
-    formatted_date = format_recall_date(recall_date)
-    
-    # Get category and severity
-    category = categorize_recall(component, summary, nhtsa_id)
-    severity = get_recall_severity(summary, component)
-    
-    return {
-        'nhtsa_id': nhtsa_id,
-        'manufacturer': manufacturer,
-        'component': component,
-        'summary': summary,
-        'action': action,
-        'category': category,
-        'severity': severity,
-        'recall_date': recall_date,
-        'formatted_date': formatted_date
-    }
\ No newline at end of file
+    return get_record(doc)._asdict()
+
+def _apply_rules(rules, components, summary_hits, codes, remaining, out):
+    """Walk the rule table once for all rows still in `remaining`"""
+    for pattern, target in rules:
+        if pattern is None:
+            hit = remaining
+        else:
+            component_hit = components.str.contains(pattern).to_numpy()[codes]
+            if isinstance(target, str) and target in SUMMARY_KEYWORD_RULES:
+                component_hit = component_hit | summary_hits
+            hit = remaining & component_hit
+
+        if isinstance(target, list):
+            _apply_rules(target, components, summary_hits, codes, hit, out)
+        else:
+            out[hit] = target
+        remaining = remaining & ~hit
+    return remaining
+
+
+def categorize_series(components, summaries):
+    """
+    Vectorized categorize_recall over whole columns.
+    Keyword rules run once per distinct component value and are broadcast back
+    to the rows, so the result matches categorize_recall row by row.
+    """
+    components = pd.Series(components).astype(str).str.upper().reset_index(drop=True)
+    summaries = pd.Series(summaries).astype(str).str.upper().reset_index(drop=True)
+
+    codes, unique_components = pd.factorize(components)
+    unique_components = pd.Series(unique_components, dtype=object)
+    summary_hits = summaries.str.contains(PRETENSIONER_PATTERN).to_numpy()
+
+    out = np.empty(len(components), dtype=object)
+    unmatched = _apply_rules(COMPILED_CATEGORY_RULES, unique_components, summary_hits, codes,
+                             np.ones(len(components), dtype=bool), out)
+
+    # Default: clean up the component name
+    cleaned = (unique_components.str.replace(r'^(VEHICLE|AUTO|CAR)\s*', '', regex=True)
+               .str.replace(r'\s+', ' ', regex=True).str.strip())
+    cleaned = cleaned.where(cleaned != '', 'OTHER COMPONENT').to_numpy()
+    out[unmatched] = cleaned[codes[unmatched]]
+    return out
+
+
+def severity_series(summaries):
+    """Vectorized get_recall_severity over a whole summary column"""
+    summaries = pd.Series(summaries).astype(str).str.upper()
+    high = summaries.str.contains(HIGH_RISK_PATTERN).to_numpy()
+    medium = summaries.str.contains(MEDIUM_RISK_PATTERN).to_numpy()
+    return np.select([high, medium], ['HIGH', 'MEDIUM'], default='LOW').astype(object)
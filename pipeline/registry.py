@@ -0,0 +1,165 @@
+# pipeline/registry.py
+# Process-wide registry of loaded models and index versions.
+# Every Streamlit session, batch job and rebuild in a process asks the registry
+# instead of loading its own copy:
+#   handle = registry.acquire("embedder:all-MiniLM-L6-v2", load_model)
+#   with handle.lease() as model:   # pins the current version for one query
+#       ...
+#   handle.release()                # the last holder frees it
+# publish() swaps in a new version (e.g. a rebuilt index) atomically; queries
+# already running keep the version they leased and it is freed once they finish.
+# Across processes, index memory is shared through the memory-mapped flat store.
+from contextlib import contextmanager
+import threading
+
+
+class _Version:
+    def __init__(self, value, number):
+        self.value = value
+        self.number = number
+        self.leases = 0
+
+
+class _Slot:
+    def __init__(self):
+        self.holders = 0
+        self.current = None
+        self.retired = []
+        self.load_lock = threading.Lock()
+
+
+class Handle:
+    """A holder's reference to a registry name; follows the name across swaps"""
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.released = False
+
+    @property
+    def value(self):
+        """The current version's value, unpinned (fine for values that are never swapped)"""
+        return self.registry._slot(self.name).current.value
+
+    @property
+    def version(self):
+        return self.registry._slot(self.name).current.number
+
+    @contextmanager
+    def lease(self):
+        """Pin the current version for the duration of the block"""
+        version = self.registry._pin(self.name)
+        try:
+            yield version.value
+        finally:
+            self.registry._unpin(self.name, version)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.registry._release(self.name)
+
+
+class Registry:
+    """
+    Reference-counted store of shared resources by name. A name lives while it
+    has holders; each version of it lives while it is current or leased.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def _slot(self, name):
+        with self._lock:
+            slot = self._slots.get(name)
+            if slot is None or slot.current is None:
+                raise KeyError(f"{name} is not loaded")
+            return slot
+
+    def acquire(self, name, loader):
+        """
+        Hold name, loading it with loader() if no one holds it yet. Concurrent
+        first callers wait for a single load. Returns a Handle.
+        """
+        with self._lock:
+            slot = self._slots.setdefault(name, _Slot())
+            slot.holders += 1
+        try:
+            with slot.load_lock:
+                if slot.current is None:
+                    value = loader()
+                    with self._lock:
+                        slot.current = _Version(value, 1)
+                    print(f"Registry loaded {name}")
+        except BaseException:
+            self._release(name)
+            raise
+        return Handle(self, name)
+
+    def publish(self, name, value):
+        """
+        Make value the current version of name in one step. New leases get it
+        straight away; the previous version is freed once its leases drain.
+        Returns the new version number.
+        """
+        with self._lock:
+            slot = self._slots.get(name)
+            if slot is None or slot.current is None:
+                raise KeyError(f"{name} is not loaded")
+            old = slot.current
+            slot.current = _Version(value, old.number + 1)
+            if old.leases:
+                slot.retired.append(old)
+                print(f"Registry swapped {name} to version {slot.current.number}, "
+                      f"version {old.number} drains {old.leases} queries")
+            else:
+                print(f"Registry swapped {name} to version {slot.current.number}, freed version {old.number}")
+            return slot.current.number
+
+    def _pin(self, name):
+        with self._lock:
+            slot = self._slots.get(name)
+            if slot is None or slot.current is None:
+                raise KeyError(f"{name} is not loaded")
+            slot.current.leases += 1
+            return slot.current
+
+    def _unpin(self, name, version):
+        with self._lock:
+            version.leases -= 1
+            slot = self._slots.get(name)
+            if slot is not None and version.leases == 0 and version in slot.retired:
+                slot.retired.remove(version)
+                print(f"Registry freed {name} version {version.number}")
+            self._drop_if_unused(name)
+
+    def _release(self, name):
+        with self._lock:
+            self._slots[name].holders -= 1
+            self._drop_if_unused(name)
+
+    def _drop_if_unused(self, name):
+        # Caller holds the lock
+        slot = self._slots.get(name)
+        if slot is None or slot.holders > 0:
+            return
+        if slot.current is not None and slot.current.leases > 0 or slot.retired:
+            return
+        del self._slots[name]
+        if slot.current is not None:
+            print(f"Registry freed {name}, no holders left")
+
+    def stats(self):
+        """{name: {"holders", "version", "leases", "draining"}}"""
+        with self._lock:
+            return {
+                name: {"holders": slot.holders,
+                       "version": slot.current.number if slot.current else None,
+                       "leases": slot.current.leases if slot.current else 0,
+                       "draining": {version.number: version.leases for version in slot.retired}}
+                for name, slot in self._slots.items()
+            }
+
+
+registry = Registry()
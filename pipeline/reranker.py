@@ -0,0 +1,182 @@
+# pipeline/reranker.py
+# Second retrieval stage: a small cross-encoder re-scores the over-fetched candidates.
+#   RECALL_RERANK=1                  turn re-ranking on in create_service
+#   RECALL_RERANK_MODEL              cross-encoder model id or directory
+#   RECALL_RERANK_FETCH_K            first-stage candidates to re-score
+#   RECALL_RERANK_TOP_K              documents kept for the prompt after re-ranking
+#   RECALL_RERANK_BUDGET_MS          time allowed for scoring before falling back
+#   RECALL_RERANK_MIN_SCORE          optional score below which candidates are dropped
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import os
+import threading
+import time
+import weakref
+
+from dotenv import load_dotenv
+
+from pipeline import tracing
+from pipeline.context_packer import split_fields
+from pipeline.query_cache import normalize_question
+from pipeline.registry import registry
+
+load_dotenv()
+
+RERANK_ENABLED = os.getenv("RECALL_RERANK", "0") == "1"
+RERANK_MODEL = os.getenv("RECALL_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_FETCH_K = int(os.getenv("RECALL_RERANK_FETCH_K", "20"))
+RERANK_TOP_K = int(os.getenv("RECALL_RERANK_TOP_K", "3"))
+RERANK_BUDGET_MS = float(os.getenv("RECALL_RERANK_BUDGET_MS", "250"))
+RERANK_MIN_SCORE = os.getenv("RECALL_RERANK_MIN_SCORE")
+
+
+def rerank_text(doc):
+    """Header and the descriptive fields only; the cross-encoder reads up to 512 tokens"""
+    header, fields = split_fields(doc.page_content)
+    return " ".join([header] + [fields[label] for label in ("Issue", "Summary", "Consequence") if label in fields])
+
+
+class CrossEncoderReranker:
+    """
+    Re-scores first-stage candidates with a cross-encoder in one batched pass.
+    Scores are cached per (question, nhtsa_id). Scoring runs on a worker thread
+    and the caller waits at most budget_ms; past that the first-stage order is
+    used, and the scores still land in the cache for the next time. At most one
+    scoring job is in flight: while it runs, other queries fall back instead of
+    queueing behind it.
+    The model loads on its own background thread on first use; until it is
+    ready the first-stage order is used. The shared model is held until close() or until
+    the re-ranker is garbage collected.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, fetch_k=RERANK_FETCH_K, top_k=RERANK_TOP_K,
+                 budget_ms=RERANK_BUDGET_MS, min_score=None, cache_size=10_000):
+        self.model_name = model_name
+        self.fetch_k = fetch_k
+        self.top_k = top_k
+        self.budget = budget_ms / 1000
+        self.min_score = min_score
+        self.cache_size = cache_size
+        self.reranked = 0
+        self.fallbacks = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self._model = None
+        self._pending = None
+        self._release = None
+
+    def _load_model(self):
+        def load():
+            from sentence_transformers import CrossEncoder
+
+            print(f"Loading cross-encoder {self.model_name}")
+            return CrossEncoder(self.model_name, device="cpu")
+
+        # Re-rankers in the same process share one copy of the model
+        handle = registry.acquire(f"cross-encoder:{self.model_name}", load)
+        self._release = weakref.finalize(self, handle.release)
+        return handle.value
+
+    @property
+    def model(self):
+        """The cross-encoder if it has finished loading, else None (loading starts on first access)"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # Kept off the scoring thread so a slow load never delays scoring
+                    loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker-load")
+                    self._model = loader.submit(self._load_model)
+                    loader.shutdown(wait=False)
+        if self._model.done():
+            return self._model.result()
+        return None
+
+    def start_loading(self):
+        """Begin loading the cross-encoder in the background; returns the loading future"""
+        self.model
+        return self._model
+
+    def _score(self, model, question, keys, texts):
+        scores = model.predict([(question, text) for text in texts], batch_size=len(texts))
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = float(score)
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return scores
+
+    def _fallback(self, docs, fallback_k, reason):
+        self.fallbacks += 1
+        tracing.count("rerank_fallback")
+        print(f"Re-ranking skipped ({reason}), keeping first-stage order")
+        return docs[:fallback_k]
+
+    def rerank(self, question, docs, fallback_k=None):
+        """
+        Best top_k of the candidate docs by cross-encoder score, or the first
+        fallback_k in first-stage order when the model is not ready or the
+        latency budget runs out
+        """
+        fallback_k = fallback_k or self.top_k
+        if len(docs) <= 1:
+            return docs
+        with tracing.span("rerank", candidates=len(docs)):
+            start = time.perf_counter()
+            normalized = normalize_question(question)
+            keys = [(normalized, doc.metadata.get("nhtsa_id")) for doc in docs]
+            with self._lock:
+                scores = {key: self._cache[key] for key in keys if key in self._cache}
+            missing = [i for i, key in enumerate(keys) if key not in scores]
+
+            if missing:
+                try:
+                    model = self.model
+                except Exception as e:
+                    return self._fallback(docs, fallback_k, f"model failed to load: {e}")
+                if model is None:
+                    return self._fallback(docs, fallback_k, "model still loading")
+                with self._lock:
+                    # A job past its budget keeps running; don't pile more up behind it
+                    busy = self._pending is not None and not self._pending.done()
+                    if not busy:
+                        future = self._pending = self._executor.submit(
+                            self._score, model, question, [keys[i] for i in missing],
+                            [rerank_text(docs[i]) for i in missing])
+                if busy:
+                    return self._fallback(docs, fallback_k, "scorer busy with an earlier query")
+                try:
+                    new_scores = future.result(timeout=max(self.budget - (time.perf_counter() - start), 0))
+                except TimeoutError:
+                    return self._fallback(docs, fallback_k, f"over the {self.budget * 1000:.0f} ms budget")
+                except Exception as e:
+                    return self._fallback(docs, fallback_k, f"scoring failed: {e}")
+                scores.update(zip((keys[i] for i in missing), map(float, new_scores)))
+
+            self.reranked += 1
+            order = sorted(range(len(docs)), key=lambda i: -scores[keys[i]])
+            if self.min_score is not None:
+                # Drop candidates the cross-encoder rates irrelevant, but never all of them
+                order = [i for i in order if scores[keys[i]] >= self.min_score] or order[:1]
+            return [docs[i] for i in order[:self.top_k]]
+
+    def close(self):
+        """Stop the worker thread and drop this re-ranker's hold on the shared model"""
+        self._executor.shutdown(wait=False)
+        if self._release is not None:
+            self._release()
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._cache)
+        return {"reranked": self.reranked, "fallbacks": self.fallbacks, "cached_scores": cached,
+                "budget_ms": self.budget * 1000}
+
+
+def get_reranker():
+    """The configured re-ranker, or None when RECALL_RERANK is off"""
+    if not RERANK_ENABLED:
+        return None
+    min_score = float(RERANK_MIN_SCORE) if RERANK_MIN_SCORE else None
+    return CrossEncoderReranker(min_score=min_score)
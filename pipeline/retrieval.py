@@ -0,0 +1,198 @@
+# pipeline/retrieval.py
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from pipeline import tracing
+from pipeline.ann_index import search_candidates
+from pipeline.embedder import embed_queries
+from pipeline.query_parser import parse_query
+
+RRF_K = 60
+
+
+def vector_search_ids(vectorstore, query_vector, k, candidate_positions=None):
+    """
+    Top-k docstore ids for a query vector.
+    With candidate_positions only those FAISS rows are scored.
+    """
+    vector = np.array([query_vector], dtype=np.float32)
+    if getattr(vectorstore, "_normalize_L2", False):
+        faiss.normalize_L2(vector)
+
+    if candidate_positions is not None:
+        _, positions = search_candidates(vectorstore.index, vector, k, candidate_positions)
+    else:
+        _, positions = vectorstore.index.search(vector, min(k, vectorstore.index.ntotal))
+
+    return [vectorstore.index_to_docstore_id[int(p)] for p in positions[0] if p != -1]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse several ranked id lists: score(id) = sum of 1 / (k + rank)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def vector_search_ids_batch(vectorstore, query_vectors, k):
+    """Top-k docstore ids for many query vectors with a single FAISS search"""
+    vectors = np.array(query_vectors, dtype=np.float32)
+    if getattr(vectorstore, "_normalize_L2", False):
+        faiss.normalize_L2(vectors)
+
+    _, positions = vectorstore.index.search(vectors, min(k, vectorstore.index.ntotal))
+    return [[vectorstore.index_to_docstore_id[int(p)] for p in row if p != -1] for row in positions]
+
+
+def _direct_lookup(question, vectorstore, k, keyword_index):
+    """Documents for NHTSA ids named in the question, or None"""
+    if keyword_index is None:
+        return None
+    with tracing.span("id_lookup"):
+        doc_ids = keyword_index.lookup_ids(question)
+    if not doc_ids:
+        return None
+    print(f"Direct NHTSA id lookup: {doc_ids}")
+    return [vectorstore.docstore.search(doc_id) for doc_id in doc_ids[:k]]
+
+
+def metadata_candidates(question, metadata_index):
+    """FAISS rows allowed by the constraints parsed from the question, or None for all rows"""
+    if metadata_index is None:
+        return None
+    with tracing.span("metadata_filter") as span:
+        constraints = parse_query(
+            question,
+            manufacturers=metadata_index.values("manufacturer"),
+            components=metadata_index.values("component"),
+        )
+        candidate_positions = metadata_index.candidates(constraints)
+        span.set(candidates=None if candidate_positions is None else len(candidate_positions))
+    if candidate_positions is not None and len(candidate_positions) > 0:
+        print(f"Filtering on {sorted(constraints)}: {len(candidate_positions)} candidate recalls")
+    elif candidate_positions is not None:
+        print(f"No recalls match {sorted(constraints)}, searching everything")
+        candidate_positions = None
+    return candidate_positions
+
+
+def _fetch_k(k, keyword_index, diversifier=None):
+    # A diversifier needs a deeper candidate list to find k distinct recalls
+    depth = k if diversifier is None else max(diversifier.fetch_k, k)
+    # Over-fetch from both retrievers so fusion has something to work with
+    return depth if keyword_index is None else max(4 * k, 20, depth)
+
+
+def _with_duplicates(doc, duplicate_ids):
+    """Copy of a representative document noting the near-duplicates folded into it"""
+    nhtsa_ids = [doc_id.split("#")[0] for doc_id in duplicate_ids]
+    own_id = str(doc.metadata.get("nhtsa_id"))
+    return Document(page_content=doc.page_content, metadata={
+        **doc.metadata,
+        "duplicate_count": len(duplicate_ids),
+        "duplicate_ids": [nhtsa_id for nhtsa_id in dict.fromkeys(nhtsa_ids) if nhtsa_id != own_id],
+    })
+
+
+def _rank_documents(question, vectorstore, k, keyword_index, candidate_positions, vector_ids,
+                    query_vector=None, diversifier=None):
+    """
+    Fuse the vector ranking with BM25 (when there is a keyword index) and load
+    the top k. With a diversifier, near-duplicates among the deeper candidate
+    list are collapsed first and each kept document gets duplicate_count and
+    duplicate_ids in its metadata.
+    """
+    depth = k if diversifier is None else _fetch_k(k, None, diversifier)
+    if keyword_index is None:
+        doc_ids = vector_ids[:depth]
+    else:
+        allowed_ids = None
+        if candidate_positions is not None:
+            allowed_ids = {vectorstore.index_to_docstore_id[int(p)] for p in candidate_positions}
+        with tracing.span("keyword_search"):
+            keyword_ids = keyword_index.search(question, _fetch_k(k, keyword_index, diversifier), allowed_ids)
+        doc_ids = reciprocal_rank_fusion([vector_ids, keyword_ids])[:depth]
+
+    if diversifier is None:
+        with tracing.span("docstore_fetch", documents=len(doc_ids)):
+            return [vectorstore.docstore.search(doc_id) for doc_id in doc_ids]
+
+    selected = diversifier.select(vectorstore, query_vector, doc_ids, k)
+    with tracing.span("docstore_fetch", documents=len(selected)):
+        return [_with_duplicates(vectorstore.docstore.search(doc_id), duplicates) for doc_id, duplicates in selected]
+
+
+def retrieve_documents(question, vectorstore, k=5, metadata_index=None, keyword_index=None, diversifier=None):
+    """
+    Retrieve the top-k recalls for a question.
+    Returns (documents, question embedding); the embedding is reused by the
+    semantic cache and is None when no embedding was needed.
+
+    - Questions naming NHTSA ids are answered by a direct id lookup.
+    - With a metadata index, constraints parsed from the question (manufacturer,
+      component, year, do-not-drive, park-outside) restrict the search to the
+      matching recalls before any vectors are scored.
+    - With a keyword index, BM25 and vector rankings are combined with
+      reciprocal rank fusion.
+    - With a diversifier, near-duplicate recalls are collapsed and the rest
+      picked by maximal marginal relevance.
+    """
+    docs = _direct_lookup(question, vectorstore, k, keyword_index)
+    if docs is not None:
+        return docs, None
+
+    with tracing.span("embed_query"):
+        query_vector = vectorstore.embeddings.embed_query(question)
+    candidate_positions = metadata_candidates(question, metadata_index)
+    with tracing.span("vector_search"):
+        vector_ids = vector_search_ids(vectorstore, query_vector, _fetch_k(k, keyword_index, diversifier),
+                                       candidate_positions)
+    docs = _rank_documents(question, vectorstore, k, keyword_index, candidate_positions, vector_ids,
+                           query_vector, diversifier)
+    return docs, query_vector
+
+
+def retrieve_documents_batch(questions, vectorstore, k=5, metadata_index=None, keyword_index=None,
+                             diversifier=None):
+    """
+    retrieve_documents for many questions at once: one embedding call for the
+    whole batch and one FAISS search for every question without metadata
+    filters (filtered questions each search their own candidate rows).
+    Returns a list of (documents, question embedding) in question order.
+    """
+    results = [None] * len(questions)
+    pending = []
+    for i, question in enumerate(questions):
+        docs = _direct_lookup(question, vectorstore, k, keyword_index)
+        if docs is not None:
+            results[i] = (docs, None)
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    # One batched call that keeps the questions out of the persistent document cache
+    with tracing.span("embed_query_batch", questions=len(pending)):
+        query_vectors = embed_queries(vectorstore.embeddings, [questions[i] for i in pending])
+    fetch_k = _fetch_k(k, keyword_index, diversifier)
+    candidates = [metadata_candidates(questions[i], metadata_index) for i in pending]
+
+    unfiltered = [n for n, positions in enumerate(candidates) if positions is None]
+    vector_ids = {}
+    if unfiltered:
+        with tracing.span("vector_search_batch", questions=len(unfiltered)):
+            batch_ids = vector_search_ids_batch(vectorstore, [query_vectors[n] for n in unfiltered], fetch_k)
+        vector_ids = dict(zip(unfiltered, batch_ids))
+
+    for n, i in enumerate(pending):
+        ids = vector_ids.get(n)
+        if ids is None:
+            with tracing.span("vector_search"):
+                ids = vector_search_ids(vectorstore, query_vectors[n], fetch_k, candidates[n])
+        docs = _rank_documents(questions[i], vectorstore, k, keyword_index, candidates[n], ids,
+                               query_vectors[n], diversifier)
+        results[i] = (docs, query_vectors[n])
+    return results
@@ -0,0 +1,97 @@
+# pipeline/semantic_cache.py
+import threading
+
+import faiss
+import numpy as np
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+    faiss.normalize_L2(vector)
+    return vector
+
+
+class SemanticCache:
+    """
+    Answer cache for paraphrased questions.
+    Past question embeddings live in a small inner-product FAISS index.
+    A new question reuses a stored answer when its cosine similarity to a past
+    question is at least `threshold` and the two retrieved nhtsa_id sets overlap
+    by at least `min_overlap` (Jaccard).
+    Entries are tagged with a scope (the chain's model id, which carries the
+    index version) and only match lookups from the same scope.
+    """
+
+    def __init__(self, threshold=0.9, min_overlap=0.5, max_entries=1000):
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._entries = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, query_vector, nhtsa_ids, candidates=5, scope=None):
+        """
+        Return (entry or None, best similarity).
+        Only the closest `candidates` past questions are checked for id overlap;
+        entries added under another scope are skipped.
+        """
+        nhtsa_ids = set(nhtsa_ids)
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                self.misses += 1
+                return None, 0.0
+
+            scores, ids = self._index.search(_unit(query_vector), min(candidates, self._index.ntotal))
+            best = float(scores[0][0])
+            for score, entry_id in zip(scores[0], ids[0]):
+                if score < self.threshold:
+                    break
+                entry = self._entries.get(int(entry_id))
+                if entry is None or entry["scope"] != scope:
+                    continue
+                union = nhtsa_ids | entry["nhtsa_ids"]
+                overlap = len(nhtsa_ids & entry["nhtsa_ids"]) / len(union) if union else 1.0
+                if overlap >= self.min_overlap:
+                    self.hits += 1
+                    return {**entry, "similarity": float(score), "overlap": overlap}, best
+
+            self.misses += 1
+            return None, best
+
+    def add(self, query_vector, question, nhtsa_ids, answer, scope=None):
+        vector = _unit(query_vector)
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap(faiss.IndexFlatIP(vector.shape[1]))
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = {"question": question, "nhtsa_ids": set(nhtsa_ids), "answer": answer,
+                                     "scope": scope}
+
+            # Evict the oldest questions once over capacity
+            if len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._index.remove_ids(np.array([oldest], dtype=np.int64))
+                del self._entries[oldest]
+
+    def clear(self):
+        with self._lock:
+            self._index = None
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+            }
@@ -0,0 +1,265 @@
+# pipeline/service.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import itertools
+import os
+import threading
+from typing import NamedTuple
+
+from pipeline import tracing
+from pipeline.analytics import load_analytics_cube
+from pipeline.data_loader import load_data
+from pipeline.diversify import get_diversifier
+from pipeline.embedder import get_embedder, LazyEmbeddings
+from pipeline.keyword_index import load_keyword_index
+from pipeline.llm_loader import MAX_BATCH_SIZE, get_llm, uses_local_llm
+from pipeline.metadata_index import MetadataIndex
+from pipeline.query_cache import normalize_question
+from pipeline.query_parser import parse_query
+from pipeline.rag_chain import build_rag_chain_manual, generate_answer
+from pipeline.registry import registry
+from pipeline.reranker import get_reranker
+from pipeline.snapshot import load_snapshot, save_snapshot
+from pipeline.vectorstore import build_vectorstore, build_vectorstore_from_csv
+
+
+_index_versions = itertools.count(1)
+
+
+class SearchIndex(NamedTuple):
+    """One version of everything retrieval reads, swapped as a unit"""
+    vectorstore: object
+    metadata_index: object
+    keyword_index: object
+    document_count: int
+    analytics_cube: object
+    version: int
+
+
+def load_search_index(data_path, persist_path, embedder, chunksize=None):
+    """
+    Open the index in persist_path, or build it from the CSV first.
+    A warm-start snapshot is opened when it matches the source CSV, skipping
+    the CSV read entirely. With chunksize the CSV is streamed into the index
+    that many rows at a time instead of being loaded whole.
+    """
+    snapshot = load_snapshot(persist_path, embedder, source_path=data_path)
+    if snapshot is not None:
+        print(f"Opened warm-start snapshot in {persist_path}")
+        vectorstore, metadata_index, document_count = snapshot
+    else:
+        if chunksize:
+            vectorstore = build_vectorstore_from_csv(data_path, embedder, persist_path, chunksize=chunksize)
+        else:
+            vectorstore = build_vectorstore(load_data(data_path), embedder, persist_path)
+        metadata_index = MetadataIndex.from_vectorstore(vectorstore)
+        save_snapshot(vectorstore, metadata_index, persist_path, source_path=data_path)
+        document_count = vectorstore.index.ntotal
+    return SearchIndex(vectorstore, metadata_index, load_keyword_index(persist_path), document_count,
+                       load_analytics_cube(persist_path), next(_index_versions))
+
+
+class RecallService:
+    """
+    Async front end for the RAG chain with no Streamlit dependency.
+    Retrieval and generation run on a thread pool so the event loop never blocks,
+    at most `max_concurrent_llm` LLM calls run at once, and identical questions
+    that are in flight at the same time share a single computation.
+    With an index handle from the registry, each query leases the current
+    SearchIndex for its retrieval, so reload_index() can swap in a new one
+    while queries are running.
+    """
+
+    def __init__(self, rag_chain, max_concurrent_llm=4, max_workers=16, document_count=None,
+                 analytics_cube=None, index=None):
+        # With an index handle the chain only supplies the LLM, caches and re-ranker;
+        # it must not keep the version it was built on alive after a swap
+        self._chain = rag_chain.with_index(None) if index is not None else rag_chain
+        self._document_count = document_count
+        self._analytics_cube = analytics_cube
+        self.index = index
+        self.data_path = None
+        self.persist_path = None
+        self.model_futures = []
+        self._llm_slots = threading.BoundedSemaphore(max_concurrent_llm)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recall-service")
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.coalesced = 0
+
+    def _chain_on(self, search_index):
+        return self._chain.with_index(search_index.vectorstore, search_index.metadata_index,
+                                      search_index.keyword_index, search_index.version)
+
+    @contextmanager
+    def _leased_chain(self):
+        """The chain on the current index version, which stays alive until the block ends"""
+        if self.index is None:
+            yield self._chain
+            return
+        with self.index.lease() as search_index:
+            yield self._chain_on(search_index)
+
+    @property
+    def chain(self):
+        """The chain on the current index version (not leased; for stats and one-off calls)"""
+        if self.index is None:
+            return self._chain
+        return self._chain_on(self.index.value)
+
+    @property
+    def document_count(self):
+        return self._document_count if self.index is None else self.index.value.document_count
+
+    @property
+    def analytics_cube(self):
+        return self._analytics_cube if self.index is None else self.index.value.analytics_cube
+
+    def _answer_sync(self, question):
+        with tracing.trace("query", question=question):
+            # The documents are plain objects once fetched, so only retrieval holds the index
+            with self._leased_chain() as chain:
+                cached, state = chain.retrieve_or_cached(question)
+            if cached is not None:
+                return cached
+
+            with tracing.span("llm_slot_wait"):
+                self._llm_slots.acquire()
+            try:
+                answer = generate_answer(question, state["docs"], chain.llm)
+            finally:
+                self._llm_slots.release()
+            return chain.remember(question, state, answer)
+
+    def _submit(self, question):
+        """Start answering a question, or join the identical request already running"""
+        key = normalize_question(question)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+
+            future = self._executor.submit(self._answer_sync, question)
+            self._inflight[key] = future
+
+        def _done(_):
+            with self._inflight_lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+        future.add_done_callback(_done)
+        return future
+
+    async def answer(self, question):
+        """Answer a question: {"answer", "source_documents", "cache"}"""
+        # Thread-pool futures can be awaited from any event loop
+        result = await asyncio.wrap_future(self._submit(question))
+        return dict(result)
+
+    async def answer_many(self, questions):
+        """Answer several questions concurrently"""
+        return await asyncio.gather(*(self.answer(question) for question in questions))
+
+    def stream(self, question):
+        """
+        Blocking streaming variant for UIs that render tokens as they arrive.
+        The LLM slot is held until the stream has been consumed.
+        Unlike answer(), identical questions are not coalesced here: each
+        stream has its own consumer, so each generates its own tokens. A
+        repeat asked after a stream has finished is served from the caches.
+        """
+        with self._leased_chain() as chain:
+            result = chain.stream({"question": question})
+        if result["cache"]["hit"]:
+            return result
+
+        def answer_stream(tokens):
+            with self._llm_slots:
+                yield from tokens
+
+        return {**result, "answer_stream": answer_stream(result["answer_stream"])}
+
+    def answer_batch(self, questions, max_workers=4):
+        """RAGChain.answer_batch on one index version for the whole batch"""
+        with self._leased_chain() as chain:
+            return chain.answer_batch(questions, max_workers)
+
+    def reload_index(self, data_path=None, persist_path=None, chunksize=None):
+        """
+        Open (or build) a new index version and swap it in. Queries keep running
+        on the current version meanwhile; it is freed once the last of them ends.
+        The paths default to the ones the service was created with; pass another
+        persist_path to switch to an index built elsewhere.
+        Returns the new registry version number.
+        """
+        if self.index is None:
+            raise RuntimeError("reload_index needs a service created with an index handle")
+        search_index = load_search_index(data_path or self.data_path, persist_path or self.persist_path,
+                                         self.index.value.vectorstore.embeddings, chunksize)
+        version = self.index.registry.publish(self.index.name, search_index)
+        # Old-version entries no longer match (they are scoped to the old model id);
+        # clearing just frees them. Queries still draining on the old version may
+        # add a few more, which stay unmatched until evicted.
+        if self._chain.semantic_cache is not None:
+            self._chain.semantic_cache.clear()
+        return version
+
+    def models_ready(self):
+        """False while the embedder or LLM are still loading in the background"""
+        return all(future.done() for future in self.model_futures)
+
+    def parse_query(self, question):
+        """Structured constraints in a question, resolved against the indexed values"""
+        metadata_index = self.chain.metadata_index
+        if metadata_index is None:
+            return {}
+        return parse_query(question, manufacturers=metadata_index.values("manufacturer"),
+                           components=metadata_index.values("component"))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self._chain.reranker is not None:
+            self._chain.reranker.close()
+        if self.index is not None:
+            self.index.release()
+
+
+def create_service(data_path="data/vehicle_recalls_clean.csv", persist_path="recall_faiss_index",
+                   max_concurrent_llm=None, background_models=False, chunksize=None):
+    """
+    Load the documents, embedder, index and chain and wrap them in a RecallService.
+    Models and the index come from the process-wide registry, so every service
+    on the same persist_path shares one copy (see load_search_index for how the
+    index is opened or built). With background_models=True the embedder and
+    LLM load on background threads and the service is returned straight away;
+    the first query waits for them.
+    max_concurrent_llm defaults to 4 remote calls, or one full micro-batch
+    for the local LLM backend.
+    """
+    if max_concurrent_llm is None:
+        max_concurrent_llm = MAX_BATCH_SIZE if uses_local_llm() else 4
+    if background_models:
+        loader = ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-loader")
+        embedder_future = loader.submit(get_embedder)
+        llm_future = loader.submit(get_llm)
+        loader.shutdown(wait=False)
+        embedder, llm = LazyEmbeddings(embedder_future), llm_future
+    else:
+        embedder, llm = get_embedder(), None
+
+    index = registry.acquire(f"index:{os.path.abspath(persist_path)}",
+                             lambda: load_search_index(data_path, persist_path, embedder, chunksize))
+    search_index = index.value
+
+    reranker = get_reranker()
+    if reranker is not None:
+        reranker.start_loading()
+    rag_chain = build_rag_chain_manual(search_index.vectorstore, keyword_index=search_index.keyword_index,
+                                       metadata_index=search_index.metadata_index, llm=llm, reranker=reranker,
+                                       diversifier=get_diversifier())
+    service = RecallService(rag_chain, max_concurrent_llm=max_concurrent_llm, index=index)
+    service.data_path, service.persist_path = data_path, persist_path
+    service.model_futures = [embedder_future, llm_future] if background_models else []
+    return service
@@ -0,0 +1,257 @@
+# pipeline/snapshot.py
+from array import array
+from collections.abc import Mapping
+import json
+import mmap
+import os
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from pipeline.ann_index import configure_search, enable_reconstruct
+from pipeline.metadata_index import MetadataIndex
+from pipeline.recall_categorizer import RecallRecord
+from pipeline.store_version import current_path, new_version, publish_version
+
+# Flat files of the persisted vector store; nothing here is pickled
+INDEX_FILE = "index.faiss"
+DOCS_FILE = "docs.bin"
+OFFSETS_FILE = "offsets.npy"
+IDS_FILE = "ids.npy"
+ID_ORDER_FILE = "id_order.npy"
+METADATA_INDEX_FILE = "metadata_index.npz"
+SNAPSHOT_META_FILE = "snapshot.json"
+FORMAT_FILE = "format"
+
+# Bumped when the stored documents change shape; stores of another format are rebuilt
+# (2: documents carry their display record)
+STORE_FORMAT = "2"
+
+# Map vectors straight from the file instead of copying them onto the heap
+# (IO_FLAG_MMAP_IFC covers flat indexes on faiss >= 1.10)
+FAISS_MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+
+def _encode_document(doc):
+    # The display record is stored as a list in RecallRecord field order
+    return json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}, default=str).encode("utf-8")
+
+
+def _decode_document(raw):
+    data = json.loads(raw)
+    metadata = data["metadata"]
+    metadata["record"] = RecallRecord._make(metadata["record"])
+    return Document(page_content=data["page_content"], metadata=metadata)
+
+
+class MmapDocstore:
+    """
+    Read-only docstore backed by a memory-mapped file of JSON documents.
+    Documents are decoded on demand and the id arrays are memory-mapped too,
+    so every worker process shares the same pages through the page cache.
+    """
+
+    def __init__(self, path):
+        self._file = open(os.path.join(path, DOCS_FILE), "rb")
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.path.getsize(self._file.name) else b""
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, IDS_FILE), mmap_mode="r")
+        # Sorted view of the ids for O(log n) lookups without a per-id dict
+        self._order = np.load(os.path.join(path, ID_ORDER_FILE), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, doc_id):
+        """Row number of a docstore id, or None"""
+        position = np.searchsorted(self.ids, doc_id, sorter=self._order)
+        if position < len(self._order):
+            row = int(self._order[position])
+            if self.ids[row] == doc_id:
+                return row
+        return None
+
+    def get_row(self, row):
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        return _decode_document(self._blob[start:end])
+
+    def search(self, search):
+        row = self.row(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.get_row(row)
+
+
+class RowIdMapping(Mapping):
+    """FAISS row -> docstore id view over the memory-mapped id array"""
+
+    def __init__(self, ids):
+        self._ids = ids
+
+    def __getitem__(self, row):
+        if not 0 <= row < len(self._ids):
+            raise KeyError(row)
+        return str(self._ids[row])
+
+    def __iter__(self):
+        return iter(range(len(self._ids)))
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def save_flat_store(vectorstore, path):
+    """
+    Persist a FAISS vector store as flat files: the raw FAISS index, one blob of
+    JSON documents with an offsets array, and the row -> id array.
+    Returns the closed writer; nothing is live until its publish().
+    """
+    rows = sorted(vectorstore.index_to_docstore_id)
+    ids = [vectorstore.index_to_docstore_id[row] for row in rows]
+    writer = FlatStoreWriter(path)
+    writer.add_documents(ids, [vectorstore.docstore.search(doc_id) for doc_id in ids])
+    writer.close(vectorstore.index)
+    return writer
+
+
+class FlatStoreWriter:
+    """
+    Writes the flat store files incrementally: documents are appended to the
+    blob as they come, so a corpus can be stored without holding it in memory.
+    Everything goes into a new version directory (see pipeline/store_version.py)
+    that readers only switch to on publish().
+    """
+
+    def __init__(self, persist_path):
+        self.path = new_version(persist_path)
+        self.ids = []
+        self._offsets = array("q", [0])
+        self._docs = open(os.path.join(self.path, DOCS_FILE), "wb")
+
+    def add_documents(self, doc_ids, docs):
+        for doc in docs:
+            raw = _encode_document(doc)
+            self._docs.write(raw)
+            self._offsets.append(self._offsets[-1] + len(raw))
+        self.ids.extend(doc_ids)
+
+    def close(self, index):
+        """Write the FAISS index and the id arrays into the new version"""
+        path = self.path
+        self._docs.close()
+        ids_array = np.array(self.ids, dtype=str)
+        np.save(os.path.join(path, OFFSETS_FILE), np.frombuffer(self._offsets, dtype=np.int64))
+        np.save(os.path.join(path, IDS_FILE), ids_array)
+        np.save(os.path.join(path, ID_ORDER_FILE), np.argsort(ids_array, kind="stable"))
+        faiss.write_index(index, os.path.join(path, INDEX_FILE))
+        with open(os.path.join(path, FORMAT_FILE), "w") as f:
+            f.write(STORE_FORMAT)
+
+    def publish(self):
+        """Switch readers to this version in one rename"""
+        publish_version(self.path)
+
+
+def store_format(path):
+    """Format of the flat store in a version directory, or None for stores older than the format file"""
+    format_file = os.path.join(path, FORMAT_FILE)
+    if not os.path.exists(format_file):
+        return None
+    with open(format_file) as f:
+        return f.read().strip()
+
+
+def has_flat_store(path):
+    """True when path holds a complete flat store in the current format"""
+    path = current_path(path)
+    if not all(os.path.exists(os.path.join(path, name))
+               for name in (INDEX_FILE, DOCS_FILE, OFFSETS_FILE, IDS_FILE, ID_ORDER_FILE)):
+        return False
+    if store_format(path) != STORE_FORMAT:
+        print(f"Flat store in {path} is in an older format, it will be rebuilt")
+        return False
+    return True
+
+
+def open_flat_store(path, embedder):
+    """
+    Open a persisted vector store read-only with everything memory-mapped.
+    Extra worker processes opening the same files add almost no private memory.
+    """
+    from langchain.vectorstores import FAISS
+
+    path = current_path(path)
+    try:
+        index = faiss.read_index(os.path.join(path, INDEX_FILE), FAISS_MMAP_FLAGS)
+    except RuntimeError:
+        # IVF inverted lists can only be mapped by the plain file reader
+        index = faiss.read_index(os.path.join(path, INDEX_FILE), faiss.IO_FLAG_MMAP)
+    configure_search(index)
+    enable_reconstruct(index)
+    docstore = MmapDocstore(path)
+    return FAISS(embedder, index, docstore, RowIdMapping(docstore.ids))
+
+
+def load_flat_store_for_update(path, embedder, docs_by_id):
+    """
+    Load a persisted vector store into memory so rows can be deleted and added.
+    Documents come from docs_by_id; ids no longer in it get a placeholder that
+    is about to be deleted anyway.
+    """
+    from langchain.vectorstores import FAISS
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+
+    path = current_path(path)
+    index = faiss.read_index(os.path.join(path, INDEX_FILE))
+    ids = np.load(os.path.join(path, IDS_FILE)).tolist()
+    docstore = InMemoryDocstore({
+        doc_id: docs_by_id.get(doc_id) or Document(page_content="") for doc_id in ids
+    })
+    return FAISS(embedder, index, docstore, dict(enumerate(ids)))
+
+
+def save_snapshot(vectorstore, metadata_index, persist_path, source_path=None):
+    """
+    Complete a warm-start snapshot next to the live flat store: the metadata
+    index and a fingerprint of the source CSV it was built from
+    """
+    path = current_path(persist_path)
+    # Both files are swapped in whole, since other processes may be reading this version
+    metadata_index.save(os.path.join(path, "metadata_index.tmp.npz"))
+    os.replace(os.path.join(path, "metadata_index.tmp.npz"), os.path.join(path, METADATA_INDEX_FILE))
+    # Written last: a snapshot without its meta file is treated as missing
+    with open(os.path.join(path, SNAPSHOT_META_FILE + ".tmp"), "w") as f:
+        json.dump({"document_count": len(vectorstore.index_to_docstore_id),
+                   "source": source_fingerprint(source_path)}, f)
+    os.replace(os.path.join(path, SNAPSHOT_META_FILE + ".tmp"), os.path.join(path, SNAPSHOT_META_FILE))
+
+
+def source_fingerprint(source_path):
+    if source_path is None or not os.path.exists(source_path):
+        return None
+    stat = os.stat(source_path)
+    return {"path": os.path.abspath(source_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_snapshot(persist_path, embedder, source_path=None):
+    """
+    Open a warm-start snapshot in one step, memory-mapping the FAISS index and documents.
+    Returns (vectorstore, metadata_index, document_count), or None when the snapshot
+    is missing or was built from a different version of the source CSV.
+    """
+    # Resolved once, so every file below comes from the same version
+    path = current_path(persist_path)
+    meta_file = os.path.join(path, SNAPSHOT_META_FILE)
+    if not os.path.exists(meta_file) or not has_flat_store(path):
+        return None
+    with open(meta_file) as f:
+        meta = json.load(f)
+    if source_path is not None and meta["source"] != source_fingerprint(source_path):
+        print("Snapshot is stale, source data changed")
+        return None
+
+    vectorstore = open_flat_store(path, embedder)
+    metadata_index = MetadataIndex.load(os.path.join(path, METADATA_INDEX_FILE))
+    return vectorstore, metadata_index, meta["document_count"]
@@ -0,0 +1,59 @@
+# pipeline/store_version.py
+# Versioned layout of a persisted index directory:
+#   persist_path/CURRENT     name of the live version directory
+#   persist_path/v<n>/       every file of one version
+# A new version is written into a fresh directory that no reader knows about
+# and published by replacing CURRENT with a single rename, so a reader opening
+# the store sees either all of the old files or all of the new ones.
+# One writer at a time: publishing removes version directories other than the
+# new one and the one it replaces (which readers may still be opening).
+# Directories from before this layout have no CURRENT and are read in place.
+import os
+import shutil
+import time
+
+CURRENT_FILE = "CURRENT"
+
+
+def _is_version(name):
+    return name.startswith("v") and name[1:].isdigit()
+
+
+def _current_name(persist_path):
+    try:
+        with open(os.path.join(persist_path, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_path(persist_path):
+    """Directory holding the live version's files"""
+    name = _current_name(persist_path)
+    return persist_path if name is None else os.path.join(persist_path, name)
+
+
+def new_version(persist_path):
+    """Create an empty, unpublished version directory and return its path"""
+    os.makedirs(persist_path, exist_ok=True)
+    path = os.path.join(persist_path, f"v{time.time_ns()}")
+    os.makedirs(path)
+    return path
+
+
+def publish_version(version_path):
+    """Make version_path the live version in one atomic rename"""
+    persist_path, name = os.path.split(os.path.normpath(version_path))
+    previous = _current_name(persist_path)
+    tmp_file = os.path.join(persist_path, CURRENT_FILE + ".tmp")
+    with open(tmp_file, "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, os.path.join(persist_path, CURRENT_FILE))
+
+    # Older versions and leftovers of interrupted builds; processes that already
+    # mapped their files keep reading them after the unlink
+    for entry in os.listdir(persist_path):
+        if _is_version(entry) and entry not in (name, previous):
+            shutil.rmtree(os.path.join(persist_path, entry), ignore_errors=True)
@@ -0,0 +1,270 @@
+# pipeline/tracing.py
+# Per-stage timers, counters and query traces.
+#   RECALL_TRACING=1        turn tracing on (off by default)
+#   RECALL_TRACE_LOG=path   append one JSON line per query trace (default: print it)
+#   RECALL_METRICS_PORT=n   serve the Prometheus text export on http://host:n/metrics
+#   RECALL_TRACE_QUESTIONS=1  debug only: log questions verbatim; by default a
+#                           "question" field is replaced by a short hash and its length
+# With tracing off, span() hands back one shared no-op object and count()
+# returns straight away, so instrumented code costs a function call per stage.
+from collections import deque
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_enabled = os.getenv("RECALL_TRACING", "0") == "1"
+TRACE_LOG = os.getenv("RECALL_TRACE_LOG")
+METRICS_PORT = int(os.getenv("RECALL_METRICS_PORT", "0"))
+TRACE_QUESTIONS = os.getenv("RECALL_TRACE_QUESTIONS", "0") == "1"
+
+# Histogram buckets in seconds, from a FAISS search up to a slow LLM answer
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RECENT_TRACES = 50
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        position = 0
+        while position < len(BUCKETS) and seconds > BUCKETS[position]:
+            position += 1
+        self.counts[position] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bucket bound holding the q-th quantile (coarse, for the debug panel)"""
+        if not self.count:
+            return 0.0
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+        return float("inf")
+
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_recent = deque(maxlen=RECENT_TRACES)
+_local = threading.local()
+
+
+def enabled():
+    return _enabled
+
+
+def set_enabled(flag):
+    global _enabled
+    _enabled = bool(flag)
+
+
+def observe(stage, seconds):
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+
+def count(event, value=1):
+    """Bump a counter, e.g. count("query_cache_hit")"""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[event] = _counters.get(event, 0) + value
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _redact(fields):
+    """Swap a raw question for a hash that still groups repeats, unless debug tracing asked for it"""
+    question = fields.get("question")
+    if question is None or TRACE_QUESTIONS:
+        return fields
+    question = str(fields.pop("question"))
+    fields["question_hash"] = hashlib.sha256(question.encode("utf-8")).hexdigest()[:12]
+    fields["question_chars"] = len(question)
+    return fields
+
+
+class Span:
+    """Times one stage; attaches itself to the query trace running on this thread"""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = _redact(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def set(self, **fields):
+        """Attach extra fields, e.g. span.set(documents=5)"""
+        self.fields.update(_redact(fields))
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        observe(self.name, seconds)
+        trace = getattr(_local, "trace", None)
+        if trace is not None:
+            record = {"name": self.name, "start_ms": round((self.start - trace.start) * 1000, 3),
+                      "duration_ms": round(seconds * 1000, 3), **self.fields}
+            if exc_type is not None:
+                record["error"] = exc_type.__name__
+            trace.spans.append(record)
+        return False
+
+
+class Trace(Span):
+    """Root span of one query; written as a JSON log line when it ends"""
+
+    def __enter__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.spans = []
+        _local.trace = self
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _local.trace = None
+        observe(self.name, seconds)
+        record = {"trace_id": self.trace_id, "name": self.name, "timestamp": time.time(),
+                  "duration_ms": round(seconds * 1000, 3), **self.fields, "spans": self.spans}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        with _lock:
+            _recent.append(record)
+        _write_log(record)
+        return False
+
+
+def span(name, **fields):
+    """Time a stage: with span("faiss_search", k=5): ..."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, fields)
+
+
+def timed(name, **fields):
+    """Decorator form of span(): @timed("render_answer") times every call of the function"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, **fields):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def trace(name, **fields):
+    """
+    Time a whole query and collect the spans run inside it on this thread.
+    Inside another trace it behaves like a plain span, so the outermost caller
+    (the app, the service or the chain) owns the trace.
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    if getattr(_local, "trace", None) is not None:
+        return Span(name, fields)
+    return Trace(name, fields)
+
+
+def _write_log(record):
+    line = json.dumps(record, default=str)
+    if TRACE_LOG:
+        with _lock, open(TRACE_LOG, "a") as f:
+            f.write(line + "\n")
+    else:
+        print(line)
+
+
+def recent_traces():
+    """Most recent query traces, newest last"""
+    with _lock:
+        return list(_recent)
+
+
+def stage_stats():
+    """{stage: {"count", "mean_ms", "p50_ms", "p95_ms"}} for the debug panel"""
+    with _lock:
+        return {
+            stage: {"count": h.count, "mean_ms": h.total / h.count * 1000,
+                    "p50_ms": h.quantile(0.5) * 1000, "p95_ms": h.quantile(0.95) * 1000}
+            for stage, h in sorted(_histograms.items())
+        }
+
+
+def prometheus_text():
+    """All histograms and counters in the Prometheus text exposition format"""
+    with _lock:
+        lines = ["# HELP recall_stage_seconds Time spent per pipeline stage",
+                 "# TYPE recall_stage_seconds histogram"]
+        for stage, h in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + (float("inf"),), h.counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'recall_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'recall_stage_seconds_sum{{stage="{stage}"}} {h.total}')
+            lines.append(f'recall_stage_seconds_count{{stage="{stage}"}} {h.count}')
+
+        lines += ["# HELP recall_events_total Pipeline events such as cache hits",
+                  "# TYPE recall_events_total counter"]
+        for event, value in sorted(_counters.items()):
+            lines.append(f'recall_events_total{{event="{event}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve prometheus_text() on /metrics from a daemon thread; returns the server or None"""
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving Prometheus metrics on :{port}/metrics")
+    return server
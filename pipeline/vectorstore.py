@@ -1,23 +1,310 @@
 # vectorstore.py
-from langchain.vectorstores import FAISS
+import hashlib
+import json
 import os
 
-def build_vectorstore(docs, embedder, persist_path="recall_faiss_index"):
-    
-    if os.path.exists(persist_path):
-        print(f"Loading cached FAISS index from {persist_path}")
-        vectorstore = FAISS.load_local(
-            persist_path, 
-            embedder, 
-            allow_dangerous_deserialization=True
-        ) # Loading the embedder
-
-            
-    else:
+import numpy as np
+
+from pipeline.analytics import (ANALYTICS_CUBE_FILE, count_cube, finish_cube, merge_cubes,
+                                save_analytics_cube, save_cube)
+from pipeline.ann_index import (INDEX_TYPE, INDEX_TYPES, IndexBuilder, build_ann_index, check_index_type,
+                                reconstruct_rows)
+from pipeline.data_loader import count_rows, iter_documents
+from pipeline.keyword_index import KEYWORD_INDEX_FILE, KeywordIndexBuilder, save_keyword_index
+from pipeline.snapshot import (FlatStoreWriter, has_flat_store, load_flat_store_for_update,
+                               open_flat_store, save_flat_store)
+from pipeline.store_version import current_path
+
+MANIFEST_FILE = "manifest.json"
+
+
+def document_ids(docs, seen=None):
+    """
+    Stable docstore ids keyed by nhtsa_id (repeated ids get a #n suffix).
+    Pass the same seen dict for every chunk when ids are assigned chunk by chunk.
+    """
+    seen = {} if seen is None else seen
+    ids = []
+    for doc in docs:
+        nhtsa_id = str(doc.metadata.get("nhtsa_id", "Unknown"))
+        count = seen.get(nhtsa_id, 0)
+        seen[nhtsa_id] = count + 1
+        ids.append(nhtsa_id if count == 0 else f"{nhtsa_id}#{count}")
+    return ids
+
+
+def content_hash(doc):
+    """Hash of everything that ends up in the index for one document"""
+    payload = doc.page_content + "\x00" + json.dumps(doc.metadata, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_manifest(persist_path):
+    """Read the id -> content hash manifest of the live index version"""
+    manifest_file = os.path.join(current_path(persist_path), MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(version_path, hashes, index_type="flat"):
+    """
+    Write the manifest into an unpublished version directory, so it goes live
+    in the same rename as the store it describes
+    """
+    manifest_file = os.path.join(version_path, MANIFEST_FILE)
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"hashes": hashes, "index_type": index_type}, f)
+    os.replace(tmp_file, manifest_file)
+
+
+def diff_manifest(old_hashes, new_hashes):
+    """Return (ids to add, ids to delete) between two manifests"""
+    added = [i for i, h in new_hashes.items() if old_hashes.get(i) != h]
+    removed = [i for i, h in old_hashes.items() if new_hashes.get(i) != h]
+    return added, removed
+
+
+def build_vectorstore_parallel(docs, embedder, ids, workers=None, batch_size=256):
+    """
+    Build the index from scratch with multi-process embedding.
+    Texts already in the embedding cache are not sent to the workers, and the
+    vectors the workers return are written back to the cache. Vectors go into
+    the index batch by batch in document order as the workers return them, so
+    only the batches in flight are held outside the index.
+    """
+    from langchain.vectorstores import FAISS
+    from pipeline.embedder import MODEL_NAME, CachedEmbeddings
+    from pipeline.parallel_embedder import embed_documents_parallel
+
+    texts = [doc.page_content for doc in docs]
+    cache = embedder if isinstance(embedder, CachedEmbeddings) and embedder.model_name == MODEL_NAME else None
+    missing = cache.missing(texts) if cache is not None else list(range(len(docs)))
+    print(f"{len(docs) - len(missing)} of {len(docs)} texts come from the embedding cache")
+
+    def embedded():
+        """Worker vectors for the missing rows, in row order"""
+        if not missing:
+            return
+        for start, batch in embed_documents_parallel([docs[i] for i in missing], MODEL_NAME, workers, batch_size):
+            if cache is not None:
+                cache.store([texts[i] for i in missing[start:start + len(batch)]], batch)
+            yield from batch
+
+    fresh = embedded()
+    to_embed = set(missing)
+    vectorstore = None
+    for start in range(0, len(docs), batch_size):
+        rows = range(start, min(start + batch_size, len(docs)))
+        cached_rows = [i for i in rows if i not in to_embed]
+        cached = dict(zip(cached_rows, cache.lookup([texts[i] for i in cached_rows]))) if cached_rows else {}
+        text_embeddings = []
+        for i in rows:
+            vector = next(fresh) if i in to_embed else cached[i]
+            if vector is None:
+                # Evicted since the check above, by vectors stored during this build
+                vector = embedder.embed_documents([texts[i]])[0]
+            text_embeddings.append((texts[i], np.asarray(vector, dtype=np.float32).tolist()))
+        metadatas = [doc.metadata for doc in docs[start:start + batch_size]]
+        batch_ids = ids[start:start + batch_size]
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(text_embeddings, embedder, metadatas=metadatas, ids=batch_ids)
+        else:
+            vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=batch_ids)
+    # Every vector is in; this lets the worker pool shut down and report its throughput
+    next(fresh, None)
+    return vectorstore
+
+
+def build_vectorstore(docs, embedder, persist_path="recall_faiss_index", workers=1, batch_size=256,
+                      index_type=None):
+    """
+    Build or update the recall index and return it opened read-only from disk.
+    The index is persisted as flat files (see pipeline/snapshot.py) that are
+    memory-mapped on load instead of unpickled into every process.
+    index_type is flat, ivfpq or hnsw (default: RECALL_INDEX_TYPE, see pipeline/ann_index.py).
+    """
+    from langchain.vectorstores import FAISS
+
+    index_type = check_index_type(index_type)
+    ids = document_ids(docs)
+    hashes = {i: content_hash(doc) for i, doc in zip(ids, docs)}
+    manifest = load_manifest(persist_path) if has_flat_store(persist_path) else None
+
+    if manifest is not None and manifest.get("index_type", "flat") != index_type:
+        print(f"Index type changed from {manifest.get('index_type', 'flat')} to {index_type}, rebuilding")
+        manifest = None
+
+    if manifest is not None:
+        # Only re-embed what changed since the index was saved
+        added, removed = diff_manifest(manifest["hashes"], hashes)
+        if (added or removed) and index_type != "flat":
+            # IVF row ids are not compacted on delete and HNSW cannot delete at all,
+            # so approximate indexes are retrained (unchanged texts hit the embedding cache)
+            print(f"{len(added)} new/changed, {len(removed)} removed/replaced, rebuilding {index_type} index")
+            manifest = None
+        elif added or removed:
+            print(f"Updating FAISS index: {len(added)} new/changed, {len(removed)} removed/replaced")
+            by_id = dict(zip(ids, docs))
+            vectorstore = load_flat_store_for_update(persist_path, embedder, by_id)
+            if removed:
+                vectorstore.delete(removed)
+            if added:
+                vectorstore.add_documents([by_id[i] for i in added], ids=added)
+            writer = save_flat_store(vectorstore, persist_path)
+            save_keyword_index(docs, ids, writer.path)
+            save_analytics_cube(docs, writer.path)
+            save_manifest(writer.path, hashes, index_type)
+            writer.publish()
+        else:
+            print("FAISS index is up to date")
+            # Stores from before the keyword index and cube existed get them added in place
+            live_path = current_path(persist_path)
+            if not os.path.exists(os.path.join(live_path, KEYWORD_INDEX_FILE)):
+                save_keyword_index(docs, ids, live_path)
+            if not os.path.exists(os.path.join(live_path, ANALYTICS_CUBE_FILE)):
+                save_analytics_cube(docs, live_path)
+
+    if manifest is None:
+        # No manifest means there is no index yet or it predates the flat file format
         print("Creating FAISS index from scratch")
-        vectorstore = FAISS.from_documents(docs, embedder) # Creating index from scratch
-        
-        vectorstore.save_local(persist_path) # Saving the vector store
+        if workers != 1:
+            vectorstore = build_vectorstore_parallel(docs, embedder, ids, workers, batch_size)
+        else:
+            vectorstore = FAISS.from_documents(docs, embedder, ids=ids) # Creating index from scratch
+
+        if index_type != "flat":
+            # Train the approximate index on the exact vectors, keeping row order
+            flat = vectorstore.index
+            vectorstore.index = build_ann_index(flat.reconstruct_n(0, flat.ntotal), index_type)
+
+        writer = save_flat_store(vectorstore, persist_path) # Saving the vector store
+        save_keyword_index(docs, ids, writer.path) # BM25 index over the same texts
+        save_analytics_cube(docs, writer.path) # Corpus-wide counts for the dashboard
+        save_manifest(writer.path, hashes, index_type)
+        writer.publish() # Store, indexes and manifest go live together
         print(f"FAISS index saved at {persist_path}")
-        
-    return vectorstore
\ No newline at end of file
+
+    print(f"Loading FAISS index from {persist_path} (memory-mapped)")
+    return open_flat_store(persist_path, embedder)
+
+
+def _stored_or_embedded(docs, doc_ids, doc_hashes, embedder, live, live_hashes):
+    """
+    Vectors for one batch: documents unchanged since the live version are copied
+    out of its index, only new or changed ones are embedded
+    """
+    reused = [i for i, (doc_id, doc_hash) in enumerate(zip(doc_ids, doc_hashes))
+              if live is not None and live_hashes.get(doc_id) == doc_hash]
+    rows = [live.docstore.row(doc_ids[i]) for i in reused]
+    if None in rows:
+        reused, rows = [], []
+    fresh = sorted(set(range(len(docs))) - set(reused))
+
+    vectors = [None] * len(docs)
+    if reused:
+        for i, vector in zip(reused, reconstruct_rows(live.index, rows)):
+            vectors[i] = vector
+    if fresh:
+        for i, vector in zip(fresh, embedder.embed_documents([docs[i].page_content for i in fresh])):
+            vectors[i] = vector
+    return np.asarray(vectors, dtype=np.float32), len(fresh)
+
+
+def build_vectorstore_from_csv(data_path, embedder, persist_path="recall_faiss_index", chunksize=10_000,
+                               batch_size=256, index_type=None):
+    """
+    Streaming version of load_data + build_vectorstore for corpora that do not
+    fit in memory. The CSV is read chunksize rows at a time, and each chunk is
+    turned into documents, embedded batch by batch and appended to the index,
+    the document blob, the BM25 postings and the analytics cube before the next
+    chunk is read. Only the FAISS index stays in memory: every vector for flat
+    and HNSW (plus the graph), the compressed codes and re-rank vectors for
+    IVF-PQ, which is trained on the first rows and then filled chunk by chunk
+    (see IndexBuilder).
+    When the source changes, recalls whose text is unchanged take their vectors
+    from the live flat or HNSW index instead of being embedded again.
+    """
+    index_type = check_index_type(index_type)
+
+    manifest = load_manifest(persist_path) if has_flat_store(persist_path) else None
+    live, live_hashes, expected_rows = None, {}, None
+    if manifest is not None and manifest.get("index_type", "flat") == index_type:
+        # A hashing pass is much cheaper than embedding, and skips the rebuild when nothing changed
+        seen, hashes = {}, {}
+        for docs in iter_documents(data_path, chunksize):
+            hashes.update((i, content_hash(doc)) for i, doc in zip(document_ids(docs, seen), docs))
+        if hashes == manifest["hashes"]:
+            print("FAISS index is up to date")
+            return open_flat_store(persist_path, embedder)
+        expected_rows = len(hashes)
+        if index_type != "ivfpq":
+            # IVF-PQ may keep only approximate vectors (sq8 or no re-rank), so it re-embeds
+            # (through the embedding cache)
+            live, live_hashes = open_flat_store(persist_path, embedder), manifest["hashes"]
+        print("Source data changed, re-ingesting")
+    if expected_rows is None and index_type == "ivfpq":
+        expected_rows = count_rows(data_path)
+
+    print(f"Ingesting {data_path} in chunks of {chunksize} rows")
+    writer = FlatStoreWriter(persist_path)
+    index = IndexBuilder(index_type, expected_rows or 0)
+    keywords = KeywordIndexBuilder()
+    cube = None
+    seen, hashes = {}, {}
+    embedded = 0
+    for docs in iter_documents(data_path, chunksize):
+        ids = document_ids(docs, seen)
+        doc_hashes = [content_hash(doc) for doc in docs]
+        for start in range(0, len(docs), batch_size):
+            end = start + batch_size
+            vectors, fresh = _stored_or_embedded(docs[start:end], ids[start:end], doc_hashes[start:end],
+                                                 embedder, live, live_hashes)
+            index.add(vectors)
+            writer.add_documents(ids[start:end], docs[start:end])
+            embedded += fresh
+        keywords.add([doc.page_content for doc in docs], ids)
+        cube = merge_cubes(cube, count_cube(docs))
+        hashes.update(zip(ids, doc_hashes))
+        print(f"Ingested {len(writer.ids)} documents ({embedded} embedded)")
+
+    if not writer.ids:
+        raise ValueError(f"No recalls found in {data_path}")
+
+    writer.close(index.finish())
+    keywords.finish().save(os.path.join(writer.path, KEYWORD_INDEX_FILE))
+    save_cube(finish_cube(cube), writer.path)
+    save_manifest(writer.path, hashes, index_type)
+    writer.publish()
+    print(f"FAISS index saved at {persist_path}")
+    return open_flat_store(persist_path, embedder)
+
+
+if __name__ == "__main__":
+    # Offline index build, e.g. python -m pipeline.vectorstore --workers 32
+    import argparse
+
+    from pipeline.data_loader import load_data
+    from pipeline.embedder import get_embedder
+
+    parser = argparse.ArgumentParser(description="Build the recall FAISS index")
+    parser.add_argument("--data", default="data/vehicle_recalls_clean.csv")
+    parser.add_argument("--persist-path", default="recall_faiss_index")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="embedding worker processes (0 = one per core)")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE,
+                        help="FAISS index type (default from RECALL_INDEX_TYPE)")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="stream the CSV this many rows at a time (single process, bounded memory)")
+    args = parser.parse_args()
+
+    if args.chunksize:
+        build_vectorstore_from_csv(args.data, get_embedder(), args.persist_path, chunksize=args.chunksize,
+                                   batch_size=args.batch_size, index_type=args.index_type)
+    else:
+        build_vectorstore(load_data(args.data), get_embedder(), args.persist_path,
+                          workers=args.workers or None, batch_size=args.batch_size,
+                          index_type=args.index_type)
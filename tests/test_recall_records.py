@@ -0,0 +1,53 @@
+# tests/test_recall_records.py
+import faiss
+import pandas as pd
+
+from pipeline.data_loader import load_data
+from pipeline.recall_categorizer import (RecallRecord, categorize_recall, format_recall_date, get_record,
+                                         get_recall_severity)
+from pipeline.snapshot import FlatStoreWriter, MmapDocstore
+
+
+CSV = """nhtsa_id,report_received_date,manufacturer,component,subject,defect_summary,consequence_summary,\
+corrective_action,potentially_affected,recall_type,do_not_drive,fire_risk_when_parked,year,year_month
+24V001000,2024-01-15,Ford Motor Company,SERVICE BRAKES,Brake hose,The brake hose may crack.  ,\
+Increased risk of crash.,Dealers will replace the hose.,1200,Vehicle,No,No,2024,2024-01
+24V002000,,Tesla Inc.,AIR BAGS,Air bag,The air bag may not deploy causing INJURY.,,,15,Vehicle,No,No,2024,2024-02
+"""
+
+
+def expected_record(row):
+    """The display record for one CSV row, as load_data should build it"""
+    row = row.fillna("Unknown")
+    return RecallRecord(
+        nhtsa_id=str(row["nhtsa_id"]),
+        manufacturer=str(row["manufacturer"]),
+        component=str(row["component"]),
+        summary=str(row["defect_summary"]).strip(),
+        consequence=str(row["consequence_summary"]).strip(),
+        action=str(row["corrective_action"]).strip(),
+        category=categorize_recall(row["component"], row["defect_summary"]),
+        severity=get_recall_severity(row["defect_summary"], row["component"]),
+        recall_date=str(row["report_received_date"]),
+        formatted_date=format_recall_date(str(row["report_received_date"])),
+    )
+
+
+def test_stored_records_match_csv(tmp_path):
+    csv_path = tmp_path / "recalls.csv"
+    csv_path.write_text(CSV)
+    expected = [expected_record(row) for _, row in pd.read_csv(csv_path).iterrows()]
+
+    docs = load_data(str(csv_path))
+    assert [get_record(doc) for doc in docs] == expected
+
+    writer = FlatStoreWriter(str(tmp_path / "index"))
+    writer.add_documents([record.nhtsa_id for record in expected], docs)
+    writer.close(faiss.IndexFlatL2(4))
+    docstore = MmapDocstore(writer.path)
+    stored = [get_record(docstore.get_row(row)) for row in range(len(docstore))]
+
+    assert stored == expected
+    assert all(isinstance(record, RecallRecord) for record in stored)
+    # Missing CSV cells stay "Unknown" after the round trip
+    assert stored[1].consequence == "Unknown" and stored[1].action == "Unknown"